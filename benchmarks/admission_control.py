@@ -0,0 +1,180 @@
+"""
+Адаптивный контроль допуска (app/core/admission.py) при замедлении БД — за шлюзом.
+
+Две реплики Users (два in-process стенда benchmarks/inprocess.py), каждому SQL-запросу
+добавляется --db-delay мс (медленный Postgres). Перед ними — UpstreamGateway, повторяющий
+политику nginx из nginx/proxy_upstream.conf: least_conn, proxy_next_upstream_tries 2,
+max_fails=3 fail_timeout=10s. --list-clients клиентов без пауз читают список GET /users/,
+--point-clients — GET /users/{id} (так Orders проверяет пользователя).
+
+Режимы:
+  * no_admission  — ADMISSION_ENABLED=0 (как раньше);
+  * retry_503     — admission включён, но шлюз считает 503 отказом реплики
+                    (proxy_next_upstream ... http_503, как было): отклонённый запрос
+                    повторяется на соседней реплике, а после max_fails реплика выпадает
+                    из пула — перегрузка переезжает на соседа, потом 502 у всех;
+  * admission     — admission включён, 503 отдаётся клиенту вместе с Retry-After
+                    (текущий конфиг).
+По каждому классу — успешные ответы, 503, 502, таймауты клиента (--timeout) и задержки;
+по шлюзу — повторы, выводы реплик из пула и отказы «no live upstreams».
+После 503 клиент ждёт Retry-After, как вежливый вызывающий сервис.
+
+Пример:
+    python benchmarks/admission_control.py --db-delay 20 --list-clients 100 --point-clients 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from contextlib import AsyncExitStack
+from pathlib import Path
+
+import httpx
+from sqlalchemy import event
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from e2e_flow import _latency_summary  # noqa: E402
+from inprocess import GATEWAY_URL, InProcessCluster  # noqa: E402
+
+# Режим → (ADMISSION_ENABLED, 503 в proxy_next_upstream)
+MODES = {
+    "no_admission": (False, True),
+    "retry_503": (True, True),
+    "admission": (True, False),
+}
+REPLICAS = 2
+# Пауза клиента после 502: у него нет Retry-After
+BAD_GATEWAY_PAUSE = 0.1
+
+
+class UpstreamGateway(httpx.AsyncBaseTransport):
+    """Шлюз перед репликами одного сервиса с пассивными health checks, как upstream в nginx."""
+
+    def __init__(self, apps: list, next_upstream_503: bool, max_fails: int = 3,
+                 fail_timeout: float = 10.0, tries: int = 2):
+        self._replicas = [
+            {"transport": httpx.ASGITransport(app=app, raise_app_exceptions=False, client=("127.0.0.1", 0)),
+             "active": 0, "fails": [], "down_until": 0.0}
+            for app in apps
+        ]
+        self._failures = {502, 504} | ({503} if next_upstream_503 else set())
+        self._max_fails = max_fails
+        self._fail_timeout = fail_timeout
+        self._tries = tries
+        self.stats = {"requests": [0] * len(apps), "retries": 0, "marked_down": 0, "no_live_upstreams": 0}
+
+    def _fail(self, replica: dict, now: float):
+        replica["fails"] = [t for t in replica["fails"] if t > now - self._fail_timeout] + [now]
+        if len(replica["fails"]) >= self._max_fails:
+            replica["down_until"] = now + self._fail_timeout
+            replica["fails"] = []
+            self.stats["marked_down"] += 1
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        tried, response = set(), None
+        for _ in range(self._tries):
+            now = time.monotonic()
+            live = [i for i, r in enumerate(self._replicas) if i not in tried and r["down_until"] <= now]
+            if not live:
+                break
+            if response is not None:
+                # Следующая попытка на другой реплике: прошлый ответ клиенту не уйдёт
+                await response.aclose()
+                self.stats["retries"] += 1
+            index = min(live, key=lambda i: self._replicas[i]["active"])  # least_conn
+            replica = self._replicas[index]
+            tried.add(index)
+            self.stats["requests"][index] += 1
+            replica["active"] += 1
+            try:
+                response = await replica["transport"].handle_async_request(request)
+            finally:
+                replica["active"] -= 1
+            if response.status_code not in self._failures:
+                return response
+            self._fail(replica, time.monotonic())
+        if response is None:
+            self.stats["no_live_upstreams"] += 1
+            return httpx.Response(502, json={"detail": "no live upstreams"}, request=request)
+        return response
+
+
+async def _client_loop(client: httpx.AsyncClient, path: str, deadline: float, timeout: float, stats: dict):
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            response = await asyncio.wait_for(client.get(path), timeout)
+            outcome = str(response.status_code)
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+        elapsed = time.perf_counter() - started
+        stats["outcomes"][outcome] = stats["outcomes"].get(outcome, 0) + 1
+        if outcome == "200":
+            stats["latencies"].append(elapsed)
+        elif outcome == "503":
+            # Вежливый клиент: повтор не раньше Retry-After
+            await asyncio.sleep(float(response.headers.get("retry-after", 1)))
+        elif outcome == "502":
+            await asyncio.sleep(BAD_GATEWAY_PAUSE)
+
+
+async def run_mode(args, mode: str) -> dict:
+    admission, next_upstream_503 = MODES[mode]
+    os.environ["ADMISSION_ENABLED"] = "1" if admission else "0"
+    delay = args.db_delay / 1000
+
+    def _slow(*_):
+        time.sleep(delay)
+
+    async with AsyncExitStack() as stack:
+        replicas = [await stack.enter_async_context(InProcessCluster(args.database_url)) for _ in range(REPLICAS)]
+        for cluster in replicas:
+            event.listen(cluster.modules["users"]["app.db.database"].engine, "before_cursor_execute", _slow)
+        gateway = UpstreamGateway([cluster.apps["users"] for cluster in replicas], next_upstream_503)
+        client = await stack.enter_async_context(httpx.AsyncClient(transport=gateway, base_url=GATEWAY_URL))
+
+        stats = {cls: {"outcomes": {}, "latencies": []} for cls in ("list", "point")}
+        deadline = time.perf_counter() + args.duration
+        await asyncio.gather(
+            *(_client_loop(client, "/api/v1/users/?limit=20", deadline, args.timeout, stats["list"])
+              for _ in range(args.list_clients)),
+            *(_client_loop(client, "/api/v1/users/1", deadline, args.timeout, stats["point"])
+              for _ in range(args.point_clients)),
+        )
+        final_limits = None
+        if admission:
+            final_limits = [
+                round(cluster.modules["users"]["app.core.admission"].ADMISSION_LIMIT._value.get(), 1)
+                for cluster in replicas
+            ]
+
+    report = {"mode": mode, "final_limits": final_limits, "gateway": gateway.stats}
+    for cls, data in stats.items():
+        total = sum(data["outcomes"].values())
+        report[cls] = {
+            "requests": total,
+            "ok_per_second": round(data["outcomes"].get("200", 0) / args.duration, 1),
+            "outcomes": data["outcomes"],
+            **_latency_summary(sorted(data["latencies"])),
+        }
+    return report
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="шаблон URL БД с {service}; по умолчанию SQLite во временном каталоге")
+    parser.add_argument("--db-delay", type=float, default=20.0, help="задержка каждого SQL-запроса Users, мс")
+    parser.add_argument("--list-clients", type=int, default=100)
+    parser.add_argument("--point-clients", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--timeout", type=float, default=5.0, help="таймаут клиента, с")
+    parser.add_argument("--modes", default=",".join(MODES), help=f"через запятую из: {', '.join(MODES)}")
+    args = parser.parse_args()
+    report = [await run_mode(args, mode) for mode in args.modes.split(",")]
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,225 @@
+"""
+Микробенчмарки CRUD-функций по отдельности (без HTTP и межсервисных вызовов) с порогом регрессии.
+
+Функции:
+  * orders.get_order, orders.get_orders на нескольких глубинах skip (--depths),
+    orders.update_order_status, сериализация страницы OrderInDB (как response_model);
+  * users.hash_password и users.create_user (вместе с хешированием);
+  * payments.delete_payment_by_order_id (строка для удаления вставляется вне замера).
+
+БД засевается перед прогоном: локальный Postgres (шаблон --database-url с {service},
+таблицы должны быть пустыми) или по умолчанию SQLite во временном каталоге.
+Замер — время одного вызова (сессия создаётся вне замера, как get_db на запрос);
+в отчёте медиана и p95 в микросекундах.
+
+Регрессии: --baseline сравнивает медианы с сохранённым прогоном (--output), процесс
+завершается с кодом 1, если какая-то функция медленнее больше чем на --max-regression %
+(для отдельных функций — --threshold name=pct).
+
+Пример:
+    python benchmarks/crud_micro.py --output baseline.json
+    python benchmarks/crud_micro.py --baseline baseline.json --max-regression 15 \\
+        --threshold users.create_user=30
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List
+
+from pydantic import TypeAdapter
+from sqlalchemy import insert
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from inprocess import load_service  # noqa: E402
+
+
+def _percentile(sorted_values, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def parse_thresholds(value: str) -> dict:
+    """"users.create_user=30,orders.get_order=10" → {"users.create_user": 30.0, ...}."""
+    thresholds = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, pct = item.partition("=")
+        thresholds[name] = float(pct)
+    return thresholds
+
+
+def measure(call, session_factory, repeat: int, warmup: int, setup=None) -> dict:
+    """call(db, state) замеряется; setup(i) и создание/закрытие сессии — вне замера."""
+    timings = []
+    for i in range(warmup + repeat):
+        state = setup(i) if setup is not None else None
+        db = session_factory()
+        try:
+            started = time.perf_counter()
+            call(db, state)
+            elapsed = time.perf_counter() - started
+        finally:
+            db.close()
+        if i >= warmup:
+            timings.append(elapsed)
+
+    timings.sort()
+    return {
+        "repeat": repeat,
+        "median_us": round(statistics.median(timings) * 1e6, 1),
+        "p95_us": round(_percentile(timings, 0.95) * 1e6, 1),
+        "min_us": round(timings[0] * 1e6, 1),
+    }
+
+
+def _seed(modules: dict, orders: int, payments: int):
+    now = datetime(2025, 1, 1, 12, 0, 0)
+    for service, model_module, model, rows in (
+        ("orders", "app.models.order", "Order", [
+            {"user_id": i % 500 + 1, "status": "pending", "total_amount": 100.5 + i,
+             "created_at": now + timedelta(seconds=i)}
+            for i in range(orders)
+        ]),
+        ("payments", "app.models.payment", "Payment", [
+            {"order_id": i + 1, "amount": 100.5 + i, "status": "success", "method": "card",
+             "created_at": now + timedelta(seconds=i)}
+            for i in range(payments)
+        ]),
+        ("users", "app.models.user", "User", []),
+    ):
+        database = modules[service]["app.db.database"]
+        database.Base.metadata.create_all(database.engine)
+        if rows:
+            with database.engine.begin() as conn:
+                conn.execute(insert(getattr(modules[service][model_module], model)), rows)
+
+
+def run(args) -> dict:
+    modules = {service: load_service(service)[1] for service in ("orders", "users", "payments")}
+    _seed(modules, args.orders, args.orders)
+
+    orders = modules["orders"]["app.crud.orders"]
+    users = modules["users"]["app.crud.users"]
+    payments = modules["payments"]["app.crud.payments"]
+    orders_session = modules["orders"]["app.db.database"].SessionLocal
+    users_session = modules["users"]["app.db.database"].SessionLocal
+    payments_session = modules["payments"]["app.db.database"].SessionLocal
+    Payment = modules["payments"]["app.models.payment"].Payment
+    UserCreate = modules["users"]["app.schemas.user"].UserCreate
+    OrderInDB = modules["orders"]["app.schemas.order"].OrderInDB
+
+    rng = random.Random(args.seed)
+    repeat, warmup = args.repeat, args.warmup
+    # bcrypt намеренно медленный — для него меньше повторов
+    slow_repeat = max(5, repeat // 10)
+    results = {}
+
+    results["orders.get_order"] = measure(
+        lambda db, _: orders.get_order(db, rng.randint(1, args.orders)), orders_session, repeat, warmup)
+
+    for depth in args.depths:
+        results[f"orders.get_orders[skip={depth}]"] = measure(
+            lambda db, _, skip=depth: orders.get_orders(db, skip=skip, limit=args.limit),
+            orders_session, repeat, warmup)
+
+    statuses = ("pending", "paid", "shipped", "delivered")
+    results["orders.update_order_status"] = measure(
+        lambda db, _: orders.update_order_status(db, rng.randint(1, args.orders), rng.choice(statuses)),
+        orders_session, repeat, warmup)
+
+    adapter = TypeAdapter(List[OrderInDB])
+    with orders_session() as db:
+        page = orders.get_orders(db, skip=0, limit=args.limit)
+    results[f"orders.serialize_OrderInDB[{args.limit}]"] = measure(
+        lambda db, _: adapter.dump_json(adapter.validate_python(page, from_attributes=True)),
+        orders_session, repeat, warmup)
+
+    results["users.hash_password"] = measure(
+        lambda db, _: users.hash_password("benchmark-password"), users_session, slow_repeat, 1)
+
+    run_id = f"{os.getpid()}-{time.time_ns()}"
+    results["users.create_user"] = measure(
+        lambda db, i: users.create_user(db, i), users_session, slow_repeat, 1,
+        setup=lambda i: UserCreate(full_name="Бенчмарк", email=f"bench-{run_id}-{i}@example.com",
+                                   password="benchmark-password"))
+
+    # Удаляем платёж по order_id вне засеянного диапазона — строку вставляем перед каждым замером
+    next_order_id = iter(range(args.orders + 1, args.orders + 1 + warmup + repeat))
+
+    def insert_payment(_):
+        order_id = next(next_order_id)
+        with payments_session() as db:
+            db.add(Payment(order_id=order_id, amount=1.0, status="success", method="card"))
+            db.commit()
+        return order_id
+
+    results["payments.delete_payment_by_order_id"] = measure(
+        lambda db, order_id: payments.delete_payment_by_order_id(db, order_id),
+        payments_session, repeat, warmup, setup=insert_payment)
+
+    return results
+
+
+def find_regressions(baseline: dict, results: dict, max_regression: float, thresholds: dict) -> dict:
+    regressions = {}
+    for name, current in results.items():
+        before = baseline.get("results", {}).get(name)
+        if not before or not before["median_us"]:
+            continue
+        change = (current["median_us"] - before["median_us"]) / before["median_us"] * 100
+        limit = thresholds.get(name, max_regression)
+        current["change_pct"] = round(change, 1)
+        if change > limit:
+            regressions[name] = {"before_us": before["median_us"], "after_us": current["median_us"],
+                                 "change_pct": round(change, 1), "threshold_pct": limit}
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="шаблон URL БД с {service}; по умолчанию SQLite во временном каталоге")
+    parser.add_argument("--orders", type=int, default=50_000, help="засеваемых заказов (и платежей)")
+    parser.add_argument("--depths", type=lambda v: [int(x) for x in v.split(",")], default=[0, 1_000, 10_000, 40_000])
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="сохранить результаты (для будущего --baseline)")
+    parser.add_argument("--baseline", help="результаты прошлого прогона")
+    parser.add_argument("--max-regression", type=float, default=20.0, help="допустимый рост медианы, %%")
+    parser.add_argument("--threshold", type=parse_thresholds, default={}, help="пороги по функциям: name=pct,...")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="microlab-bench-") as tmpdir:
+        database_url = args.database_url or f"sqlite:///{tmpdir}/{{service}}.db"
+        for service in ("users", "orders", "payments"):
+            os.environ[f"{service.upper()}_DATABASE_URL"] = database_url.format(service=service)
+        os.environ.setdefault("LOG_LEVEL", "WARNING")
+        os.environ.setdefault("TRACE_SAMPLE_RATIO", "0")
+        report = {"config": {"orders": args.orders, "limit": args.limit, "repeat": args.repeat,
+                             "database": "custom" if args.database_url else "sqlite"},
+                  "results": run(args)}
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            report["regressions"] = find_regressions(json.load(f), report["results"],
+                                                     args.max_regression, args.threshold)
+        exit_code = 1 if report["regressions"] else 0
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""
+SSE-поток статусов доставки (GET /delivery/{id}/events) под нагрузкой подписчиков.
+
+Открывает --subscribers потоков (по умолчанию 10 000) на --deliveries доставок, затем
+делает --updates изменений (PUT /delivery/{id}, адрес bench-<n>) с частотой --rate и
+замеряет задержку от начала PUT до получения события каждым подписчиком этой доставки.
+Для сравнения выводится нагрузка, которую те же клиенты создавали бы опросом GET
+раз в --poll-interval секунд.
+
+Режимы:
+  * asgi — in-process стенд (benchmarks/inprocess.py, SQLite): каждый подписчик — вызов
+    ASGI-приложения delivery со всем стеком middleware, без сокетов (httpx.ASGITransport
+    буферизует ответ целиком и для потоков не годится). Рассылка — внутри процесса.
+  * http — работающий стенд (--base-url шлюза delivery): настоящие HTTP-соединения,
+    рассылка между воркерами через LISTEN/NOTIFY. Изменяет адреса выбранных доставок;
+    для 10 000 соединений поднимите лимит дескрипторов (ulimit -n).
+
+Примеры:
+    python benchmarks/delivery_stream.py --subscribers 10000 --updates 500 --rate 100
+    python benchmarks/delivery_stream.py --mode http --base-url http://localhost/api/v1/delivery \\
+        --subscribers 10000 --deliveries 500
+"""
+import argparse
+import asyncio
+import json
+import random
+import resource
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from e2e_flow import _latency_summary  # noqa: E402
+from inprocess import InProcessCluster, _create_user_and_order  # noqa: E402
+
+MARKER = "bench-"
+
+
+class Subscriber:
+    """Разбирает SSE-поток и записывает задержки событий бенчмарка."""
+
+    def __init__(self, delivery_id: int, sent: dict, latencies: list):
+        self.delivery_id = delivery_id
+        self.sent = sent
+        self.latencies = latencies
+        self.snapshot = asyncio.Event()
+        self._buffer = b""
+
+    def feed(self, chunk: bytes):
+        self._buffer += chunk
+        *events, self._buffer = self._buffer.split(b"\n\n")
+        for raw in events:
+            for line in raw.split(b"\n"):
+                if not line.startswith(b"data: "):
+                    continue
+                address = json.loads(line[6:])["address"]
+                if address.startswith(MARKER):
+                    sent_at = self.sent.get(int(address[len(MARKER):]))
+                    if sent_at is not None:
+                        self.latencies.append(time.perf_counter() - sent_at)
+                self.snapshot.set()
+
+
+def _rss_mb() -> float:
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+async def _subscribe_asgi(app, subscriber: Subscriber, stop: asyncio.Event):
+    path = f"/api/v1/delivery/{subscriber.delivery_id}/events"
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "", "query_string": b"",
+        "headers": [(b"host", b"bench"), (b"accept", b"text/event-stream")],
+        "server": ("bench", 80), "client": ("127.0.0.1", 0),
+    }
+    request_sent = False
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await stop.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.body":
+            subscriber.feed(message.get("body", b""))
+
+    await app(scope, receive, send)
+
+
+async def _subscribe_http(client: httpx.AsyncClient, subscriber: Subscriber, stop: asyncio.Event):
+    async with client.stream("GET", f"/{subscriber.delivery_id}/events") as response:
+        response.raise_for_status()
+        reader = asyncio.ensure_future(_read_stream(response, subscriber))
+        await stop.wait()
+        reader.cancel()
+
+
+async def _read_stream(response: httpx.Response, subscriber: Subscriber):
+    async for chunk in response.aiter_raw():
+        subscriber.feed(chunk)
+
+
+async def _run(args, subscribe, update, delivery_ids: list) -> dict:
+    sent, latencies = {}, []
+    subscribers = [Subscriber(random.choice(delivery_ids), sent, latencies) for _ in range(args.subscribers)]
+    per_delivery = {}
+    for subscriber in subscribers:
+        per_delivery[subscriber.delivery_id] = per_delivery.get(subscriber.delivery_id, 0) + 1
+
+    stop = asyncio.Event()
+    rss_before = _rss_mb()
+    started = time.perf_counter()
+    tasks = [asyncio.create_task(subscribe(subscriber, stop)) for subscriber in subscribers]
+    # Подключение считается завершённым, когда пришёл начальный снимок
+    await asyncio.wait_for(asyncio.gather(*(s.snapshot.wait() for s in subscribers)), args.connect_timeout)
+    connect_seconds = time.perf_counter() - started
+
+    expected = 0
+    update_latencies = []
+    started = time.perf_counter()
+    for n in range(args.updates):
+        delivery_id = random.choice(delivery_ids)
+        expected += per_delivery.get(delivery_id, 0)
+        sent[n] = time.perf_counter()
+        await update(delivery_id, f"{MARKER}{n}")
+        update_latencies.append(time.perf_counter() - sent[n])
+        await asyncio.sleep(max(0.0, started + (n + 1) / args.rate - time.perf_counter()))
+
+    # Ждём, пока подписчики дочитают хвост
+    deadline = time.perf_counter() + args.drain_timeout
+    while len(latencies) < expected and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+
+    stop.set()
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    errors = sum(1 for r in results if isinstance(r, BaseException) and not isinstance(r, asyncio.CancelledError))
+
+    return {
+        "subscribers": args.subscribers,
+        "deliveries": len(delivery_ids),
+        "connect_seconds": round(connect_seconds, 2),
+        "subscriber_errors": errors,
+        "updates": args.updates,
+        "events_expected": expected,
+        "events_received": len(latencies),
+        "update": _latency_summary(sorted(update_latencies)),
+        "fanout": _latency_summary(sorted(latencies)),
+        "rss_growth_mb": round(_rss_mb() - rss_before, 1),
+        # Те же клиенты при опросе: по запросу на подписчика раз в poll_interval
+        "polling_equivalent_rps": round(args.subscribers / args.poll_interval, 1),
+        "push_rps": round(args.updates / (time.perf_counter() - started), 1),
+    }
+
+
+async def run_asgi(args) -> dict:
+    async with InProcessCluster() as cluster:
+        client = cluster.client
+        for i in range(args.deliveries):
+            await _create_user_and_order(client, i, paid=True)
+        deliveries = (await client.get("/api/v1/delivery/", params={"limit": args.deliveries})).raise_for_status().json()
+        app = cluster.apps["delivery"]
+
+        async def subscribe(subscriber, stop):
+            await _subscribe_asgi(app, subscriber, stop)
+
+        async def update(delivery_id, address):
+            (await client.put(f"/api/v1/delivery/{delivery_id}", json={"address": address})).raise_for_status()
+
+        return await _run(args, subscribe, update, [d["id"] for d in deliveries])
+
+
+async def run_http(args) -> dict:
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    timeout = httpx.Timeout(30.0, read=None)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=timeout) as streams, \
+            httpx.AsyncClient(base_url=args.base_url, timeout=10.0) as client:
+        deliveries = (await client.get("/", params={"limit": args.deliveries})).raise_for_status().json()
+        if not deliveries:
+            raise SystemExit("на стенде нет доставок: создайте их (например, benchmarks/e2e_flow.py)")
+        # Открываем соединения волнами, чтобы не упереться в backlog сокета
+        connecting = asyncio.Semaphore(args.connect_concurrency)
+
+        async def subscribe(subscriber, stop):
+            async with connecting:
+                opened = asyncio.ensure_future(_subscribe_http(streams, subscriber, stop))
+                await asyncio.wait([opened, asyncio.ensure_future(subscriber.snapshot.wait())],
+                                   return_when=asyncio.FIRST_COMPLETED)
+            await opened
+
+        async def update(delivery_id, address):
+            (await client.put(f"/{delivery_id}", json={"address": address})).raise_for_status()
+
+        return await _run(args, subscribe, update, [d["id"] for d in deliveries])
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=("asgi", "http"), default="asgi")
+    parser.add_argument("--base-url", default="http://localhost/api/v1/delivery")
+    parser.add_argument("--subscribers", type=int, default=10_000)
+    parser.add_argument("--deliveries", type=int, default=100)
+    parser.add_argument("--updates", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=50.0, help="изменений в секунду")
+    parser.add_argument("--poll-interval", type=float, default=3.0)
+    parser.add_argument("--connect-concurrency", type=int, default=500)
+    parser.add_argument("--connect-timeout", type=float, default=120.0)
+    parser.add_argument("--drain-timeout", type=float, default=10.0)
+    args = parser.parse_args()
+
+    report = await (run_asgi(args) if args.mode == "asgi" else run_http(args))
+    report["mode"] = args.mode
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
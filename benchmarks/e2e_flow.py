@@ -0,0 +1,289 @@
+"""
+Нагрузочный тест сквозного бизнес-сценария через шлюз:
+пользователь → заказ → оплата (статус заказа + доставка) → чтение → каскадное удаление.
+
+Нагрузка открытая (open-loop): сценарии запускаются по пуассоновскому потоку с
+интенсивностью --rate в секунду независимо от того, успевает ли система, поэтому
+задержка сценария считается от запланированного момента старта (без coordinated omission).
+Сверх --max-in-flight одновременных сценариев новые прибытия отбрасываются и учитываются в "dropped".
+
+Сценарии (--mix, веса через запятую):
+  * purchase — user.create → order.create → payment.create → order.get (ожидается 'paid')
+               → delivery.list → order.delete (каскад payments/delivery) → user.delete
+               (202: каскад пользователя идёт фоновой задачей, её завершения не ждём);
+  * checkout — то же без удаления: данные копятся, списки растут;
+  * browse   — списки users/orders/payments/delivery (limit=--page-size);
+  * lookup   — order.get по id заказов, созданных в этом прогоне.
+
+Результат — JSON с p50/p95/p99 и долей ошибок по каждому шагу и сценарию.
+--output сохраняет его в файл, --baseline добавляет сравнение с прошлым прогоном.
+
+Пример:
+    python benchmarks/e2e_flow.py --rate 20 --duration 60 --mix purchase=1,browse=3 \\
+        --output after.json --baseline before.json
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from collections import Counter, defaultdict
+
+import httpx
+
+SCENARIOS = ("purchase", "checkout", "browse", "lookup")
+
+
+def _percentile(sorted_values, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def parse_mix(value: str) -> dict:
+    """"purchase=1,browse=3" → {"purchase": 1.0, "browse": 3.0}."""
+    mix = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, weight = item.partition("=")
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"неизвестный сценарий {name!r}, доступны: {', '.join(SCENARIOS)}")
+        mix[name] = float(weight or 1)
+    if not mix or sum(mix.values()) <= 0:
+        raise argparse.ArgumentTypeError("пустой --mix")
+    return mix
+
+
+class StepFailed(Exception):
+    pass
+
+
+class LoadStats:
+    def __init__(self):
+        self.step_latencies = defaultdict(list)
+        self.step_statuses = defaultdict(Counter)
+        self.step_errors = Counter()
+        self.flow_latencies = defaultdict(list)
+        self.flow_results = defaultdict(Counter)
+        self.arrivals = 0
+        self.dropped = 0
+
+    def step_report(self) -> dict:
+        report = {}
+        for step in sorted(self.step_statuses):
+            latencies = sorted(self.step_latencies[step])
+            count = sum(self.step_statuses[step].values())
+            report[step] = {
+                "count": count,
+                "errors": self.step_errors[step],
+                "error_rate": round(self.step_errors[step] / count, 4) if count else 0.0,
+                "statuses": dict(self.step_statuses[step]),
+                **_latency_summary(latencies),
+            }
+        return report
+
+    def flow_report(self) -> dict:
+        report = {}
+        for name in sorted(self.flow_results):
+            results = self.flow_results[name]
+            total = results["ok"] + results["failed"]
+            report[name] = {
+                "completed": results["ok"],
+                "failed": results["failed"],
+                "error_rate": round(results["failed"] / total, 4) if total else 0.0,
+                **_latency_summary(sorted(self.flow_latencies[name])),
+            }
+        return report
+
+
+def _latency_summary(sorted_latencies) -> dict:
+    return {
+        "p50_ms": round(_percentile(sorted_latencies, 0.50) * 1000, 2),
+        "p95_ms": round(_percentile(sorted_latencies, 0.95) * 1000, 2),
+        "p99_ms": round(_percentile(sorted_latencies, 0.99) * 1000, 2),
+        "max_ms": round(sorted_latencies[-1] * 1000, 2) if sorted_latencies else 0.0,
+    }
+
+
+class FlowRunner:
+    """Шаги сценариев поверх одного httpx.AsyncClient (шлюз или in-process транспорт)."""
+
+    def __init__(self, client: httpx.AsyncClient, stats: LoadStats, page_size: int = 50):
+        self.client = client
+        self.stats = stats
+        self.page_size = page_size
+        self.run_id = uuid.uuid4().hex[:8]
+        self.order_ids: list[int] = []
+        self._sequence = 0
+
+    async def step(self, name: str, method: str, url: str, expected=(200,), **kwargs) -> httpx.Response:
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+        except httpx.HTTPError as e:
+            self.stats.step_latencies[name].append(time.perf_counter() - started)
+            self.stats.step_statuses[name][type(e).__name__] += 1
+            self.stats.step_errors[name] += 1
+            raise StepFailed(f"{name}: {type(e).__name__}") from e
+
+        self.stats.step_latencies[name].append(time.perf_counter() - started)
+        self.stats.step_statuses[name][str(response.status_code)] += 1
+        if response.status_code not in expected:
+            self.stats.step_errors[name] += 1
+            raise StepFailed(f"{name}: HTTP {response.status_code}")
+        return response
+
+    async def purchase(self, cleanup: bool = True):
+        self._sequence += 1
+        user = (await self.step("user.create", "POST", "/api/v1/users/", expected=(201,), json={
+            "full_name": "Нагрузочный Тест",
+            "email": f"load-{self.run_id}-{self._sequence}@example.com",
+            "password": "load-test-password",
+        })).json()
+
+        order = None
+        try:
+            amount = round(random.uniform(10, 500), 2)
+            order = (await self.step("order.create", "POST", "/api/v1/orders/", expected=(201,), json={
+                "user_id": user["id"], "total_amount": amount,
+            })).json()
+            if not cleanup:
+                # Для lookup годятся только заказы, которые не будут удалены
+                self.order_ids.append(order["id"])
+
+            await self.step("payment.create", "POST", "/api/v1/payments/", expected=(201,), json={
+                "order_id": order["id"], "amount": amount, "method": "card",
+            })
+
+            paid = (await self.step("order.get", "GET", f"/api/v1/orders/{order['id']}")).json()
+            if paid["status"] != "paid":
+                # Платёж прошёл, но обновление статуса заказа потерялось
+                self.stats.step_errors["order.status_paid"] += 1
+                self.stats.step_statuses["order.status_paid"][paid["status"]] += 1
+                raise StepFailed(f"order.status_paid: {paid['status']}")
+            self.stats.step_statuses["order.status_paid"]["paid"] += 1
+
+            await self.step("delivery.list", "GET", "/api/v1/delivery/", params={"limit": self.page_size})
+        finally:
+            if cleanup:
+                # У оплаченного заказа активная доставка, и users откажет (400) — сначала каскад заказа
+                if order is not None:
+                    await self.step("order.delete", "DELETE", f"/api/v1/orders/{order['id']}", expected=(204,))
+                await self.step("user.delete", "DELETE", f"/api/v1/users/{user['id']}", expected=(202,))
+
+    async def browse(self):
+        for service in ("users", "orders", "payments", "delivery"):
+            await self.step(f"{service}.list", "GET", f"/api/v1/{service}/", params={"limit": self.page_size})
+
+    async def lookup(self):
+        if not self.order_ids:
+            # Заказов этого прогона ещё нет — читаем тестовый заказ из init_db
+            await self.step("order.get", "GET", "/api/v1/orders/1", expected=(200, 404))
+            return
+        await self.step("order.get", "GET", f"/api/v1/orders/{random.choice(self.order_ids)}")
+
+    async def run(self, scenario: str, scheduled: float):
+        try:
+            if scenario == "purchase":
+                await self.purchase(cleanup=True)
+            elif scenario == "checkout":
+                await self.purchase(cleanup=False)
+            elif scenario == "browse":
+                await self.browse()
+            else:
+                await self.lookup()
+        except StepFailed:
+            self.stats.flow_results[scenario]["failed"] += 1
+        else:
+            self.stats.flow_results[scenario]["ok"] += 1
+        finally:
+            self.stats.flow_latencies[scenario].append(time.perf_counter() - scheduled)
+
+
+async def run_load(client: httpx.AsyncClient, rate: float, duration: float, mix: dict,
+                   max_in_flight: int = 256, page_size: int = 50, seed: int | None = None) -> dict:
+    """Открытая нагрузка на уже настроенный клиент; возвращает отчёт (dict)."""
+    rng = random.Random(seed)
+    stats = LoadStats()
+    runner = FlowRunner(client, stats, page_size)
+    names, weights = list(mix), list(mix.values())
+    in_flight: set[asyncio.Task] = set()
+
+    started = time.perf_counter()
+    next_arrival = started
+    deadline = started + duration
+    while next_arrival < deadline:
+        delay = next_arrival - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        stats.arrivals += 1
+        if len(in_flight) >= max_in_flight:
+            stats.dropped += 1
+        else:
+            scenario = rng.choices(names, weights)[0]
+            task = asyncio.create_task(runner.run(scenario, next_arrival))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+        next_arrival += rng.expovariate(rate)
+
+    if in_flight:
+        await asyncio.wait(in_flight)
+    elapsed = time.perf_counter() - started
+
+    return {
+        "config": {"rate": rate, "duration": duration, "mix": mix, "max_in_flight": max_in_flight},
+        "elapsed_seconds": round(elapsed, 2),
+        "arrivals": stats.arrivals,
+        "dropped": stats.dropped,
+        "achieved_rate": round((stats.arrivals - stats.dropped) / duration, 2),
+        "scenarios": stats.flow_report(),
+        "steps": stats.step_report(),
+    }
+
+
+def compare(baseline: dict, current: dict) -> dict:
+    """Разница p50/p95/p99 и доли ошибок по шагам между двумя отчётами."""
+    comparison = {}
+    for step, after in current["steps"].items():
+        before = baseline.get("steps", {}).get(step)
+        if before is None:
+            continue
+        row = {}
+        for key in ("p50_ms", "p95_ms", "p99_ms", "error_rate"):
+            row[key] = {"before": before[key], "after": after[key]}
+            if before[key]:
+                row[key]["change_pct"] = round((after[key] - before[key]) / before[key] * 100, 1)
+        comparison[step] = row
+    return comparison
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost")
+    parser.add_argument("--rate", type=float, default=10.0, help="сценариев в секунду")
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("purchase=1"))
+    parser.add_argument("--max-in-flight", type=int, default=256)
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--output", help="сохранить отчёт в файл")
+    parser.add_argument("--baseline", help="отчёт прошлого прогона для сравнения")
+    args = parser.parse_args()
+
+    limits = httpx.Limits(max_connections=args.max_in_flight, max_keepalive_connections=args.max_in_flight)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=30.0) as client:
+        report = await run_load(client, args.rate, args.duration, args.mix,
+                                args.max_in_flight, args.page_size, args.seed)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            report["comparison"] = compare(json.load(f), report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
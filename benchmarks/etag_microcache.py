@@ -0,0 +1,83 @@
+"""
+Бенчмарк ETag / microcache: насколько падает нагрузка на origin при опросе списков.
+
+Три режима опроса одного и того же спискового эндпоинта:
+  * origin        — напрямую в реплику, без валидаторов (как сейчас делают клиенты);
+  * origin-etag   — напрямую в реплику с If-None-Match (304 без сериализации);
+  * gateway       — через nginx с microcache; запросы, дошедшие до origin,
+                    считаются по заголовку X-Cache-Status.
+
+Пример:
+    python benchmarks/etag_microcache.py --clients 50 --duration 10
+"""
+import argparse
+import asyncio
+import json
+import time
+from collections import Counter
+
+import httpx
+
+# Статусы кэша nginx, при которых запрос дошёл до upstream
+ORIGIN_CACHE_STATUSES = {"MISS", "EXPIRED", "REVALIDATED", "BYPASS", None}
+
+
+async def _poller(client: httpx.AsyncClient, url: str, deadline: float, conditional: bool, stats: Counter):
+    etag = None
+    while time.perf_counter() < deadline:
+        headers = {"If-None-Match": etag} if conditional and etag else {}
+        try:
+            response = await client.get(url, headers=headers)
+        except httpx.RequestError:
+            stats["errors"] += 1
+            continue
+
+        stats["requests"] += 1
+        stats[f"status_{response.status_code}"] += 1
+        stats["bytes"] += len(response.content)
+        etag = response.headers.get("etag", etag)
+
+        cache_status = response.headers.get("x-cache-status")
+        if cache_status in ORIGIN_CACHE_STATUSES:
+            stats["origin_hits"] += 1
+
+
+async def run_mode(url: str, clients: int, duration: float, conditional: bool) -> dict:
+    stats: Counter = Counter()
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(limits=limits, timeout=10.0) as client:
+        deadline = time.perf_counter() + duration
+        await asyncio.gather(*(
+            _poller(client, url, deadline, conditional, stats) for _ in range(clients)
+        ))
+
+    return {
+        "url": url,
+        "client_qps": round(stats["requests"] / duration, 1),
+        "origin_qps": round(stats["origin_hits"] / duration, 1),
+        "bytes_per_request": round(stats["bytes"] / max(stats["requests"], 1), 1),
+        **{k: v for k, v in stats.items() if k.startswith("status_") or k == "errors"},
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--origin", default="http://localhost:8011/api/v1/orders/")
+    parser.add_argument("--gateway", default="http://localhost/api/v1/orders/")
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=10.0)
+    args = parser.parse_args()
+
+    results = {
+        "origin": await run_mode(args.origin, args.clients, args.duration, conditional=False),
+        "origin-etag": await run_mode(args.origin, args.clients, args.duration, conditional=True),
+        "gateway": await run_mode(args.gateway, args.clients, args.duration, conditional=True),
+    }
+
+    baseline = results["origin"]["origin_qps"] or 1
+    results["gateway"]["origin_qps_reduction"] = round(1 - results["gateway"]["origin_qps"] / baseline, 4)
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,100 @@
+"""
+Нагрузочный скрипт для шлюза: keepalive-пулы, least_conn и пассивные health checks.
+
+Гоняет смешанную нагрузку (GET заказа, GET пользователя, GET списка доставок)
+с фиксированной конкурентностью против одного или нескольких шлюзов и печатает
+RPS, перцентили задержки, долю ошибок и распределение по репликам (X-Replica-ID).
+
+Чтобы увидеть разницу, поднимите второй nginx со старым конфигом
+(без upstream keepalive) на другом порту и передайте оба адреса:
+    python benchmarks/gateway_keepalive.py \\
+        --target tuned=http://localhost --target baseline=http://localhost:8080
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import statistics
+import time
+from collections import Counter
+
+import httpx
+
+PATHS = [
+    "/api/v1/orders/1",
+    "/api/v1/users/1",
+    "/api/v1/delivery/?limit=20",
+]
+
+
+def _percentile(sorted_values, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+async def _worker(client, base_url, paths, deadline, latencies, stats, replicas):
+    for path in itertools.cycle(paths):
+        if time.perf_counter() >= deadline:
+            return
+        started = time.perf_counter()
+        try:
+            response = await client.get(base_url + path)
+        except httpx.RequestError:
+            stats["errors"] += 1
+            continue
+        latencies.append((time.perf_counter() - started) * 1000)
+        stats["requests"] += 1
+        if response.status_code >= 500:
+            stats["errors"] += 1
+        replica = response.headers.get("x-replica-id")
+        if replica:
+            replicas[replica] += 1
+
+
+async def run_target(base_url: str, concurrency: int, duration: float) -> dict:
+    latencies: list = []
+    stats: Counter = Counter()
+    replicas: Counter = Counter()
+
+    # Клиент держит свои keepalive-соединения — меряем именно плечо nginx → upstream
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=10.0) as client:
+        deadline = time.perf_counter() + duration
+        await asyncio.gather(*(
+            _worker(client, base_url, PATHS[i % len(PATHS):] + PATHS[:i % len(PATHS)],
+                    deadline, latencies, stats, replicas)
+            for i in range(concurrency)
+        ))
+
+    latencies.sort()
+    return {
+        "rps": round(stats["requests"] / duration, 1),
+        "p50_ms": round(_percentile(latencies, 0.50), 2),
+        "p95_ms": round(_percentile(latencies, 0.95), 2),
+        "p99_ms": round(_percentile(latencies, 0.99), 2),
+        "mean_ms": round(statistics.fmean(latencies), 2) if latencies else 0.0,
+        "error_rate": round(stats["errors"] / max(stats["requests"] + stats["errors"], 1), 4),
+        "replicas": dict(replicas),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", action="append", default=[],
+                        help="name=base_url, можно указать несколько раз")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=15.0)
+    args = parser.parse_args()
+
+    targets = dict(t.split("=", 1) for t in args.target) or {"gateway": "http://localhost"}
+    results = {}
+    for name, base_url in targets.items():
+        results[name] = await run_target(base_url.rstrip("/"), args.concurrency, args.duration)
+
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,81 @@
+"""
+CPU на сериализацию одной страницы списка: путь FastAPI (response_model) против быстрого orjson-пути.
+
+  * pydantic — то, что делает FastAPI для response_model=List[OrderInDB]:
+               валидация ORM-объектов (from_attributes) → dump в JSON-режиме → json.dumps;
+  * orjson   — быстрый путь (app/core/fast_json.py): Row._asdict() → orjson.dumps.
+
+БД не нужна: строки синтезируются в памяти, меряется только CPU процесса.
+    python benchmarks/list_serialization.py --rows 100 --iterations 2000
+
+Сквозное сравнение на живом сервисе: запустить его с FAST_JSON_RESPONSES=1 и =0
+и сравнить CPU контейнера (docker stats) при одинаковом RPS.
+"""
+import argparse
+import json
+import sys
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+from pathlib import Path
+from types import SimpleNamespace
+from typing import List
+
+import orjson
+from pydantic import TypeAdapter
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "orders_service"))
+from app.schemas.order import OrderInDB  # noqa: E402
+
+OrderRow = namedtuple("OrderRow", "id user_id status total_amount created_at updated_at")
+
+
+def _make_rows(n: int):
+    now = datetime(2025, 1, 1, 12, 0, 0)
+    return [
+        OrderRow(i, i % 50, "pending", 100.5 + i, now + timedelta(seconds=i), None)
+        for i in range(1, n + 1)
+    ]
+
+
+def pydantic_path(objects, adapter) -> bytes:
+    validated = adapter.validate_python(objects, from_attributes=True)
+    return json.dumps(adapter.dump_python(validated, mode="json")).encode("utf-8")
+
+
+def orjson_path(rows) -> bytes:
+    return orjson.dumps([row._asdict() for row in rows])
+
+
+def _measure(fn, iterations: int) -> float:
+    started = time.process_time()
+    for _ in range(iterations):
+        fn()
+    return (time.process_time() - started) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100)
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    rows = _make_rows(args.rows)
+    objects = [SimpleNamespace(**row._asdict()) for row in rows]
+    adapter = TypeAdapter(List[OrderInDB])
+
+    # Оба пути должны давать одинаковый JSON
+    assert json.loads(pydantic_path(objects, adapter)) == json.loads(orjson_path(rows))
+
+    pydantic_us = _measure(lambda: pydantic_path(objects, adapter), args.iterations)
+    orjson_us = _measure(lambda: orjson_path(rows), args.iterations)
+    print(json.dumps({
+        "rows": args.rows,
+        "pydantic_cpu_us_per_page": round(pydantic_us, 1),
+        "orjson_cpu_us_per_page": round(orjson_us, 1),
+        "speedup": round(pydantic_us / orjson_us, 2),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
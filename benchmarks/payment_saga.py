@@ -0,0 +1,100 @@
+"""
+Сравнение create_payment: прежняя цепочка (PAYMENT_SAGA_ENABLED=0) и сага с компенсациями.
+
+Оба режима прогоняются на in-process стенде (benchmarks/inprocess.py) с одинаковыми
+задержками и отказами зависимостей. Кроме пропускной способности и задержек считается
+согласованность после прогона:
+  * paid_without_delivery — заказ в 'paid', а доставки нет;
+  * payment_without_paid_order — успешный платёж по заказу, который не в 'paid';
+  * unfinished_sagas — саги, оставшиеся в running/compensating (дозавершит resumer).
+Прежняя цепочка при отказе delivery оставляет оплаченный заказ без доставки; сага —
+откатывает заказ в 'pending' и аннулирует платёж (ответ 502).
+
+Пример:
+    python benchmarks/payment_saga.py --iterations 300 --concurrency 16 \\
+        --latency delivery=5 --failure-rate delivery=0.1
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from inprocess import Fault, InProcessCluster, _create_user_and_order, _measure, parse_per_service  # noqa: E402
+
+MODES = {"legacy": "0", "saga": "1"}
+
+
+async def _consistency(cluster: InProcessCluster, order_ids: list) -> dict:
+    client = cluster.client
+    limit = len(order_ids) + 1000
+    orders = (await client.get("/api/v1/orders/", params={"limit": limit})).raise_for_status().json()
+    deliveries = (await client.get("/api/v1/delivery/", params={"limit": limit})).raise_for_status().json()
+    payments = (await client.get("/api/v1/payments/", params={"limit": limit})).raise_for_status().json()
+
+    ours = set(order_ids)
+    paid = {o["id"] for o in orders if o["id"] in ours and o["status"] == "paid"}
+    delivered = {d["order_id"] for d in deliveries if d["order_id"] in ours}
+    charged = {p["order_id"] for p in payments if p["order_id"] in ours and p["status"] == "success"}
+
+    report = {
+        "paid_orders": len(paid),
+        "paid_without_delivery": len(paid - delivered),
+        "payment_without_paid_order": len(charged - paid),
+    }
+    if os.environ["PAYMENT_SAGA_ENABLED"] == "1":
+        PaymentSaga = cluster.modules["payments"]["app.models.saga"].PaymentSaga
+        with cluster.modules["payments"]["app.db.database"].SessionLocal() as db:
+            report["unfinished_sagas"] = db.query(PaymentSaga).filter(
+                PaymentSaga.status.in_(("running", "compensating"))).count()
+    return report
+
+
+async def run_mode(args, mode: str) -> dict:
+    os.environ["PAYMENT_SAGA_ENABLED"] = MODES[mode]
+    faults = {
+        service: Fault(args.latency.get(service, 0.0), args.failure_rate.get(service, 0.0), args.failure_mode)
+        for service in set(args.latency) | set(args.failure_rate)
+    }
+    async with InProcessCluster(args.database_url, faults) as cluster:
+        client = cluster.client
+        order_ids = []
+
+        async def prepare(i):
+            state = await _create_user_and_order(client, i)
+            order_ids.append(state[1])
+            return state
+
+        async def pay(state):
+            return await client.post("/api/v1/payments/", json={"order_id": state[1], "amount": 100.0, "method": "card"})
+
+        report = await _measure(prepare, pay, args.iterations, args.concurrency, 201)
+        report["consistency"] = await _consistency(cluster, order_ids)
+    report["injected_failures"] = sum(f.injected_failures for f in faults.values())
+    return report
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="шаблон URL БД с {service}; по умолчанию SQLite во временном каталоге")
+    parser.add_argument("--latency", type=parse_per_service, default={}, help="задержка зависимости, мс")
+    parser.add_argument("--failure-rate", type=parse_per_service, default={}, help="доля отказов зависимости")
+    parser.add_argument("--failure-mode", choices=("connect", "503"), default="connect")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--modes", default="legacy,saga", help="режимы через запятую: legacy, saga")
+    args = parser.parse_args()
+
+    report = {}
+    for mode in args.modes.split(","):
+        report[mode] = await run_mode(args, mode)
+    if "legacy" in report and "saga" in report and report["legacy"]["ops_per_second"]:
+        report["saga_throughput_ratio"] = round(
+            report["saga"]["ops_per_second"] / report["legacy"]["ops_per_second"], 3)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,99 @@
+"""
+Single-flight исходящих GET (app/core/http_client.py): «распродажа» — много одновременных
+проверок одного и того же заказа (GET /orders/{id}, как в verify_order_can_be_paid).
+
+На in-process стенде (benchmarks/inprocess.py) --callers вызовов общего клиента Payments
+одновременно запрашивают один заказ, --waves волн подряд. Режимы:
+  * plain    — без объединения (extensions={"coalesce": False}), как раньше;
+  * coalesce — одинаковые одновременные GET делят один запрос к Orders.
+Для каждого режима — сколько запросов дошло до Orders, задержки вызовов и доля
+объединённых (outbound_coalesced_requests_total). Задержка Orders — --latency (мс).
+
+В режиме plain больше ~40 одновременных вызовов на SQLite-стенде упираются в пул потоков
+Orders (обработчики ждут соединение БД, а освобождение соединения ждёт свободный поток) —
+сравнивайте при --callers ниже этого порога.
+
+Пример:
+    python benchmarks/request_coalescing.py --callers 30 --waves 20 --latency 20
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from e2e_flow import _latency_summary  # noqa: E402
+from inprocess import Fault, InProcessCluster, _create_user_and_order  # noqa: E402
+
+
+class CountingFault(Fault):
+    """Задержка зависимости и счётчик дошедших до неё запросов."""
+
+    def __init__(self, latency_ms: float):
+        super().__init__(latency_ms)
+        self.requests = 0
+
+    async def apply(self, request):
+        self.requests += 1
+        return await super().apply(request)
+
+
+def _coalesced(modules) -> dict:
+    counter = modules["app.core.http_client"].OUTBOUND_COALESCED
+    return {
+        outcome: counter.labels("orders", outcome)._value.get()
+        for outcome in ("sent", "joined", "reused")
+    }
+
+
+async def run(args) -> dict:
+    orders = CountingFault(args.latency)
+    async with InProcessCluster(args.database_url, faults={"orders": orders}) as cluster:
+        _, order_id = await _create_user_and_order(cluster.client, 0)
+        modules = cluster.modules["payments"]
+        client = modules["app.core.http_client"].get_http_client()
+        url = f"{modules['app.crud.payments'].ORDERS_SERVICE_URL}/{order_id}"
+
+        report = {"callers": args.callers, "waves": args.waves, "latency_ms": args.latency}
+        for mode in ("plain", "coalesce"):
+            extensions = {"coalesce": mode == "coalesce"}
+            before, coalesced_before = orders.requests, _coalesced(modules)
+            latencies, statuses = [], {}
+
+            async def call():
+                started = time.perf_counter()
+                response = await client.get(url, extensions=extensions)
+                latencies.append(time.perf_counter() - started)
+                statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+
+            started = time.perf_counter()
+            for _ in range(args.waves):
+                await asyncio.gather(*(call() for _ in range(args.callers)))
+            elapsed = time.perf_counter() - started
+
+            coalesced = {k: v - coalesced_before[k] for k, v in _coalesced(modules).items()}
+            calls = args.callers * args.waves
+            report[mode] = {
+                "calls_per_second": round(calls / elapsed, 1),
+                "origin_requests": orders.requests - before,
+                "coalesced_ratio": round((coalesced["joined"] + coalesced["reused"]) / calls, 4),
+                "statuses": statuses,
+                **_latency_summary(sorted(latencies)),
+            }
+    return report
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="шаблон URL БД с {service}; по умолчанию SQLite во временном каталоге")
+    parser.add_argument("--callers", type=int, default=30, help="одновременных вызовов в волне")
+    parser.add_argument("--waves", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=20.0, help="задержка Orders, мс")
+    args = parser.parse_args()
+    print(json.dumps(await run(args), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,102 @@
+"""
+Сравнение режимов запуска сервиса: single (uvicorn, asyncio + h11) против multi
+(gunicorn + uvicorn-воркеры, uvloop + httptools, воркеры по числу CPU).
+
+Скрипт по очереди запускает start.sh сервиса в каждом режиме, ждёт /readyz,
+даёт нагрузку на читающий эндпоинт и останавливает сервер. CPU сервера
+(включая воркеры) берётся из getrusage(RUSAGE_CHILDREN) после его завершения,
+поэтому метрика "requests_per_cpu_second" = req/s на одно полностью загруженное ядро.
+
+Запускать там, где сервису доступна его БД (переменные окружения как в .env), например:
+    python benchmarks/serving_modes.py --service-dir orders_service --port 8001 \\
+        --path /api/v1/orders/1 --concurrency 128 --duration 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import signal
+import subprocess
+import time
+
+import httpx
+
+
+def _children_cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+async def _wait_ready(base_url: str, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(f"{base_url}/readyz", timeout=1.0)).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"{base_url} не стал ready за {timeout}s")
+
+
+async def _load(url: str, concurrency: int, duration: float) -> dict:
+    done = errors = 0
+    deadline = time.perf_counter() + duration
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(limits=limits, timeout=10.0) as client:
+        async def worker():
+            nonlocal done, errors
+            while time.perf_counter() < deadline:
+                try:
+                    response = await client.get(url)
+                    done += 1
+                    errors += response.status_code >= 500
+                except httpx.HTTPError:
+                    errors += 1
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    return {"requests": done, "errors": errors}
+
+
+async def run_mode(mode: str, args) -> dict:
+    base_url = f"http://127.0.0.1:{args.port}"
+    env = {**os.environ, "SERVE_MODE": mode}
+    cpu_before = _children_cpu_seconds()
+
+    server = subprocess.Popen(["bash", "start.sh"], cwd=args.service_dir, env=env, start_new_session=True)
+    try:
+        await _wait_ready(base_url)
+        result = await _load(base_url + args.path, args.concurrency, args.duration)
+    finally:
+        os.killpg(server.pid, signal.SIGTERM)
+        server.wait(timeout=60)
+
+    cpu_seconds = _children_cpu_seconds() - cpu_before
+    return {
+        **result,
+        "rps": round(result["requests"] / args.duration, 1),
+        "server_cpu_seconds": round(cpu_seconds, 2),
+        "requests_per_cpu_second": round(result["requests"] / cpu_seconds, 1) if cpu_seconds else None,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--service-dir", default="orders_service")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--path", default="/api/v1/orders/1")
+    parser.add_argument("--concurrency", type=int, default=128)
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--modes", default="single,multi")
+    args = parser.parse_args()
+
+    results = {mode: await run_mode(mode, args) for mode in args.modes.split(",")}
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
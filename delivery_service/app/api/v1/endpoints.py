@@ -1,33 +1,182 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+import asyncio
+from datetime import datetime
+
+import orjson
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 
-from app.db.database import get_db
-from app.schemas.delivery import DeliveryInDB, DeliveryCreate, DeliveryUpdate
+from app.core.bulk_formats import (
+    BULK_RESPONSES, JSON, bulk_response, export_response, negotiate_media_type,
+)
+from app.core.etag import make_etag, etag_matches
+from app.core.fast_json import FAST_JSON_ENABLED, rows_response
+from app.core.pubsub import RESYNC, broker
+from app.db.database import SessionLocal, get_db
+from app.schemas.delivery import (
+    BulkStatusResult, BulkStatusUpdate, ClaimedDelivery, DeliveryInDB, DeliveryCreate, DeliveryUpdate,
+)
 from app.crud import deliveries as crud_deliveries
 
 router = APIRouter()
 
 
+def _delivery_version(db_delivery):
+    """Версия доставки для ETag: id + время последнего изменения."""
+    return db_delivery.id, db_delivery.updated_at or db_delivery.created_at
+
+
 @router.post("/", response_model=DeliveryInDB, status_code=status.HTTP_201_CREATED)
 async def create_delivery_route(delivery: DeliveryCreate, db: Session = Depends(get_db)):
     """Создание новой записи о доставке. Проверяет order_id в Orders Service."""
     return await crud_deliveries.create_delivery(db=db, delivery=delivery)
 
 
-@router.get("/", response_model=List[DeliveryInDB])
-def read_deliveries(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    """Получение списка всех записей о доставке."""
-    deliveries = crud_deliveries.get_deliveries(db, skip=skip, limit=limit)
+@router.get("/", response_model=List[DeliveryInDB], responses=BULK_RESPONSES)
+def read_deliveries(
+    request: Request,
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    after_order_id: Optional[int] = Query(None, description="keyset-страница по order_id"),
+    order_id: Optional[List[int]] = Query(None, max_length=1000),
+    changed_since: Optional[datetime] = None,
+    db: Session = Depends(get_db),
+):
+    """Получение списка всех записей о доставке (If-None-Match, JSON / MessagePack / Arrow)."""
+    filters = dict(after_order_id=after_order_id, order_ids=order_id, changed_since=changed_since)
+    media_type = negotiate_media_type(request)
+    if FAST_JSON_ENABLED or media_type != JSON:
+        deliveries = crud_deliveries.get_delivery_rows(db, skip=skip, limit=limit, **filters)
+    else:
+        deliveries = crud_deliveries.get_deliveries(db, skip=skip, limit=limit, **filters)
+
+    # ETag считаем до сериализации: при совпадении отдаём 304 без тела.
+    # Представления в разных форматах различаются, поэтому формат входит в ETag.
+    etag = make_etag(media_type, *(_delivery_version(d) for d in deliveries))
+    headers = {"ETag": etag, "Vary": "Accept"}
+    if etag_matches(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    if media_type != JSON:
+        return bulk_response(deliveries, crud_deliveries.DELIVERY_COLUMNS, media_type, headers=headers)
+    if FAST_JSON_ENABLED:
+        return rows_response(deliveries, headers=headers)
+
+    response.headers.update(headers)
     return deliveries
 
 
+# EXPORT (потоковая выгрузка всей таблицы)
+@router.get("/export", responses=BULK_RESPONSES)
+def export_deliveries_route(request: Request, batch_size: int = 10_000):
+    """
+    Потоковая выгрузка всех доставок: Arrow IPC stream, MessagePack или NDJSON (по Accept).
+    Строки читаются серверным курсором пачками по batch_size и сразу уходят клиенту.
+    """
+    def partitions():
+        # Своя сессия: генератор живёт дольше, чем зависимость get_db
+        db = SessionLocal()
+        try:
+            yield from crud_deliveries.iter_delivery_partitions(db, batch_size=batch_size)
+        finally:
+            db.close()
+
+    return export_response(partitions(), crud_deliveries.DELIVERY_COLUMNS, negotiate_media_type(request))
+
+
+# --- Поток изменений статуса (Server-Sent Events) вместо опроса GET /{delivery_id} ---
+
+def _load_delivery_events(delivery_ids) -> list[dict]:
+    with SessionLocal() as db:
+        return crud_deliveries.get_delivery_events(db, delivery_ids)
+
+
+def _sse(data: dict) -> bytes:
+    # id — версия доставки: по ней клиент отбрасывает повторы после переподключения
+    version = data["updated_at"] or data["created_at"]
+    return b"id: %d:%s\nevent: delivery\ndata: %s\n\n" % (data["id"], version.encode(), orjson.dumps(data))
+
+
+async def _delivery_event_stream(request: Request, subscription, delivery_ids, snapshot):
+    try:
+        yield b"retry: 3000\n\n"
+        for data in snapshot:
+            yield _sse(data)
+        while True:
+            try:
+                data = await subscription.get(crud_deliveries.SSE_HEARTBEAT)
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    break
+                yield b": ping\n\n"
+                continue
+            if data is RESYNC:
+                for data in await run_in_threadpool(_load_delivery_events, delivery_ids):
+                    yield _sse(data)
+            else:
+                yield _sse(data)
+    finally:
+        broker.unsubscribe(subscription)
+
+
+async def _delivery_events_response(request: Request, delivery_ids):
+    # Подписка оформляется до снимка: изменение между ними придёт событием, а не потеряется
+    subscription = broker.subscribe(crud_deliveries.DELIVERY_CHANNEL, delivery_ids)
+    try:
+        snapshot = await run_in_threadpool(_load_delivery_events, delivery_ids)
+    except BaseException:
+        broker.unsubscribe(subscription)
+        raise
+    if not snapshot:
+        broker.unsubscribe(subscription)
+        raise HTTPException(status_code=404, detail="Запись о доставке не найдена")
+    return StreamingResponse(
+        _delivery_event_stream(request, subscription, delivery_ids, snapshot),
+        media_type="text/event-stream",
+        # X-Accel-Buffering: nginx отдаёт события сразу, не копя их в буфере
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # Клиент мог отключиться раньше, чем генератор начал работу, — тогда его finally не выполнится
+        background=BackgroundTask(broker.unsubscribe, subscription),
+    )
+
+
+@router.get("/events")
+async def delivery_events_route(request: Request, ids: str = Query(..., description="id доставок через запятую")):
+    """
+    SSE-поток по нескольким доставкам в одном соединении: снимок текущего состояния,
+    затем каждое изменение (PUT /{delivery_id}) и heartbeat-комментарии.
+    """
+    try:
+        delivery_ids = sorted({int(part) for part in ids.split(",") if part.strip()})
+    except ValueError:
+        raise HTTPException(status_code=422, detail="ids: список целых чисел через запятую")
+    if not delivery_ids or len(delivery_ids) > crud_deliveries.SSE_MAX_IDS:
+        raise HTTPException(status_code=422, detail=f"ids: от 1 до {crud_deliveries.SSE_MAX_IDS} доставок")
+    return await _delivery_events_response(request, delivery_ids)
+
+
+@router.get("/{delivery_id}/events")
+async def delivery_events_one_route(delivery_id: int, request: Request):
+    """SSE-поток изменений одной доставки."""
+    return await _delivery_events_response(request, [delivery_id])
+
+
 @router.get("/{delivery_id}", response_model=DeliveryInDB)
-def read_delivery(delivery_id: int, db: Session = Depends(get_db)):
-    """Получение записи о доставке по ID."""
+def read_delivery(delivery_id: int, request: Request, response: Response, db: Session = Depends(get_db)):
+    """Получение записи о доставке по ID (поддерживает If-None-Match)."""
     db_delivery = crud_deliveries.get_delivery(db, delivery_id=delivery_id)
     if db_delivery is None:
         raise HTTPException(status_code=404, detail="Запись о доставке не найдена")
+
+    etag = make_etag(*_delivery_version(db_delivery))
+    if etag_matches(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+    response.headers["ETag"] = etag
     return db_delivery
 
 
@@ -40,6 +189,32 @@ def update_delivery_route(delivery_id: int, delivery: DeliveryUpdate, db: Sessio
     return db_delivery
 
 
+@router.post("/claim", response_model=List[ClaimedDelivery])
+def claim_deliveries_route(
+    courier_id: str = Query(..., min_length=1, max_length=64),
+    n: int = Query(1, ge=1, le=crud_deliveries.CLAIM_MAX),
+    db: Session = Depends(get_db),
+):
+    """
+    Захват курьером до n самых старых доставок в статусе processing (вместо выбора из GET /).
+    Доставка закрепляется за курьером до lease_expires_at; не отправленная к этому сроку
+    возвращается в очередь. Пустой список — свободных доставок нет.
+    """
+    return crud_deliveries.claim_deliveries(db, courier_id=courier_id, n=n)
+
+
+@router.patch("/bulk-status", response_model=BulkStatusResult)
+async def bulk_update_status_route(changes: BulkStatusUpdate, db: Session = Depends(get_db)):
+    """
+    Пакетная смена статусов доставок (синхронизация курьерских терминалов): один UPDATE
+    и одна транзакция на весь пакет, исход по каждому элементу. Заказы доставок, ставших
+    shipped/in_transit/delivered, переводятся в shipped/completed одним вызовом Orders Service.
+    """
+    items = await run_in_threadpool(crud_deliveries.bulk_update_delivery_status, db, changes.items)
+    await crud_deliveries.sync_order_statuses(items)
+    return BulkStatusResult(updated=sum(item.outcome == "updated" for item in items), items=items)
+
+
 @router.delete("/{delivery_id}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_delivery_route(delivery_id: int, db: Session = Depends(get_db)):
     success = crud_deliveries.delete_delivery(db, delivery_id=delivery_id)
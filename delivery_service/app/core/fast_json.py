@@ -0,0 +1,15 @@
+import os
+
+import orjson
+from fastapi.responses import Response
+
+# Быстрый путь для списков: строки из БД (Row) сериализуются orjson напрямую,
+# минуя ORM-объекты, валидацию Pydantic (from_attributes) и stdlib json.
+# FAST_JSON_RESPONSES=0 возвращает старый путь — удобно для сравнения CPU на запрос.
+FAST_JSON_ENABLED = os.getenv("FAST_JSON_RESPONSES", "1") == "1"
+
+
+def rows_response(rows, headers: dict | None = None) -> Response:
+    """Готовый JSON-ответ из списка Row (select по колонкам схемы *InDB)."""
+    body = orjson.dumps([row._asdict() for row in rows])
+    return Response(content=body, media_type="application/json", headers=headers)
@@ -0,0 +1,249 @@
+"""
+Рассылка событий между процессами сервиса через Postgres LISTEN/NOTIFY.
+
+* publish(db, channel, key, data) — событие уходит при commit транзакции db
+  (NOTIFY транзакционный: откат — события нет, подписчик не увидит незакоммиченное).
+  publish_many — события пакетного изменения: они упаковываются в NOTIFY по нескольку
+  (до PUBSUB_PAYLOAD_MAX байт) и отправляются одним запросом.
+* На процесс — одно LISTEN-соединение вне пула (autocommit), читается из event loop
+  через add_reader, без потока на соединение. Обрыв → переподключение с backoff и
+  событие RESYNC всем подписчикам: пропущенное за время обрыва они перечитывают из БД.
+* Подписчик получает ограниченный буфер (PUBSUB_BUFFER_SIZE): медленный клиент не
+  тормозит рассылку и не копит память — при переполнении вытесняется самое старое
+  событие (для статусов важно последнее).
+
+Без Postgres (sqlite на локальном стенде) события рассылаются внутри процесса по
+after_commit сессии — другие процессы их не увидят.
+"""
+import asyncio
+import logging
+import os
+from collections import defaultdict
+
+import orjson
+from fastapi.concurrency import run_in_threadpool
+from prometheus_client import Counter, Gauge
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+PUBSUB_BUFFER_SIZE = int(os.getenv("PUBSUB_BUFFER_SIZE", "16"))
+PUBSUB_RECONNECT_MAX = 5.0
+# Полезная нагрузка NOTIFY ограничена 8000 байт
+PUBSUB_PAYLOAD_MAX = 7900
+
+PUBSUB_SUBSCRIBERS = Gauge(
+    "pubsub_subscribers", "Активные подписки на события",
+    ["channel"], multiprocess_mode="livesum",
+)
+PUBSUB_MESSAGES = Counter("pubsub_messages_total", "События, полученные процессом", ["channel"])
+PUBSUB_DROPPED = Counter(
+    "pubsub_dropped_total", "События, вытесненные из переполненного буфера подписчика", ["channel"],
+)
+
+# Маркер в очереди подписчика: соединение LISTEN переподключалось, события могли потеряться
+RESYNC = object()
+
+# Ключ в Session.info: события, ждущие commit (только без Postgres)
+_PENDING = "pubsub_pending"
+
+
+class Subscription:
+    """Подписка на события канала по набору ключей (None — на все)."""
+
+    __slots__ = ("channel", "keys", "queue", "dropped", "active")
+
+    def __init__(self, channel: str, keys, maxsize: int):
+        self.channel = channel
+        self.keys = keys
+        self.queue = asyncio.Queue(maxsize)
+        self.dropped = 0
+        self.active = True
+
+    def offer(self, message):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+            PUBSUB_DROPPED.labels(self.channel).inc()
+        self.queue.put_nowait(message)
+
+    async def get(self, timeout: float):
+        """Следующее событие; asyncio.TimeoutError, если за timeout ничего не пришло."""
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+
+class Broker:
+    def __init__(self):
+        # (channel, key) → подписки; key=None — подписка на весь канал
+        self._subscribers = defaultdict(set)
+        self._engine = None
+        self._channels = ()
+        self._loop = None
+        self._raw = None
+        self._fd = None
+        self._reconnect = None
+
+    @property
+    def listening(self) -> bool:
+        return self._raw is not None
+
+    # --- Подписки ---
+
+    def subscribe(self, channel: str, keys=None, maxsize: int = PUBSUB_BUFFER_SIZE) -> Subscription:
+        subscription = Subscription(channel, tuple(keys) if keys is not None else None, maxsize)
+        for key in subscription.keys if subscription.keys is not None else (None,):
+            self._subscribers[channel, key].add(subscription)
+        PUBSUB_SUBSCRIBERS.labels(channel).inc()
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        """Повторный вызов для той же подписки ничего не делает."""
+        if not subscription.active:
+            return
+        subscription.active = False
+        for key in subscription.keys if subscription.keys is not None else (None,):
+            subscribers = self._subscribers.get((subscription.channel, key))
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.channel, key]
+        PUBSUB_SUBSCRIBERS.labels(subscription.channel).dec()
+
+    def _dispatch(self, channel: str, payload: str):
+        # В одном NOTIFY — список событий {"key", "data"}
+        for message in orjson.loads(payload):
+            PUBSUB_MESSAGES.labels(channel).inc()
+            data = message["data"]
+            for subscription in self._subscribers.get((channel, message["key"]), ()):
+                subscription.offer(data)
+            for subscription in self._subscribers.get((channel, None), ()):
+                subscription.offer(data)
+
+    def _resync_all(self):
+        for subscribers in self._subscribers.values():
+            for subscription in subscribers:
+                subscription.offer(RESYNC)
+
+    # --- Публикация ---
+
+    def publish(self, db: Session, channel: str, key, data: dict):
+        """Ставит событие в транзакцию db: подписчики получат его после commit."""
+        self.publish_many(db, channel, [(key, data)])
+
+    def publish_many(self, db: Session, channel: str, events):
+        """События (key, data) одной транзакции — одним запросом, а не NOTIFY на событие."""
+        payloads = _pack(orjson.dumps({"key": key, "data": data}) for key, data in events)
+        if not payloads:
+            return
+        if db.get_bind().dialect.name == "postgresql":
+            db.execute(text("SELECT pg_notify(:channel, p) FROM unnest(CAST(:payloads AS text[])) AS p"),
+                       {"channel": channel, "payloads": payloads})
+        else:
+            pending = db.info.setdefault(_PENDING, [])
+            pending.extend((self, channel, payload) for payload in payloads)
+
+    def _dispatch_threadsafe(self, channel: str, payload: str):
+        # commit sync-роута идёт в пуле потоков, а очереди подписчиков живут в event loop
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._dispatch, channel, payload)
+
+    # --- LISTEN-соединение ---
+
+    async def start(self, engine, channels):
+        self._engine = engine
+        self._channels = tuple(channels)
+        self._loop = asyncio.get_running_loop()
+        if engine.dialect.name == "postgresql":
+            await self._connect()
+
+    def _open(self):
+        raw = self._engine.raw_connection()
+        # Соединение живёт всё время процесса — в пул его не возвращаем
+        raw.detach()
+        connection = raw.driver_connection
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            for channel in self._channels:
+                cursor.execute(f'LISTEN "{channel}"')
+        return raw
+
+    async def _connect(self):
+        delay = 0.1
+        while True:
+            try:
+                raw = await run_in_threadpool(self._open)
+                break
+            except Exception as e:
+                logger.warning("LISTEN %s: не удалось подключиться (%s), повтор через %.1f с",
+                               ",".join(self._channels), e, delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, PUBSUB_RECONNECT_MAX)
+        self._raw = raw
+        # Номер дескриптора запоминаем: у оборванного соединения fileno() уже не узнать
+        self._fd = raw.driver_connection.fileno()
+        self._loop.add_reader(self._fd, self._on_readable)
+        logger.info("LISTEN %s", ",".join(self._channels))
+
+    def _on_readable(self):
+        connection = self._raw.driver_connection
+        try:
+            connection.poll()
+        except Exception:
+            logger.exception("LISTEN-соединение оборвалось, переподключение")
+            self._close()
+            self._resync_all()
+            self._reconnect = self._loop.create_task(self._connect())
+            return
+        while connection.notifies:
+            notify = connection.notifies.pop(0)
+            try:
+                self._dispatch(notify.channel, notify.payload)
+            except Exception:
+                logger.exception("Некорректное событие в канале %s", notify.channel)
+
+    def _close(self):
+        if self._raw is None:
+            return
+        self._loop.remove_reader(self._fd)
+        try:
+            self._raw.close()
+        except Exception:
+            pass
+        self._raw = None
+
+    async def stop(self):
+        if self._reconnect is not None:
+            self._reconnect.cancel()
+        self._close()
+        self._loop = None
+
+
+def _pack(messages) -> list[str]:
+    """JSON-массивы сообщений, каждый не длиннее PUBSUB_PAYLOAD_MAX байт."""
+    payloads, chunk, size = [], [], 2
+    for message in messages:
+        if chunk and size + len(message) + 1 > PUBSUB_PAYLOAD_MAX:
+            payloads.append(b"[" + b",".join(chunk) + b"]")
+            chunk, size = [], 2
+        chunk.append(message)
+        size += len(message) + 1
+    if chunk:
+        payloads.append(b"[" + b",".join(chunk) + b"]")
+    return [payload.decode() for payload in payloads]
+
+
+broker = Broker()
+
+
+# Рассылка без Postgres: события сессии уходят только после успешного commit
+
+@event.listens_for(Session, "after_commit")
+def _dispatch_pending(session):
+    for target, channel, payload in session.info.pop(_PENDING, ()):
+        target._dispatch_threadsafe(channel, payload)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_pending(session):
+    session.info.pop(_PENDING, None)
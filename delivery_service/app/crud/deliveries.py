@@ -1,12 +1,79 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+
 import httpx
+from fastapi.concurrency import run_in_threadpool
+from prometheus_client import Counter
 from sqlalchemy.orm import Session
-from sqlalchemy import select, delete
+from sqlalchemy import Integer, String, column, func, select, update, values
 from fastapi import HTTPException, status
 
-from app.models.delivery import Delivery
-from app.schemas.delivery import DeliveryCreate, DeliveryUpdate
+from app.core.http_client import get_http_client
+from app.core.outbox import emit, emit_many
+from app.core.pubsub import broker
+from app.core.tombstones import delete_statement
+from app.db.database import SessionLocal
+from app.models.delivery import CLAIMABLE, LEASED, Delivery
+from app.schemas.delivery import (
+    BulkStatusItemResult, DeliveryCreate, DeliveryInDB, DeliveryStatusChange, DeliveryUpdate,
+)
+
+logger = logging.getLogger(__name__)
+
+# Колонки схемы DeliveryInDB — для быстрых списков и выгрузок без ORM-объектов
+DELIVERY_COLUMNS = (
+    Delivery.id, Delivery.order_id, Delivery.status, Delivery.address,
+    Delivery.created_at, Delivery.updated_at, Delivery.courier_id, Delivery.lease_expires_at,
+)
+
+ORDERS_SERVICE_URL = os.getenv("ORDERS_SERVICE_URL", "http://nginx_gateway/api/v1/orders")
+# Приёмник событий витрины заказов (orders_service: order_views)
+ORDER_VIEW_EVENTS_URL = os.getenv("ORDER_VIEW_EVENTS_URL", f"{ORDERS_SERVICE_URL}/view-events")
+ORDER_VIEW_TOPIC = "delivery"
+
+DELIVERY_STATUSES = ("processing", "shipped", "in_transit", "delivered", "failed")
+# Статус заказа, в который его переводит статус доставки (остальные статусы заказ не трогают)
+ORDER_STATUS_BY_DELIVERY = {"shipped": "shipped", "in_transit": "shipped", "delivered": "completed"}
+
+# Захват доставок курьерами (POST /claim): срок аренды и период sweeper'а просроченных
+DELIVERY_LEASE_SECONDS = float(os.getenv("DELIVERY_LEASE_SECONDS", "300"))
+LEASE_SWEEP_INTERVAL = float(os.getenv("LEASE_SWEEP_INTERVAL", "10"))
+CLAIM_MAX = 100
+
+DELIVERY_CLAIMS = Counter("delivery_claims_total", "Доставки, захваченные курьерами")
+DELIVERY_LEASES_EXPIRED = Counter("delivery_leases_expired_total", "Захваты, возвращённые в очередь по истечении аренды")
+
+# Канал LISTEN/NOTIFY с изменениями доставок (ключ события — id доставки)
+DELIVERY_CHANNEL = "delivery_status"
+# Пауза без событий, после которой в SSE-поток уходит комментарий-heartbeat:
+# держит соединение живым через прокси и вовремя выявляет отключившихся клиентов
+SSE_HEARTBEAT = float(os.getenv("SSE_HEARTBEAT", "15"))
+SSE_MAX_IDS = 100
+
+
+def delivery_event(db_delivery) -> dict:
+    """Представление доставки в событии — то же, что отдаёт GET /{delivery_id}."""
+    return DeliveryInDB.model_validate(db_delivery).model_dump(mode="json")
 
-ORDERS_SERVICE_URL = "http://nginx_gateway/api/v1/orders"
+
+# --- События для витрины заказов (outbox: уходят вместе с commit) ---
+
+def _view_state(db_delivery) -> dict:
+    return {
+        "id": db_delivery.id, "status": db_delivery.status, "address": db_delivery.address,
+        "courier_id": db_delivery.courier_id,
+    }
+
+
+def emit_delivery_state(db: Session, db_delivery):
+    """Текущее состояние доставки (ORM-объект или строка с колонками DELIVERY_COLUMNS)."""
+    emit(db, ORDER_VIEW_TOPIC, db_delivery.order_id, _view_state(db_delivery))
+
+
+def emit_delivery_deleted(db: Session, order_id: int):
+    emit(db, ORDER_VIEW_TOPIC, order_id, {"deleted": True})
 
 
 # --- Межсервисное общение ---
@@ -19,35 +86,35 @@ async def verify_order_ready_for_delivery(order_id: int):
     url = f"{ORDERS_SERVICE_URL}/{order_id}"
     TIMEOUT = 5.0
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(url, timeout=TIMEOUT)
+    client = get_http_client()
+    try:
+        response = await client.get(url, timeout=TIMEOUT)
 
-            if response.status_code == 404:
-                raise HTTPException(
-                    status_code=404,
-                    detail="Заказ не найден."
-                )
+        if response.status_code == 404:
+            raise HTTPException(
+                status_code=404,
+                detail="Заказ не найден."
+            )
 
-            order_data = response.json()
+        order_data = response.json()
 
-            allowed_statuses = ['paid', 'completed', 'shipped']
-            if order_data['status'] not in allowed_statuses:
-                raise HTTPException(
-                    status_code=400,
-                    detail=(
-                        f"Заказ имеет статус '{order_data['status']}' и не готов к доставке. "
-                        f"Требуется один из: {allowed_statuses}"
-                    )
+        allowed_statuses = ['paid', 'completed', 'shipped']
+        if order_data['status'] not in allowed_statuses:
+            raise HTTPException(
+                status_code=400,
+                detail=(
+                    f"Заказ имеет статус '{order_data['status']}' и не готов к доставке. "
+                    f"Требуется один из: {allowed_statuses}"
                 )
+            )
 
-            return True
+        return True
 
-        except httpx.RequestError:
-            raise HTTPException(
-                status_code=503,
-                detail="Service Unavailable"
-            )
+    except httpx.RequestError:
+        raise HTTPException(
+            status_code=503,
+            detail="Service Unavailable"
+        )
 
 
 # --- CRUD ---
@@ -64,14 +131,45 @@ async def create_delivery(db: Session, delivery: DeliveryCreate):
     )
 
     db.add(db_delivery)
+    db.flush()
+    emit_delivery_state(db, db_delivery)
     db.commit()
     db.refresh(db_delivery)
     return db_delivery
 
 
 # READ ALL
-def get_deliveries(db: Session, skip: int = 0, limit: int = 100):
-    return db.scalars(select(Delivery).offset(skip).limit(limit)).all()
+def _filter_deliveries(stmt, skip: int, limit: int, after_order_id=None, order_ids=None, changed_since=None):
+    """
+    Фильтры списка доставок. С after_order_id — keyset-страница по order_id (WHERE order_id > ...
+    ORDER BY order_id по частичному индексу): так сверка между сервисами читает таблицу
+    по порядку без OFFSET. changed_since — созданные или изменённые с этого момента.
+    """
+    if order_ids:
+        stmt = stmt.where(Delivery.order_id.in_(order_ids))
+    if changed_since is not None:
+        stmt = stmt.where(func.coalesce(Delivery.updated_at, Delivery.created_at) >= changed_since)
+    if after_order_id is not None:
+        return stmt.where(Delivery.order_id > after_order_id).order_by(Delivery.order_id).limit(limit)
+    return stmt.offset(skip).limit(limit)
+
+
+def get_deliveries(db: Session, skip: int = 0, limit: int = 100, **filters):
+    return db.scalars(_filter_deliveries(select(Delivery), skip, limit, **filters)).all()
+
+
+def get_delivery_rows(db: Session, skip: int = 0, limit: int = 100, **filters):
+    """Список доставок в виде Row (колонки схемы DeliveryInDB), без ORM-объектов."""
+    return db.execute(_filter_deliveries(select(*DELIVERY_COLUMNS), skip, limit, **filters)).all()
+
+
+def iter_delivery_partitions(db: Session, batch_size: int = 10_000):
+    """
+    Все доставки пачками по batch_size строк через серверный курсор (yield_per),
+    чтобы выгрузка не держала всю таблицу в памяти.
+    """
+    stmt = select(*DELIVERY_COLUMNS).order_by(Delivery.id).execution_options(yield_per=batch_size)
+    yield from db.execute(stmt).partitions()
 
 
 # READ ONE
@@ -79,6 +177,12 @@ def get_delivery(db: Session, delivery_id: int):
     return db.get(Delivery, delivery_id)
 
 
+def get_delivery_events(db: Session, delivery_ids) -> list[dict]:
+    """Текущее состояние доставок для начального снимка SSE-потока."""
+    deliveries = db.scalars(select(Delivery).where(Delivery.id.in_(delivery_ids)).order_by(Delivery.id)).all()
+    return [delivery_event(d) for d in deliveries]
+
+
 # UPDATE
 def update_delivery(db: Session, delivery_id: int, delivery: DeliveryUpdate):
     db_delivery = db.get(Delivery, delivery_id)
@@ -90,15 +194,172 @@ def update_delivery(db: Session, delivery_id: int, delivery: DeliveryUpdate):
         setattr(db_delivery, key, value)
 
     db.add(db_delivery)
+    if update_data:
+        # updated_at проставляет БД: перечитываем строку до commit, чтобы событие несло новую версию
+        db.flush()
+        db.refresh(db_delivery)
+        broker.publish(db, DELIVERY_CHANNEL, db_delivery.id, delivery_event(db_delivery))
+        emit_delivery_state(db, db_delivery)
     db.commit()
     db.refresh(db_delivery)
     return db_delivery
 
 
+def bulk_update_delivery_status(db: Session, changes: list[DeliveryStatusChange]) -> list[BulkStatusItemResult]:
+    """
+    Смена статусов многих доставок одним UPDATE ... FROM (VALUES ...) в одной транзакции
+    (вместо get/setattr/commit/refresh на каждую). Исход по каждому элементу:
+    updated, not_found, invalid_status или duplicate (повтор id в пакете).
+    """
+    results, rows, seen = [], [], set()
+    for change in changes:
+        if change.status not in DELIVERY_STATUSES:
+            results.append(BulkStatusItemResult(id=change.id, outcome="invalid_status"))
+        elif change.id in seen:
+            results.append(BulkStatusItemResult(id=change.id, outcome="duplicate"))
+        else:
+            seen.add(change.id)
+            rows.append((change.id, change.status))
+            results.append(BulkStatusItemResult(id=change.id, outcome="updated", status=change.status))
+
+    updated = {}
+    if rows:
+        # VALUES — как CTE: такую форму UPDATE ... FROM понимают и Postgres, и SQLite
+        changed = values(column("id", Integer), column("status", String), name="changes").data(rows).cte("changes")
+        for row in db.execute(
+            update(Delivery)
+            .where(Delivery.id == changed.c.id, Delivery.deleted_at.is_(None))
+            .values(status=changed.c.status)
+            .returning(*DELIVERY_COLUMNS)
+            .execution_options(synchronize_session=False)
+        ):
+            updated[row.id] = row
+        _publish_changes(db, list(updated.values()))
+        db.commit()
+
+    for result in results:
+        if result.outcome != "updated":
+            continue
+        if result.id in updated:
+            result.order_id = updated[result.id].order_id
+        else:
+            result.outcome, result.status = "not_found", None
+    return results
+
+
+async def sync_order_statuses(results: list[BulkStatusItemResult]):
+    """
+    Переводит заказы обновлённых доставок в соответствующий статус (ORDER_STATUS_BY_DELIVERY)
+    одним пакетным вызовом Orders Service. Исход пишется в order_status/order_sync элементов;
+    сбой Orders не откатывает уже закоммиченные статусы доставок.
+    """
+    affected = [r for r in results if r.outcome == "updated" and r.status in ORDER_STATUS_BY_DELIVERY]
+    if not affected:
+        return
+    # Несколько доставок одного заказа в пакете: побеждает последняя
+    order_changes = {r.order_id: ORDER_STATUS_BY_DELIVERY[r.status] for r in affected}
+
+    outcomes = {}
+    client = get_http_client()
+    try:
+        response = await client.patch(
+            f"{ORDERS_SERVICE_URL}/bulk-status",
+            json={"items": [{"id": order_id, "status": s} for order_id, s in order_changes.items()]},
+            timeout=5.0,
+        )
+        if response.status_code == 200:
+            outcomes = {item["id"]: item["outcome"] for item in response.json()["items"]}
+        else:
+            logger.warning("Orders Service отклонил пакетную смену статусов: %s", response.status_code)
+    except httpx.RequestError as e:
+        logger.warning("Не удалось передать статусы заказов в Orders Service: %s", e)
+
+    for result in affected:
+        result.order_status = order_changes[result.order_id]
+        result.order_sync = outcomes.get(result.order_id, "failed")
+
+
+# --- Очередь доставок для курьеров ---
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _publish_changes(db: Session, rows: list):
+    """
+    SSE-подписчикам и витрине заказов — новое состояние строк из RETURNING (до commit):
+    один запрос NOTIFY и многострочный INSERT в outbox на всю пачку вместо двух запросов на строку.
+    """
+    broker.publish_many(db, DELIVERY_CHANNEL, [(row.id, delivery_event(row)) for row in rows])
+    emit_many(db, ORDER_VIEW_TOPIC, [(row.order_id, _view_state(row)) for row in rows])
+
+
+def claim_deliveries(db: Session, courier_id: str, n: int = 1):
+    """
+    Атомарно захватывает до n самых старых свободных доставок (status='processing', без аренды)
+    и выставляет аренду на DELIVERY_LEASE_SECONDS.
+
+    Кандидаты выбираются по частичному индексу ix_deliveries_claimable с FOR UPDATE SKIP LOCKED:
+    строки, которые в этот момент захватывает другой курьер, пропускаются, а не ждут его
+    транзакции, — параллельные захваты не выстраиваются в очередь на блокировках и не получают
+    одну и ту же доставку. Весь захват — один UPDATE в короткой транзакции.
+    """
+    candidates = (
+        select(Delivery.id).where(CLAIMABLE).order_by(Delivery.created_at).limit(n)
+        .with_for_update(skip_locked=True).cte("candidates")
+    )
+    claimed = db.execute(
+        update(Delivery)
+        .where(Delivery.id == candidates.c.id)
+        .values(courier_id=courier_id, lease_expires_at=_now() + timedelta(seconds=DELIVERY_LEASE_SECONDS))
+        .returning(*DELIVERY_COLUMNS)
+        .execution_options(synchronize_session=False)
+    ).all()
+    _publish_changes(db, claimed)
+    db.commit()
+    DELIVERY_CLAIMS.inc(len(claimed))
+    # Порядок RETURNING не гарантирован
+    return sorted(claimed, key=lambda row: (row.created_at, row.id))
+
+
+def release_expired_leases(db: Session) -> int:
+    """Возвращает в очередь доставки, которые курьер захватил, но не отправил до конца аренды."""
+    released = db.execute(
+        update(Delivery)
+        .where(LEASED, Delivery.lease_expires_at < _now())
+        .values(courier_id=None, lease_expires_at=None)
+        .returning(*DELIVERY_COLUMNS)
+        .execution_options(synchronize_session=False)
+    ).all()
+    _publish_changes(db, released)
+    db.commit()
+    DELIVERY_LEASES_EXPIRED.inc(len(released))
+    return len(released)
+
+
+def _sweep_leases() -> int:
+    with SessionLocal() as db:
+        return release_expired_leases(db)
+
+
+async def lease_sweeper():
+    """Фоновая задача lifespan: каждые LEASE_SWEEP_INTERVAL снимает просроченные захваты."""
+    while True:
+        try:
+            released = await run_in_threadpool(_sweep_leases)
+            if released:
+                logger.info("Возвращено в очередь доставок с истёкшей арендой: %d", released)
+        except Exception:
+            logger.exception("Ошибка при снятии просроченных захватов")
+        await asyncio.sleep(LEASE_SWEEP_INTERVAL)
+
+
 # DELETE по ID
 def delete_delivery(db: Session, delivery_id: int):
-    stmt = delete(Delivery).where(Delivery.id == delivery_id).returning(Delivery.id)
-    if db.scalar(stmt):
+    stmt = delete_statement(Delivery, Delivery.id == delivery_id).returning(Delivery.order_id)
+    deleted = db.execute(stmt).first()
+    if deleted:
+        emit_delivery_deleted(db, deleted.order_id)
         db.commit()
         return True
     return False
@@ -111,13 +372,16 @@ def delete_delivery_by_order_id(db: Session, order_id: int) -> bool:
     Удаляет запись о доставке по order_id.
     Используется для каскадного удаления (когда удаляется заказ или пользователь).
     """
-    stmt = delete(Delivery).where(Delivery.order_id == order_id).returning(Delivery.id)
+    stmt = delete_statement(Delivery, Delivery.order_id == order_id)
     deleted_id = db.scalar(stmt)
     if deleted_id:
-        db.commit()
-        print(f"✅ Доставка для order_id={order_id} удалена")
+        emit_delivery_deleted(db, order_id)
+    # Коммитим и пустой DELETE: иначе транзакция с блокировкой висит до закрытия сессии
+    db.commit()
+    if deleted_id:
+        logger.info("Доставка для order_id=%s удалена", order_id)
         return True
 
     # Записи может не быть — это не ошибка для каскадного сценария
-    print(f"ℹ️ Доставка для order_id={order_id} не найдена, ничего не удаляем")
+    logger.info("Доставка для order_id=%s не найдена, ничего не удаляем", order_id)
     return False
@@ -1,9 +1,16 @@
+import logging
 from sqlalchemy.orm import Session
+from app.core.idempotency import idempotency_metadata
+from app.core.outbox import outbox_metadata
 from app.db.database import Base, engine
 from app.models.delivery import Delivery
 
+logger = logging.getLogger(__name__)
+
 def init_db():
     Base.metadata.create_all(bind=engine)
+    idempotency_metadata.create_all(bind=engine)
+    outbox_metadata.create_all(bind=engine)
 
     db: Session = Session(bind=engine)
     try:
@@ -20,10 +27,10 @@ def init_db():
                 db.add(db_delivery)
             
             db.commit()
-            print("База данных доставок проинициализирована 3 тестовыми записями.")
+            logger.info("База данных доставок проинициализирована 3 тестовыми записями.")
         else:
-            print("База данных доставок уже содержит данные, пропуск инициализации.")
+            logger.info("База данных доставок уже содержит данные, пропуск инициализации.")
     except Exception as e:
-        print(f"Ошибка инициализации БД доставок: {e}")
+        logger.exception("Ошибка инициализации БД доставок: %s", e)
     finally:
         db.close()
\ No newline at end of file
@@ -1,14 +1,81 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from app.api.v1 import endpoints
+from app.core.admission import ADMISSION_ENABLED, AdmissionMiddleware
+from app.core.idempotency import IdempotencyMiddleware, idempotency_purger
+from app.core.logging_setup import RequestIdMiddleware, setup_logging
+from app.core.metrics import MetricsMiddleware, instrument_engine, metrics_router
+from app.core.outbox import outbox_relay
+from app.core.profiling import PROFILING_ENABLED, ProfilingMiddleware, profiling_router
+from app.core.pubsub import broker
+from app.core.sql_stats import SqlStatsMiddleware, instrument_engine_sql_stats
+from app.core.startup import probes_router, run_shutdown, run_startup
+from app.core.tombstones import tombstone_purger
+from app.core.tracing import TracingMiddleware, configure_tracing, instrument_engine_tracing
+from app.crud.deliveries import DELIVERY_CHANNEL, ORDER_VIEW_EVENTS_URL, ORDERS_SERVICE_URL, lease_sweeper
+from app.db.database import engine
+from app.db.init_db import init_db
+from app.models.delivery import Delivery
 import os
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await run_startup(
+        engine, init_db, lock_name="delivery_service.init_db",
+        dependency_urls=[ORDERS_SERVICE_URL],
+    )
+    purger = asyncio.create_task(idempotency_purger(engine))
+    # Физическое удаление помеченных строк — пачками, в окно PURGE_WINDOW
+    tombstones = asyncio.create_task(tombstone_purger(engine, [Delivery.__table__]))
+    # Захваты курьеров с истёкшей арендой возвращаются в очередь
+    leases = asyncio.create_task(lease_sweeper())
+    # События доставок для витрины заказов
+    relay = asyncio.create_task(outbox_relay(engine, ORDER_VIEW_EVENTS_URL))
+    # Одно LISTEN-соединение на процесс: изменения доставок для SSE-подписчиков всех воркеров
+    await broker.start(engine, [DELIVERY_CHANNEL])
+    yield
+    await broker.stop()
+    relay.cancel()
+    leases.cancel()
+    tombstones.cancel()
+    purger.cancel()
+    await run_shutdown(engine)
+
+
 app = FastAPI(
     title="Delivery Microservice",
     docs_url="/docs",
     openapi_url="/openapi.json",
-    root_path="/api/v1/delivery"
+    root_path="/api/v1/delivery",
+    lifespan=lifespan,
 )
 
+setup_logging("delivery_service")
+configure_tracing("delivery_service")
+instrument_engine(engine)
+instrument_engine_tracing(engine)
+instrument_engine_sql_stats(engine)
+# Повтор POST с тем же Idempotency-Key отдаёт сохранённый ответ, не доходя до обработчика
+app.add_middleware(IdempotencyMiddleware, engine=engine)
+if PROFILING_ENABLED:
+    # Без PROFILING_TOKEN профилирование не подключается вовсе
+    app.add_middleware(ProfilingMiddleware)
+app.add_middleware(SqlStatsMiddleware)
+if ADMISSION_ENABLED:
+    # Снаружи idempotency и SQL: отклонённый запрос не доходит до БД, но попадает в метрики и логи
+    app.add_middleware(AdmissionMiddleware)
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(TracingMiddleware)
+app.add_middleware(RequestIdMiddleware)
+
+# Служебные роуты подключаем раньше /{id} из endpoints, иначе он их перехватит
+app.include_router(probes_router)
+app.include_router(metrics_router)
+if PROFILING_ENABLED:
+    app.include_router(profiling_router)
 app.include_router(endpoints.router, prefix="", tags=["delivery"])
 
 @app.get("/")
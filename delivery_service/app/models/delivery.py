@@ -1,17 +1,53 @@
-from sqlalchemy import Column, Integer, String, DateTime
+from datetime import datetime, timezone
+
+from sqlalchemy import Column, Integer, String, DateTime, Index, text
 from sqlalchemy.sql import func
+from app.core.tombstones import SoftDeleteMixin, live_index, tombstone_index
 from app.db.database import Base
 
-class Delivery(Base):
+
+def _now() -> datetime:
+    # Время изменения — из Python, с микросекундами: func.now() в SQLite — с точностью до секунды,
+    # и два изменения за секунду давали одинаковый updated_at, а значит и ETag (ложный 304)
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+# Условие частичного индекса очереди; в запросах захвата оно повторяется дословно,
+# иначе планировщик индекс не выберет
+CLAIMABLE = text("status = 'processing' AND lease_expires_at IS NULL AND deleted_at IS NULL")
+LEASED = text("status = 'processing' AND lease_expires_at IS NOT NULL AND deleted_at IS NULL")
+
+
+class Delivery(SoftDeleteMixin, Base):
     __tablename__ = "deliveries"
+    __table_args__ = (
+        # Одна живая доставка на заказ
+        live_index("uq_deliveries_order_id_live", "order_id", unique=True),
+        tombstone_index("deliveries"),
+        # Очередь на захват курьерами (POST /claim): только свободные доставки в порядке создания.
+        # Индекс маленький — строка выпадает из него, как только её захватили или отправили.
+        Index(
+            "ix_deliveries_claimable", "created_at",
+            postgresql_where=CLAIMABLE, sqlite_where=CLAIMABLE,
+        ),
+        # Действующие захваты — для sweeper'а просроченных
+        Index(
+            "ix_deliveries_leased", "lease_expires_at",
+            postgresql_where=LEASED, sqlite_where=LEASED,
+        ),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     
     # ID заказа, который доставляется
-    order_id = Column(Integer, unique=True, nullable=False, index=True) 
+    order_id = Column(Integer, nullable=False)
     
     status = Column(String, default="processing") # processing, shipped, in_transit, delivered, failed
     address = Column(String, nullable=False)
     
+    # Захват курьером: кто взял и до какого времени (UTC); просроченный захват снимает sweeper
+    courier_id = Column(String(64), nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+
     created_at = Column(DateTime, server_default=func.now())
-    updated_at = Column(DateTime, onupdate=func.now())
\ No newline at end of file
+    updated_at = Column(DateTime, onupdate=_now)
\ No newline at end of file
@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field
+from typing import List, Optional
 from datetime import datetime
 
 class DeliveryCreate(BaseModel):
@@ -17,6 +17,37 @@ class DeliveryInDB(BaseModel):
     address: str
     created_at: datetime
     updated_at: Optional[datetime] = None
+    # Захват курьером (POST /claim): до lease_expires_at доставка закреплена за courier_id
+    courier_id: Optional[str] = None
+    lease_expires_at: Optional[datetime] = None
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+class ClaimedDelivery(DeliveryInDB):
+    courier_id: str
+    lease_expires_at: datetime
+
+
+# Пакетная смена статусов курьерскими терминалами (PATCH /bulk-status)
+BULK_STATUS_MAX_ITEMS = 1000
+
+class DeliveryStatusChange(BaseModel):
+    id: int
+    status: str
+
+class BulkStatusUpdate(BaseModel):
+    items: List[DeliveryStatusChange] = Field(..., min_length=1, max_length=BULK_STATUS_MAX_ITEMS)
+
+class BulkStatusItemResult(BaseModel):
+    id: int
+    outcome: str  # updated, not_found, invalid_status, duplicate
+    status: Optional[str] = None
+    order_id: Optional[int] = None
+    # Заказ, статус которого сменился вслед за доставкой: новый статус и исход синхронизации с Orders
+    order_status: Optional[str] = None
+    order_sync: Optional[str] = None  # updated, not_found, failed
+
+class BulkStatusResult(BaseModel):
+    updated: int
+    items: List[BulkStatusItemResult]
@@ -1,14 +1,29 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
 from sqlalchemy.orm import Session
-from typing import List
-
-from app.db.database import get_db
-from app.schemas.order import OrderInDB, OrderCreate, OrderUpdate
+from typing import List, Literal, Optional
+
+from app.core.bulk_formats import (
+    BULK_RESPONSES, JSON, bulk_response, export_response, negotiate_media_type,
+)
+from app.core.etag import make_etag, etag_matches
+from app.core.fast_json import FAST_JSON_ENABLED, rows_response
+from app.core.jobs import JobStatus, start_job
+from app.db.database import SessionLocal, get_db
+from app.schemas.order import (
+    BulkStatusResult, BulkStatusUpdate, OrderFull, OrderInDB, OrderCreate, OrderUpdate,
+    ViewEventBatch, ViewEventsResult,
+)
+from app.crud import order_views as crud_order_views
 from app.crud import orders as crud_orders
 
 router = APIRouter()
 
 
+def _order_version(db_order):
+    """Версия заказа для ETag: id + время последнего изменения."""
+    return db_order.id, db_order.updated_at or db_order.created_at
+
+
 # CREATE
 @router.post("/", response_model=OrderInDB, status_code=status.HTTP_201_CREATED)
 async def create_order_route(order: OrderCreate, db: Session = Depends(get_db)):
@@ -25,23 +40,106 @@ async def create_order_route(order: OrderCreate, db: Session = Depends(get_db)):
 
 
 # READ ALL
-@router.get("/", response_model=List[OrderInDB])
-def read_orders_route(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    """Получение списка всех заказов."""
-    orders = crud_orders.get_orders(db, skip=skip, limit=limit)
+@router.get("/", response_model=List[OrderInDB], responses=BULK_RESPONSES)
+def read_orders_route(
+    request: Request,
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    user_id: Optional[int] = None,
+    after_id: Optional[int] = Query(None, description="keyset-страница по id"),
+    expand: Optional[Literal["full"]] = None,
+    db: Session = Depends(get_db),
+):
+    """
+    Получение списка заказов (If-None-Match, JSON / MessagePack / Arrow).
+    expand=full — строки витрины (OrderFull) вместе с платежом и доставкой.
+    """
+    media_type = negotiate_media_type(request)
+    if expand == "full":
+        return _read_order_views(request, media_type, skip, limit, user_id, db)
+    if FAST_JSON_ENABLED or media_type != JSON:
+        orders = crud_orders.get_order_rows(db, skip=skip, limit=limit, user_id=user_id, after_id=after_id)
+    else:
+        orders = crud_orders.get_orders(db, skip=skip, limit=limit, user_id=user_id, after_id=after_id)
+
+    # ETag считаем до сериализации: при совпадении отдаём 304 без тела.
+    # Представления в разных форматах различаются, поэтому формат входит в ETag.
+    etag = make_etag(media_type, *(_order_version(o) for o in orders))
+    headers = {"ETag": etag, "Vary": "Accept"}
+    if etag_matches(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    if media_type != JSON:
+        return bulk_response(orders, crud_orders.ORDER_COLUMNS, media_type, headers=headers)
+    if FAST_JSON_ENABLED:
+        return rows_response(orders, headers=headers)
+
+    response.headers.update(headers)
     return orders
 
 
+def _read_order_views(request: Request, media_type: str, skip: int, limit: int, user_id, db: Session):
+    views = crud_order_views.get_order_view_rows(db, skip=skip, limit=limit, user_id=user_id)
+    etag = make_etag(media_type, "full", *((v.order_id, v.refreshed_at) for v in views))
+    headers = {"ETag": etag, "Vary": "Accept"}
+    if etag_matches(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    if media_type != JSON:
+        return bulk_response(views, crud_order_views.ORDER_VIEW_COLUMNS, media_type, headers=headers)
+    return rows_response(views, headers=headers)
+
+
+# EXPORT (потоковая выгрузка всей таблицы)
+@router.get("/export", responses=BULK_RESPONSES)
+def export_orders_route(request: Request, batch_size: int = 10_000):
+    """
+    Потоковая выгрузка всех заказов: Arrow IPC stream, MessagePack или NDJSON (по Accept).
+    Строки читаются серверным курсором пачками по batch_size и сразу уходят клиенту.
+    """
+    def partitions():
+        # Своя сессия: генератор живёт дольше, чем зависимость get_db
+        db = SessionLocal()
+        try:
+            yield from crud_orders.iter_order_partitions(db, batch_size=batch_size)
+        finally:
+            db.close()
+
+    return export_response(partitions(), crud_orders.ORDER_COLUMNS, negotiate_media_type(request))
+
+
 # READ ONE
 @router.get("/{order_id}", response_model=OrderInDB)
-def read_order_route(order_id: int, db: Session = Depends(get_db)):
-    """Получение заказа по ID."""
+def read_order_route(order_id: int, request: Request, response: Response, db: Session = Depends(get_db)):
+    """Получение заказа по ID (поддерживает If-None-Match)."""
     db_order = crud_orders.get_order(db, order_id=order_id)
     if db_order is None:
         raise HTTPException(status_code=404, detail="Order not found")
+
+    etag = make_etag(*_order_version(db_order))
+    if etag_matches(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+    response.headers["ETag"] = etag
     return db_order
 
 
+# READ ONE вместе с платежом и доставкой (витрина)
+@router.get("/{order_id}/full", response_model=OrderFull)
+def read_order_full_route(order_id: int, request: Request, response: Response, db: Session = Depends(get_db)):
+    """Заказ, его платёж и доставка одним чтением витрины (поддерживает If-None-Match)."""
+    view = crud_order_views.get_order_view(db, order_id)
+    if view is None:
+        raise HTTPException(status_code=404, detail="Order not found")
+
+    etag = make_etag(view.order_id, view.refreshed_at)
+    if etag_matches(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+    response.headers["ETag"] = etag
+    return view
+
+
 # UPDATE
 @router.put("/{order_id}", response_model=OrderInDB)
 def update_order_route(order_id: int, order: OrderUpdate, db: Session = Depends(get_db)):
@@ -91,12 +189,39 @@ async def update_order_status_route(
 
     return updated_order
 
-@router.delete("/by-user/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_orders_by_user_route(user_id: int, db: Session = Depends(get_db)):
+
+@router.patch("/bulk-status", response_model=BulkStatusResult)
+def bulk_update_order_status_route(changes: BulkStatusUpdate, db: Session = Depends(get_db)):
+    """
+    Пакетная смена статусов заказов одним запросом и одной транзакцией
+    (вызывается Delivery Service при пакетной синхронизации курьеров).
+    Исход по каждому элементу — в items; неизвестные id и статусы не мешают остальным.
+    """
+    items = crud_orders.bulk_update_order_status(db, changes.items)
+    return BulkStatusResult(updated=sum(item.outcome == "updated" for item in items), items=items)
+
+
+@router.post("/view-events", response_model=ViewEventsResult)
+def apply_view_events_route(batch: ViewEventBatch, db: Session = Depends(get_db)):
+    """
+    Приём событий платежей и доставок для витрины (outbox relay Payments / Delivery).
+    Повтор пачки безопасен: событие не старше применённого ничего не меняет.
+    """
+    return crud_order_views.apply_view_events(db, batch.events)
+
+
+@router.delete("/by-user/{user_id}", response_model=JobStatus, status_code=status.HTTP_202_ACCEPTED)
+async def delete_orders_by_user_route(
+    user_id: int,
+    request: Request,
+    response: Response,
+    batch_size: int | None = Query(None, ge=1, le=1000),
+):
     """
-    Каскадно удаляет все заказы пользователя:
-    - вызывается Users Service при удалении пользователя
+    Каскадно удаляет все заказы пользователя фоновой задачей (вызывается Users Service):
+    - сразу отвечает 202 с id задачи, ход — GET /jobs/{id} (Location)
+    - если каскад для пользователя уже идёт, возвращает существующую задачу
     """
-    await crud_orders.cascade_delete_orders_by_user(db, user_id=user_id)
-    # Даже если заказов не было, возвращаем 204 — это нормально
-    return
\ No newline at end of file
+    job = await start_job("cascade_delete_orders_by_user", user_id, batch_size)
+    response.headers["Location"] = f"{request.scope.get('root_path', '')}/jobs/{job.id}"
+    return job
@@ -0,0 +1,125 @@
+from datetime import datetime
+
+import msgpack
+import orjson
+import pyarrow as pa
+from fastapi import Request
+from fastapi.responses import Response, StreamingResponse
+from sqlalchemy import Boolean, DateTime, Float, Integer, String
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+NDJSON = "application/x-ndjson"
+
+SUPPORTED_MEDIA_TYPES = (JSON, MSGPACK, ARROW_STREAM)
+
+# Для OpenAPI: списки и экспорт умеют отдавать бинарные форматы
+BULK_RESPONSES = {200: {"content": {MSGPACK: {}, ARROW_STREAM: {}}}}
+
+# Маркер конца IPC-потока Arrow (continuation token + нулевая длина)
+_ARROW_EOS = b"\xff\xff\xff\xff\x00\x00\x00\x00"
+
+_ARROW_TYPES = (
+    (Boolean, pa.bool_()),
+    (Integer, pa.int64()),
+    (Float, pa.float64()),
+    (DateTime, pa.timestamp("us")),
+    (String, pa.string()),
+)
+
+
+def negotiate_media_type(request: Request) -> str:
+    """
+    Выбирает формат ответа по заголовку Accept (с учётом q-весов).
+    По умолчанию — JSON.
+    """
+    header = request.headers.get("accept")
+    if not header:
+        return JSON
+
+    candidates = []
+    for position, part in enumerate(header.split(",")):
+        media_type, *params = [p.strip() for p in part.split(";")]
+        quality = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        if media_type in SUPPORTED_MEDIA_TYPES and quality > 0:
+            candidates.append((-quality, position, media_type))
+
+    return min(candidates)[2] if candidates else JSON
+
+
+def arrow_schema(columns) -> pa.Schema:
+    """Arrow-схема по колонкам SQLAlchemy (тот же набор, что в select)."""
+    fields = []
+    for column in columns:
+        arrow_type = next(
+            (t for sa_type, t in _ARROW_TYPES if isinstance(column.expression.type, sa_type)),
+            pa.string(),
+        )
+        fields.append(pa.field(column.key, arrow_type))
+    return pa.schema(fields)
+
+
+def _record_batch(rows, schema: pa.Schema) -> pa.RecordBatch:
+    # Транспонируем строки в колонки одним проходом
+    columns = list(zip(*rows)) if rows else [()] * len(schema)
+    arrays = [pa.array(values, type=field.type) for values, field in zip(columns, schema)]
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def iter_arrow_stream(partitions, schema: pa.Schema):
+    """
+    Arrow IPC stream по частям: schema → record batch на каждую пачку строк → EOS.
+    Каждая пачка (партиция курсора) сериализуется и отдаётся сразу, без буферизации всего ответа.
+    """
+    yield schema.serialize().to_pybytes()
+    for rows in partitions:
+        yield _record_batch(rows, schema).serialize().to_pybytes()
+    yield _ARROW_EOS
+
+
+def _msgpack_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialize {type(value)!r}")
+
+
+def pack_rows(rows) -> bytes:
+    """Строки в MessagePack: массив map-ов, как в JSON (даты — ISO-строки)."""
+    return msgpack.packb([row._asdict() for row in rows], default=_msgpack_default)
+
+
+def bulk_response(rows, columns, media_type: str, headers: dict | None = None) -> Response:
+    """Готовый бинарный ответ для уже выбранной страницы строк."""
+    if media_type == ARROW_STREAM:
+        body = b"".join(iter_arrow_stream([rows], arrow_schema(columns)))
+    else:
+        body = pack_rows(rows)
+    return Response(content=body, media_type=media_type, headers=headers)
+
+
+def export_response(partitions, columns, media_type: str) -> StreamingResponse:
+    """
+    Потоковый экспорт всей таблицы: partitions — итератор пачек строк из серверного курсора.
+    Arrow — IPC stream, MessagePack — поток map-ов (читается msgpack.Unpacker), иначе NDJSON.
+    """
+    if media_type == ARROW_STREAM:
+        body = iter_arrow_stream(partitions, arrow_schema(columns))
+    elif media_type == MSGPACK:
+        body = (
+            b"".join(msgpack.packb(row._asdict(), default=_msgpack_default) for row in rows)
+            for rows in partitions
+        )
+    else:
+        media_type = NDJSON
+        body = (
+            b"".join(orjson.dumps(row._asdict()) + b"\n" for row in rows)
+            for rows in partitions
+        )
+    return StreamingResponse(body, media_type=media_type)
@@ -0,0 +1,29 @@
+import hashlib
+
+from fastapi import Request
+
+
+def make_etag(*parts) -> str:
+    """
+    Строит слабый ETag (W/"...") из версионных полей ресурса (id, updated_at, ...).
+    Значение стабильно между репликами, т.к. зависит только от данных в БД.
+    """
+    digest = hashlib.blake2b(repr(parts).encode("utf-8"), digest_size=8).hexdigest()
+    return f'W/"{digest}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """
+    Слабое сравнение If-None-Match с текущим ETag (RFC 9110, 13.1.2).
+    """
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+
+    current = etag.removeprefix("W/")
+    return any(
+        candidate.strip().removeprefix("W/") == current
+        for candidate in header.split(",")
+    )
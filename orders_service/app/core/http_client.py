@@ -0,0 +1,151 @@
+import asyncio
+import os
+import time
+
+import httpx
+from prometheus_client import Counter
+
+from app.core.metrics import InstrumentedTransport, dependency_name
+from app.core.tracing import TracingTransport
+
+# Общий клиент на процесс: межсервисные вызовы переиспользуют keepalive-соединения
+# вместо открытия нового TCP-соединения на каждый запрос.
+TIMEOUT = 5.0
+# Метка межсервисного вызова: шлюз отдаёт такие запросы мимо microcache (nginx/microcache.conf) —
+# проверки согласованности (активные заказы и доставки пользователя) не читают списки секундной давности
+INTERNAL_HEADER = "X-Internal-Call"
+
+# Single-flight: одновременные одинаковые GET делят один запрос к зависимости и его ответ.
+# HTTP_COALESCE_TTL > 0 — ещё и короткое переиспользование ответа 200 после завершения
+# (по умолчанию выключено: ответ может устареть на это время).
+HTTP_COALESCE_ENABLED = os.getenv("HTTP_COALESCE_ENABLED", "1") == "1"
+HTTP_COALESCE_TTL = float(os.getenv("HTTP_COALESCE_TTL", "0"))
+HTTP_COALESCE_MAX_CACHED = 1000
+# Заголовки, от которых зависит ответ: запросы с разными значениями не объединяются
+COALESCE_VARY = ("accept", "accept-encoding", "authorization", "cookie")
+
+OUTBOUND_COALESCED = Counter(
+    "outbound_coalesced_requests_total", "Исходящие GET по исходу объединения",
+    ["dependency", "outcome"],  # sent — ушёл в сеть, joined — дождался чужого запроса, reused — взят из TTL
+)
+# Доля объединённых: sum(rate(...{outcome=~"joined|reused"})) / sum(rate(...))
+
+_client: httpx.AsyncClient | None = None
+# Подмена сетевого транспорта (in-process стенд: httpx.ASGITransport вместо TCP)
+_base_transport: httpx.AsyncBaseTransport | None = None
+
+
+class _SharedResponse:
+    """Ответ, прочитанный целиком: из него каждый ожидающий получает свой httpx.Response."""
+
+    __slots__ = ("status_code", "headers", "content", "extensions")
+
+    def __init__(self, status_code: int, headers, content: bytes, extensions: dict):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.extensions = extensions
+
+    def build(self, request: httpx.Request) -> httpx.Response:
+        return httpx.Response(
+            self.status_code, headers=self.headers, stream=httpx.ByteStream(self.content),
+            request=request, extensions=self.extensions,
+        )
+
+
+class CoalescingTransport(httpx.AsyncBaseTransport):
+    """
+    Обёртка транспорта httpx: single-flight для GET. Первый запрос с данным ключом
+    (URL + COALESCE_VARY) уходит в сеть отдельной задачей, остальные ждут её результат —
+    и ответ, и исключение. Отмена одного ожидающего (клиент ушёл) не обрывает запрос
+    для остальных. Отключить для запроса: extensions={"coalesce": False}.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, ttl: float = HTTP_COALESCE_TTL):
+        self._transport = transport
+        self._ttl = ttl
+        self._inflight: dict[tuple, asyncio.Task] = {}
+        self._cached: dict[tuple, tuple[float, _SharedResponse]] = {}
+
+    @staticmethod
+    def _key(request: httpx.Request) -> tuple:
+        return (str(request.url), *(request.headers.get(name) for name in COALESCE_VARY))
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if request.method != "GET" or not request.extensions.get("coalesce", True):
+            return await self._transport.handle_async_request(request)
+
+        dependency = dependency_name(request.url)
+        key = self._key(request)
+        if self._ttl > 0:
+            cached = self._cached.get(key)
+            if cached is not None and cached[0] > time.monotonic():
+                OUTBOUND_COALESCED.labels(dependency, "reused").inc()
+                return cached[1].build(request)
+
+        task = self._inflight.get(key)
+        if task is None:
+            OUTBOUND_COALESCED.labels(dependency, "sent").inc()
+            task = asyncio.ensure_future(self._fetch(key, request))
+            # Исключение забираем, даже если все ожидающие уже отменены
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self._inflight[key] = task
+        else:
+            OUTBOUND_COALESCED.labels(dependency, "joined").inc()
+        shared = await asyncio.shield(task)
+        return shared.build(request)
+
+    async def _fetch(self, key: tuple, request: httpx.Request) -> _SharedResponse:
+        try:
+            response = await self._transport.handle_async_request(request)
+            try:
+                content = await response.aread()
+            finally:
+                await response.aclose()
+            # Тело уже распаковано: копии отдаются без Content-Encoding
+            headers = httpx.Headers(response.headers)
+            headers.pop("content-encoding", None)
+            headers["content-length"] = str(len(content))
+            shared = _SharedResponse(response.status_code, headers, content, response.extensions)
+            if self._ttl > 0 and response.status_code == 200:
+                self._remember(key, shared)
+            return shared
+        finally:
+            self._inflight.pop(key, None)
+
+    def _remember(self, key: tuple, shared: _SharedResponse):
+        now = time.monotonic()
+        if len(self._cached) >= HTTP_COALESCE_MAX_CACHED:
+            self._cached = {k: v for k, v in self._cached.items() if v[0] > now}
+            if len(self._cached) >= HTTP_COALESCE_MAX_CACHED:
+                self._cached.clear()
+        self._cached[key] = (now + self._ttl, shared)
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+def set_base_transport(transport: httpx.AsyncBaseTransport | None):
+    """Задаёт транспорт для следующего создаваемого клиента; None — обычный TCP."""
+    global _base_transport
+    _base_transport = transport
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Возвращает общий AsyncClient (создаётся лениво в текущем event loop)."""
+    global _client
+    if _client is None or _client.is_closed:
+        limits = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=30.0)
+        transport = InstrumentedTransport(TracingTransport(_base_transport or httpx.AsyncHTTPTransport(limits=limits)))
+        # Снаружи метрик и трейсинга: в них попадают только запросы, ушедшие в сеть
+        if HTTP_COALESCE_ENABLED:
+            transport = CoalescingTransport(transport)
+        _client = httpx.AsyncClient(timeout=TIMEOUT, transport=transport, headers={INTERNAL_HEADER: "1"})
+    return _client
+
+
+async def close_http_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
@@ -0,0 +1,256 @@
+"""
+Фоновые задачи с сохранённым состоянием: долгие каскады выполняются вне HTTP-запроса.
+
+Роут создаёт задачу (start_job) и сразу отвечает 202 с её id; ход выполнения —
+GET /jobs/{id} (processed/total, status, error). Задача хранится в таблице background_jobs
+БД сервиса и запускается в этом же процессе. Обработчик идёт пачками по batch_size и
+после каждой пачки сохраняет прогресс (checkpoint) — это же служит heartbeat.
+
+Перезапуск: фоновый job_worker подхватывает задачи со status=pending (повтор после
+временной ошибки) и running без heartbeat дольше JOB_STALE_AFTER (процесс упал).
+Обработчики идемпотентны и продолжают с сохранённого state / оставшихся строк.
+
+Ошибки: JobFailed и HTTPException 4xx — окончательные (status=failed); остальные
+повторяются до JOB_MAX_ATTEMPTS попыток.
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+
+from fastapi import APIRouter, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from prometheus_client import Counter
+from pydantic import BaseModel
+from sqlalchemy import (
+    JSON, Column, DateTime, Index, Integer, MetaData, String, Table, Text, insert, or_, select, text, update,
+)
+from sqlalchemy.exc import IntegrityError
+
+logger = logging.getLogger(__name__)
+
+JOB_BATCH_SIZE = int(os.getenv("JOB_BATCH_SIZE", "50"))
+# running без checkpoint дольше этого считается брошенной (процесс упал)
+JOB_STALE_AFTER = float(os.getenv("JOB_STALE_AFTER", "60"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "5"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+
+JOBS_FINISHED = Counter("background_jobs_total", "Завершённые фоновые задачи", ["kind", "status"])
+
+# Своя MetaData, как у idempotency_keys: таблица создаётся из init_db сервиса
+jobs_metadata = MetaData()
+
+background_jobs = Table(
+    "background_jobs", jobs_metadata,
+    Column("id", Integer, primary_key=True),
+    Column("kind", String(64), nullable=False),
+    Column("subject_id", Integer, nullable=False, index=True),
+    Column("status", String(16), nullable=False, index=True),  # pending, running, completed, failed
+    Column("batch_size", Integer, nullable=False),
+    Column("processed", Integer, nullable=False, default=0),
+    Column("total", Integer, nullable=True),
+    Column("state", JSON, nullable=False, default=dict),  # курсор/фаза обработчика
+    Column("error", Text, nullable=True),
+    Column("attempts", Integer, nullable=False, default=1),
+    Column("created_at", DateTime, nullable=False),
+    Column("updated_at", DateTime, nullable=False, index=True),
+    # Не больше одной активной задачи на каскад — и между репликами / воркерами gunicorn
+    Index(
+        "uq_background_jobs_active", "kind", "subject_id", unique=True,
+        postgresql_where=text("status IN ('pending', 'running')"),
+        sqlite_where=text("status IN ('pending', 'running')"),
+    ),
+)
+
+ACTIVE_STATUSES = ("pending", "running")
+
+
+class JobStatus(BaseModel):
+    id: int
+    kind: str
+    subject_id: int
+    status: str
+    processed: int
+    total: int | None = None
+    error: str | None = None
+    created_at: datetime
+    updated_at: datetime
+
+
+class JobFailed(Exception):
+    """Окончательная ошибка задачи: повторять бессмысленно."""
+
+
+_engine = None
+_handlers: dict = {}
+# Ссылки на запущенные asyncio-задачи, иначе их может собрать GC
+_running: dict = {}
+
+
+def configure_jobs(engine, handlers: dict):
+    """handlers: kind → async def handler(job: Job)."""
+    global _engine, _handlers
+    _engine = engine
+    _handlers = handlers
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _fetch(job_id: int):
+    with _engine.connect() as conn:
+        return conn.execute(select(background_jobs).where(background_jobs.c.id == job_id)).first()
+
+
+def _write(job_id: int, **values):
+    with _engine.begin() as conn:
+        conn.execute(update(background_jobs).where(background_jobs.c.id == job_id)
+                     .values(updated_at=_now(), **values))
+
+
+class Job:
+    """Состояние задачи для обработчика; checkpoint сохраняет прогресс и продлевает heartbeat."""
+
+    def __init__(self, row):
+        self.id = row.id
+        self.kind = row.kind
+        self.subject_id = row.subject_id
+        self.batch_size = row.batch_size
+        self.processed = row.processed
+        self.total = row.total
+        self.state = dict(row.state or {})
+
+    async def checkpoint(self, processed: int | None = None, total: int | None = None, **state):
+        if processed is not None:
+            self.processed = processed
+        if total is not None:
+            self.total = total
+        self.state.update(state)
+        await run_in_threadpool(_write, self.id, processed=self.processed, total=self.total, state=self.state)
+
+
+# --- Запуск и выполнение ---
+
+def _active(conn, kind: str, subject_id: int):
+    return conn.execute(
+        select(background_jobs)
+        .where(background_jobs.c.kind == kind, background_jobs.c.subject_id == subject_id,
+               background_jobs.c.status.in_(ACTIVE_STATUSES))
+    ).first()
+
+
+def _create(kind: str, subject_id: int, batch_size: int):
+    for attempt in range(2):
+        now = _now()
+        try:
+            with _engine.begin() as conn:
+                # Повторный запрос на тот же каскад не плодит задачи — отдаём активную
+                existing = _active(conn, kind, subject_id)
+                if existing is not None:
+                    return existing, False
+                job_id = conn.execute(insert(background_jobs).values(
+                    kind=kind, subject_id=subject_id, status="running", batch_size=batch_size,
+                    processed=0, state={}, attempts=1, created_at=now, updated_at=now,
+                )).inserted_primary_key[0]
+                return conn.execute(select(background_jobs).where(background_jobs.c.id == job_id)).first(), True
+        except IntegrityError:
+            # Между проверкой и вставкой задачу создала другая реплика (uq_background_jobs_active):
+            # в новой транзакции она уже видна и вернётся как существующая
+            if attempt:
+                raise
+
+
+async def start_job(kind: str, subject_id: int, batch_size: int | None = None) -> JobStatus:
+    """Создаёт задачу и запускает её в этом процессе; для уже идущего каскада возвращает существующую."""
+    row, created = await run_in_threadpool(_create, kind, subject_id, batch_size or JOB_BATCH_SIZE)
+    if created:
+        _spawn(row)
+    return JobStatus.model_validate(row, from_attributes=True)
+
+
+def _spawn(row):
+    task = asyncio.create_task(_run(row))
+    _running[row.id] = task
+    task.add_done_callback(lambda _: _running.pop(row.id, None))
+
+
+async def _run(row):
+    job = Job(row)
+    try:
+        await _handlers[job.kind](job)
+    except asyncio.CancelledError:
+        # Остановка процесса: задача остаётся running и будет подхвачена по JOB_STALE_AFTER
+        raise
+    except Exception as e:
+        permanent = isinstance(e, JobFailed) or (isinstance(e, HTTPException) and e.status_code < 500)
+        error = e.detail if isinstance(e, HTTPException) else str(e) or type(e).__name__
+        if permanent or row.attempts >= JOB_MAX_ATTEMPTS:
+            await run_in_threadpool(_write, job.id, status="failed", error=error)
+            JOBS_FINISHED.labels(job.kind, "failed").inc()
+            logger.warning("Задача %s %s(%s) завершилась ошибкой: %s", job.id, job.kind, job.subject_id, error)
+        else:
+            await run_in_threadpool(_write, job.id, status="pending", error=error)
+            logger.info("Задача %s %s(%s) будет повторена: %s", job.id, job.kind, job.subject_id, error)
+        return
+    await run_in_threadpool(_write, job.id, status="completed", processed=job.processed, total=job.total,
+                            state=job.state, error=None)
+    JOBS_FINISHED.labels(job.kind, "completed").inc()
+    logger.info("Задача %s %s(%s) выполнена: %s из %s", job.id, job.kind, job.subject_id, job.processed, job.total)
+
+
+def _claim_ready() -> list:
+    """Забирает задачи на повтор и брошенные; захват — условный UPDATE по прочитанному updated_at."""
+    now = _now()
+    stale = now - timedelta(seconds=JOB_STALE_AFTER)
+    claimed = []
+    with _engine.connect() as conn:
+        candidates = conn.execute(
+            select(background_jobs)
+            .where(or_(background_jobs.c.status == "pending",
+                       (background_jobs.c.status == "running") & (background_jobs.c.updated_at < stale)))
+            .order_by(background_jobs.c.id)
+            .limit(100)
+        ).all()
+        for row in candidates:
+            if row.id in _running:
+                continue
+            taken = conn.execute(
+                update(background_jobs)
+                .where(background_jobs.c.id == row.id, background_jobs.c.updated_at == row.updated_at)
+                .values(status="running", attempts=row.attempts + 1, updated_at=now)
+            ).rowcount
+            conn.commit()
+            if taken:
+                claimed.append(conn.execute(select(background_jobs).where(background_jobs.c.id == row.id)).first())
+    return claimed
+
+
+async def job_worker():
+    """Фоновая задача lifespan: повторы и задачи, брошенные упавшими процессами."""
+    while True:
+        try:
+            for row in await run_in_threadpool(_claim_ready):
+                logger.info("Возобновление задачи %s %s(%s), попытка %s", row.id, row.kind, row.subject_id, row.attempts)
+                _spawn(row)
+        except Exception:
+            logger.exception("Ошибка при подхвате фоновых задач")
+        await asyncio.sleep(JOB_POLL_INTERVAL)
+
+
+async def stop_jobs():
+    """Отменяет задачи этого процесса при остановке; их подхватит другой процесс или рестарт."""
+    for task in list(_running.values()):
+        task.cancel()
+    await asyncio.gather(*_running.values(), return_exceptions=True)
+
+
+jobs_router = APIRouter()
+
+
+@jobs_router.get("/jobs/{job_id}", response_model=JobStatus)
+def read_job(job_id: int):
+    row = _fetch(job_id)
+    if row is None:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    return JobStatus.model_validate(row, from_attributes=True)
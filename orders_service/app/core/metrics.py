@@ -0,0 +1,197 @@
+import os
+import time
+
+import httpx
+from fastapi import APIRouter
+from fastapi.responses import Response
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest,
+)
+from sqlalchemy import event
+
+# Бакеты под межсервисные вызовы и запросы к БД: от 1 мс до 10 с
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Метка route — шаблон пути (/{order_id}), а не сырой путь: кардинальность ограничена числом роутов
+UNMATCHED_ROUTE = "<unmatched>"
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Время обработки входящего HTTP-запроса",
+    ["method", "route", "status"], buckets=LATENCY_BUCKETS,
+)
+HTTP_REQUESTS_IN_FLIGHT = Gauge(
+    "http_requests_in_flight", "Входящие запросы в обработке",
+    ["method"], multiprocess_mode="livesum",
+)
+DB_QUERY_DURATION = Histogram(
+    "db_query_duration_seconds", "Время выполнения SQL-запроса",
+    ["operation"], buckets=LATENCY_BUCKETS,
+)
+DB_POOL_CHECKED_OUT = Gauge(
+    "db_pool_checked_out_connections", "Соединения пула, выданные приложению",
+    multiprocess_mode="livesum",
+)
+DB_POOL_OPEN = Gauge(
+    "db_pool_open_connections", "Открытые DBAPI-соединения пула",
+    multiprocess_mode="livesum",
+)
+DB_POOL_SIZE = Gauge(
+    "db_pool_size", "Настроенный размер пула (pool_size)",
+    multiprocess_mode="max",
+)
+OUTBOUND_REQUEST_DURATION = Histogram(
+    "outbound_request_duration_seconds", "Время исходящего вызова другого сервиса",
+    ["dependency", "method", "status"], buckets=LATENCY_BUCKETS,
+)
+OUTBOUND_REQUEST_ERRORS = Counter(
+    "outbound_request_errors_total", "Исходящие вызовы, завершившиеся ошибкой транспорта",
+    ["dependency", "method", "error"],
+)
+STARTUP_PHASE_SECONDS = Gauge(
+    "service_startup_phase_seconds", "Длительность фаз старта процесса",
+    ["phase"], multiprocess_mode="max",
+)
+
+_SQL_OPERATIONS = {"SELECT", "INSERT", "UPDATE", "DELETE"}
+
+
+# --- Входящие запросы ---
+
+def route_template(scope) -> str:
+    """Шаблон пути сработавшего роута (роутер кладёт его в scope["route"] при диспетчеризации)."""
+    route = scope.get("route")
+    return getattr(route, "path", None) or UNMATCHED_ROUTE
+
+
+class MetricsMiddleware:
+    """ASGI-middleware: гистограмма задержек по шаблонам роутов и число запросов в обработке."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        method = scope["method"]
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        in_flight = HTTP_REQUESTS_IN_FLIGHT.labels(method)
+        in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            in_flight.dec()
+            HTTP_REQUEST_DURATION.labels(method, route_template(scope), str(status_code)).observe(
+                time.perf_counter() - started
+            )
+
+
+# --- SQLAlchemy ---
+
+def instrument_engine(engine):
+    """Гистограмма длительности запросов и gauges пула через события SQLAlchemy."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start_time"].pop()
+        operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+        DB_QUERY_DURATION.labels(operation if operation in _SQL_OPERATIONS else "OTHER").observe(elapsed)
+
+    @event.listens_for(engine, "handle_error")
+    def _on_error(context):
+        # after_cursor_execute не вызывается при ошибке — снимаем отметку времени
+        stack = context.connection.info.get("query_start_time") if context.connection is not None else None
+        if stack:
+            stack.pop()
+
+    @event.listens_for(engine.pool, "checkout")
+    def _checkout(dbapi_connection, connection_record, connection_proxy):
+        DB_POOL_CHECKED_OUT.inc()
+
+    @event.listens_for(engine.pool, "checkin")
+    def _checkin(dbapi_connection, connection_record):
+        DB_POOL_CHECKED_OUT.dec()
+
+    @event.listens_for(engine.pool, "connect")
+    def _connect(dbapi_connection, connection_record):
+        DB_POOL_OPEN.inc()
+
+    @event.listens_for(engine.pool, "close")
+    def _close(dbapi_connection, connection_record):
+        DB_POOL_OPEN.dec()
+
+    if hasattr(engine.pool, "size"):
+        DB_POOL_SIZE.set(engine.pool.size())
+
+
+# --- Исходящие вызовы ---
+
+def dependency_name(url: httpx.URL) -> str:
+    """
+    Имя зависимости по URL: /api/v1/<service>/... → <service>, иначе хост.
+    Ограниченная кардинальность: id и query в метку не попадают.
+    """
+    parts = url.path.strip("/").split("/")
+    if len(parts) >= 3 and parts[0] == "api":
+        return parts[2]
+    return url.host
+
+
+class InstrumentedTransport(httpx.AsyncBaseTransport):
+    """Обёртка транспорта httpx: задержка/статус по зависимостям и ошибки транспорта."""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self._transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        dependency = dependency_name(request.url)
+        started = time.perf_counter()
+        try:
+            response = await self._transport.handle_async_request(request)
+        except httpx.TransportError as e:
+            OUTBOUND_REQUEST_ERRORS.labels(dependency, request.method, type(e).__name__).inc()
+            OUTBOUND_REQUEST_DURATION.labels(dependency, request.method, "error").observe(time.perf_counter() - started)
+            raise
+        OUTBOUND_REQUEST_DURATION.labels(dependency, request.method, str(response.status_code)).observe(
+            time.perf_counter() - started
+        )
+        return response
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+# --- Экспорт ---
+
+def record_startup(startup_state: dict):
+    for phase in ("db_wait_seconds", "init_db_seconds", "warmup_seconds", "time_to_ready_seconds"):
+        if startup_state.get(phase) is not None:
+            STARTUP_PHASE_SECONDS.labels(phase.removesuffix("_seconds")).set(startup_state[phase])
+
+
+metrics_router = APIRouter()
+
+
+@metrics_router.get("/metrics", include_in_schema=False)
+def metrics():
+    """Метрики в формате Prometheus (в multi-режиме gunicorn — агрегат по воркерам)."""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
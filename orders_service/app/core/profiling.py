@@ -0,0 +1,154 @@
+"""
+Профилирование по запросу, без передеплоя. Включается переменной PROFILING_TOKEN:
+без неё ни middleware, ни роут не подключаются — накладных расходов нет.
+
+* Профиль одного запроса: заголовок X-Profile-Token: <token> на любом запросе.
+  Вместо тела ответа возвращается профиль pyinstrument (async-aware): HTML по умолчанию
+  или speedscope JSON при X-Profile-Format: speedscope. Исходный статус — в X-Profiled-Status.
+* Сэмплер всего процесса: POST /debug/profile/sample?seconds=N с тем же заголовком.
+  N секунд снимает стеки всех потоков (sys._current_frames) и отдаёт их в collapsed-формате
+  (flamegraph.pl, speedscope, inferno). В multi-режиме gunicorn — только стеки обработавшего воркера.
+"""
+import hmac
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse, Response
+
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN", "")
+PROFILING_ENABLED = bool(PROFILING_TOKEN)
+
+# Ограничение длительности сэмплирования и шаг pyinstrument для профиля одного запроса
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.001"))
+
+# Листовые кадры простаивающих потоков: event loop в select, пул потоков и очереди в ожидании
+_IDLE_FRAMES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("queue.py", "get"),
+    ("handlers.py", "dequeue"),
+    ("thread.py", "_worker"),
+    ("tracing.py", "_run"),
+}
+
+_sampler_lock = threading.Lock()
+
+
+def _token_valid(token: str | None) -> bool:
+    return bool(PROFILING_ENABLED and token) and hmac.compare_digest(token, PROFILING_TOKEN)
+
+
+def require_profiling_token(x_profile_token: str | None = Header(None)):
+    if not _token_valid(x_profile_token):
+        raise HTTPException(status_code=403, detail="Неверный токен профилирования")
+
+
+# --- Профиль одного запроса ---
+
+class ProfilingMiddleware:
+    """ASGI-middleware: при валидном X-Profile-Token запрос выполняется под pyinstrument."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope["headers"])
+        token = headers.get(b"x-profile-token")
+        # /debug/... проверяет токен сам и профилировать его не нужно
+        if token is None or scope["path"].endswith("/debug/profile/sample"):
+            return await self.app(scope, receive, send)
+        if not _token_valid(token.decode("latin-1")):
+            response = PlainTextResponse("Неверный токен профилирования", status_code=403)
+            return await response(scope, receive, send)
+
+        from pyinstrument import Profiler
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            # Ответ приложения не отправляем: вместо него уйдёт профиль
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+
+        profiler = Profiler(interval=PROFILE_INTERVAL, async_mode="enabled")
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profiler.stop()
+
+        if headers.get(b"x-profile-format", b"").lower() == b"speedscope":
+            from pyinstrument.renderers import SpeedscopeRenderer
+
+            body, media_type = profiler.output(SpeedscopeRenderer()), "application/json"
+        else:
+            body, media_type = profiler.output_html(), "text/html"
+        response = Response(body, media_type=media_type, headers={"X-Profiled-Status": str(status_code)})
+        await response(scope, receive, send)
+
+
+# --- Сэмплер процесса ---
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    path = code.co_filename.replace("\\", "/").rsplit("/", 2)
+    return f"{getattr(code, 'co_qualname', code.co_name)} ({'/'.join(path[-2:])})"
+
+
+def _is_idle(frame) -> bool:
+    return (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name) in _IDLE_FRAMES
+
+
+def sample_stacks(seconds: float, interval: float, include_idle: bool = False) -> Counter:
+    """Снимает стеки всех потоков, кроме своего; ключ — collapsed-стек "поток;внешний;...;листовой"."""
+    own_thread = threading.get_ident()
+    stacks: Counter = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread or (not include_idle and _is_idle(frame)):
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            labels.append(names.get(thread_id, str(thread_id)))
+            stacks[";".join(reversed(labels))] += 1
+        time.sleep(interval)
+    return stacks
+
+
+profiling_router = APIRouter(dependencies=[Depends(require_profiling_token)])
+
+
+@profiling_router.post("/debug/profile/sample", include_in_schema=False)
+async def sample_profile(
+    seconds: float = Query(10.0, gt=0),
+    interval_ms: float = Query(5.0, ge=1),
+    idle: bool = Query(False, description="Включать стеки простаивающих потоков"),
+):
+    """Сэмплирует все потоки процесса N секунд и возвращает collapsed-стеки для flamegraph."""
+    if not _sampler_lock.acquire(blocking=False):
+        raise HTTPException(status_code=409, detail="Сэмплер уже запущен")
+    try:
+        stacks = await run_in_threadpool(
+            sample_stacks, min(seconds, PROFILE_MAX_SECONDS), interval_ms / 1000, idle,
+        )
+    finally:
+        _sampler_lock.release()
+
+    body = "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+    return PlainTextResponse(body, headers={
+        "Content-Disposition": f'attachment; filename="profile-{os.getpid()}.collapsed"',
+    })
@@ -0,0 +1,202 @@
+"""
+Витрина заказов (order_views): заказ вместе с платежом и доставкой одной строкой,
+чтобы GET /{id}/full и GET /?user_id=&expand=full читали один индекс, а не ходили
+в три сервиса.
+
+* Поля заказа — sync_orders из каждой записи crud заказов, в той же транзакции.
+* Платёж и доставка — события Payments / Delivery (transactional outbox, POST /view-events),
+  одним UPDATE ... FROM (VALUES ...) на секцию пачки. Событие несёт полное состояние секции,
+  версия — emitted_at: повтор и опоздавшее старое событие ничего не меняют (at-least-once,
+  порядок не важен).
+* Отставание: order_view_lag_seconds — от записи события в outbox источника до применения
+  здесь; застрявшую отправку показывает outbox_lag_seconds у Payments / Delivery.
+Перестройка с нуля — python -m app.order_views.
+"""
+from datetime import datetime, timezone
+
+from prometheus_client import Counter, Histogram
+from sqlalchemy import DateTime, Integer, cast, column, delete, literal, or_, select, update, values
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from app.models.order import Order
+from app.models.order_view import OrderView
+
+# Колонки схемы OrderFull — для списков без ORM-объектов
+ORDER_VIEW_COLUMNS = (
+    OrderView.order_id, OrderView.user_id, OrderView.status, OrderView.total_amount,
+    OrderView.created_at, OrderView.updated_at,
+    OrderView.payment_id, OrderView.payment_status, OrderView.payment_amount, OrderView.payment_method,
+    OrderView.delivery_id, OrderView.delivery_status, OrderView.delivery_address,
+    OrderView.delivery_courier_id, OrderView.refreshed_at,
+)
+
+# Секции витрины по топику события: поле payload → колонка, и колонка версии
+SECTIONS = {
+    "payment": (
+        {"id": OrderView.payment_id, "status": OrderView.payment_status,
+         "amount": OrderView.payment_amount, "method": OrderView.payment_method},
+        OrderView.payment_version,
+    ),
+    "delivery": (
+        {"id": OrderView.delivery_id, "status": OrderView.delivery_status,
+         "address": OrderView.delivery_address, "courier_id": OrderView.delivery_courier_id},
+        OrderView.delivery_version,
+    ),
+}
+
+ORDER_VIEW_EVENTS = Counter(
+    "order_view_events_total", "События витрины заказов по исходу",
+    ["topic", "outcome"],  # applied, stale, no_order, unknown_topic
+)
+ORDER_VIEW_LAG = Histogram(
+    "order_view_lag_seconds", "Отставание витрины: от события в Payments / Delivery до применения",
+    ["topic"], buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0),
+)
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _insert(db: Session):
+    return pg_insert if db.get_bind().dialect.name == "postgresql" else sqlite_insert
+
+
+# --- Поля заказа ---
+
+def sync_orders(db: Session, order_ids):
+    """
+    Переносит поля заказов order_ids в витрину (INSERT ... SELECT ... ON CONFLICT DO UPDATE)
+    и убирает строки удалённых. Вызывается до commit записи заказа.
+    """
+    order_ids = list(order_ids)
+    if not order_ids:
+        return
+    now = _now()
+    live = select(Order.id).where(Order.id.in_(order_ids), Order.deleted_at.is_(None))
+    stmt = _insert(db)(OrderView).from_select(
+        ["order_id", "user_id", "status", "total_amount", "created_at", "updated_at", "refreshed_at"],
+        select(Order.id, Order.user_id, Order.status, Order.total_amount, Order.created_at, Order.updated_at,
+               literal(now, DateTime))
+        .where(Order.id.in_(order_ids), Order.deleted_at.is_(None)),
+    )
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=[OrderView.order_id],
+        set_={name: stmt.excluded[name]
+              for name in ("user_id", "status", "total_amount", "created_at", "updated_at", "refreshed_at")},
+    ))
+    db.execute(
+        delete(OrderView)
+        .where(OrderView.order_id.in_(order_ids), OrderView.order_id.not_in(live))
+        .execution_options(synchronize_session=False)
+    )
+
+
+# --- Платёж и доставка ---
+
+def _present(db: Session, order_ids) -> set:
+    return set(db.scalars(select(OrderView.order_id).where(OrderView.order_id.in_(order_ids))))
+
+
+def _typed(db: Session, expr, type_):
+    # psycopg2 передаёт None как NULL без типа: столбец VALUES из одних NULL Postgres считает text
+    return cast(expr, type_) if db.get_bind().dialect.name == "postgresql" else expr
+
+
+def _apply_section(db: Session, topic: str, events, now: datetime) -> set:
+    """
+    Одна секция пачкой: UPDATE ... FROM (VALUES ...) с той же защитой версией, что и по одному
+    событию. Возвращает order_id применённых (RETURNING); остальные — устаревшие.
+    """
+    columns, version = SECTIONS[topic]
+    rows = []
+    for event in events:
+        deleted = event.payload.get("deleted", False)
+        rows.append((event.key, event.emitted_at,
+                     *(None if deleted else event.payload.get(field) for field in columns)))
+    # VALUES — как CTE: такую форму UPDATE ... FROM понимают и Postgres, и SQLite
+    changes = values(
+        column("order_id", Integer), column("emitted_at", DateTime),
+        *(column(field, target.type) for field, target in columns.items()),
+        name="changes",
+    ).data(rows).cte("changes")
+    emitted_at = _typed(db, changes.c.emitted_at, DateTime())
+    return set(db.scalars(
+        update(OrderView)
+        .where(OrderView.order_id == changes.c.order_id, or_(version.is_(None), version < emitted_at))
+        .values(
+            **{target.key: _typed(db, changes.c[field], target.type) for field, target in columns.items()},
+            **{version.key: emitted_at}, refreshed_at=now,
+        )
+        .returning(OrderView.order_id)
+        .execution_options(synchronize_session=False)
+    ))
+
+
+def apply_view_events(db: Session, events, observe_lag: bool = True) -> dict:
+    """
+    Применяет события (topic, key=order_id, payload, emitted_at) одной транзакцией; счётчики исходов.
+    Из событий одной секции одного заказа в пачке нужно только последнее: остальные
+    сразу считаются устаревшими, а каждая секция применяется одним UPDATE.
+    """
+    keys = {event.key for event in events}
+    present = _present(db, keys)
+    if keys - present:
+        # Заказ создан до появления витрины или его событие обогнало синхронизацию
+        sync_orders(db, keys - present)
+        present = _present(db, keys)
+
+    now = _now()
+    outcomes = {"applied": 0, "stale": 0, "no_order": 0, "unknown_topic": 0}
+
+    def count(topic: str, outcome: str, n: int = 1):
+        if n:
+            outcomes[outcome] += n
+            ORDER_VIEW_EVENTS.labels(topic, outcome).inc(n)
+
+    latest = {}  # topic → {order_id: event}
+    for event in events:
+        if event.topic not in SECTIONS:
+            count(event.topic, "unknown_topic")
+        elif event.key not in present:
+            count(event.topic, "no_order")
+        else:
+            by_order = latest.setdefault(event.topic, {})
+            previous = by_order.get(event.key)
+            if previous is None or previous.emitted_at < event.emitted_at:
+                by_order[event.key] = event
+            if previous is not None:
+                count(event.topic, "stale")
+
+    for topic, by_order in latest.items():
+        applied = _apply_section(db, topic, by_order.values(), now)
+        count(topic, "applied", len(applied))
+        count(topic, "stale", len(by_order) - len(applied))
+        if observe_lag:
+            for order_id in applied:
+                ORDER_VIEW_LAG.labels(topic).observe(max(0.0, (now - by_order[order_id].emitted_at).total_seconds()))
+    db.commit()
+    return outcomes
+
+
+def drop_orphans(db: Session, refreshed_before: datetime) -> int:
+    """Удаляет строки, не обновлённые с refreshed_before (заказы, физически удалённые purger'ом)."""
+    removed = db.execute(delete(OrderView).where(OrderView.refreshed_at < refreshed_before)).rowcount
+    db.commit()
+    return removed
+
+
+# --- Чтение ---
+
+def get_order_view(db: Session, order_id: int):
+    return db.get(OrderView, order_id)
+
+
+def get_order_view_rows(db: Session, skip: int = 0, limit: int = 100, user_id: int | None = None):
+    """Строки витрины (колонки схемы OrderFull); с user_id — по индексу ix_order_views_user_id."""
+    stmt = select(*ORDER_VIEW_COLUMNS).order_by(OrderView.order_id).offset(skip).limit(limit)
+    if user_id is not None:
+        stmt = stmt.where(OrderView.user_id == user_id)
+    return db.execute(stmt).all()
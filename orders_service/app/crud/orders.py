@@ -1,18 +1,40 @@
+import asyncio
+import logging
+import os
 import httpx
 
 from sqlalchemy.orm import Session
-from sqlalchemy import select, delete
+from sqlalchemy import Integer, String, column, func, select, update, values
 from fastapi import HTTPException, status
 
+from app.core.http_client import get_http_client
+from app.core.tombstones import delete_statement
+from app.core.jobs import JOB_BATCH_SIZE
+from app.crud.order_views import sync_orders
+from app.db.database import SessionLocal
 from app.models.order import Order
-from app.schemas.order import OrderCreate, OrderUpdate
+from app.schemas.order import BulkStatusItemResult, OrderCreate, OrderStatusChange, OrderUpdate
+
+logger = logging.getLogger(__name__)
+
+# Колонки схемы OrderInDB — для быстрых списков и выгрузок без ORM-объектов
+ORDER_COLUMNS = (
+    Order.id, Order.user_id, Order.status, Order.total_amount,
+    Order.created_at, Order.updated_at,
+)
 
 # URL для доступа к сервису пользователей через Docker сеть
-USERS_SERVICE_URL = "http://users_service_container:8000"
+USERS_SERVICE_URL = os.getenv("USERS_SERVICE_URL", "http://users_service_container:8000")
 
 # URL для сервисов платежей и доставки через API Gateway
-PAYMENTS_SERVICE_URL = "http://nginx_gateway/api/v1/payments"
-DELIVERY_SERVICE_URL = "http://nginx_gateway/api/v1/delivery"
+PAYMENTS_SERVICE_URL = os.getenv("PAYMENTS_SERVICE_URL", "http://nginx_gateway/api/v1/payments")
+DELIVERY_SERVICE_URL = os.getenv("DELIVERY_SERVICE_URL", "http://nginx_gateway/api/v1/delivery")
+
+# Сколько заказов пачки каскада одновременно удаляют платёж и доставку:
+# вся пачка разом — до 2 × JOB_BATCH_SIZE запросов, под нагрузкой их отклонит admission control
+CASCADE_CONCURRENCY = int(os.getenv("CASCADE_CONCURRENCY", "4"))
+
+ORDER_STATUSES = ("pending", "paid", "shipped", "completed", "cancelled")
 
 
 # --- Межсервисное общение с Users Service ---
@@ -22,25 +44,25 @@ async def check_user_exists(user_id: int) -> bool:
     url = f"{USERS_SERVICE_URL}/api/v1/users/{user_id}"
     TIMEOUT = 5.0
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(url, timeout=TIMEOUT)
+    client = get_http_client()
+    try:
+        response = await client.get(url, timeout=TIMEOUT)
 
-            if response.status_code == 200:
-                return True
-            if response.status_code == 404:
-                return False
+        if response.status_code == 200:
+            return True
+        if response.status_code == 404:
+            return False
 
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"Ошибка при проверке Users Service: получено {response.status_code}"
-            )
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Ошибка при проверке Users Service: получено {response.status_code}"
+        )
 
-        except httpx.RequestError as e:
-            raise HTTPException(
-                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                detail=f"Users Service временно недоступен или таймаут ({TIMEOUT}s): {e}"
-            )
+    except httpx.RequestError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Users Service временно недоступен или таймаут ({TIMEOUT}s): {e}"
+        )
 
 
 # --- CRUD-операции ---
@@ -57,6 +79,8 @@ async def create_order(db: Session, order: OrderCreate):
 
     db_order = Order(**order.model_dump(), status="pending")
     db.add(db_order)
+    db.flush()
+    sync_orders(db, [db_order.id])
     db.commit()
     db.refresh(db_order)
     return db_order
@@ -68,9 +92,33 @@ def get_order(db: Session, order_id: int):
 
 
 # READ ALL
-def get_orders(db: Session, skip: int = 0, limit: int = 100):
+def _filter_orders(stmt, skip: int, limit: int, user_id: int | None = None, after_id: int | None = None):
+    """С after_id — keyset-страница по id (WHERE id > ... ORDER BY id) без OFFSET."""
+    if user_id is not None:
+        stmt = stmt.where(Order.user_id == user_id)
+    if after_id is not None:
+        return stmt.where(Order.id > after_id).order_by(Order.id).limit(limit)
+    return stmt.offset(skip).limit(limit)
+
+
+def get_orders(db: Session, skip: int = 0, limit: int = 100, **filters):
     """Получение списка всех заказов с пагинацией."""
-    return db.scalars(select(Order).offset(skip).limit(limit)).all()
+    return db.scalars(_filter_orders(select(Order), skip, limit, **filters)).all()
+
+
+def get_order_rows(db: Session, skip: int = 0, limit: int = 100, **filters):
+    """Список заказов в виде Row (колонки схемы OrderInDB), без ORM-объектов."""
+    stmt = _filter_orders(select(*ORDER_COLUMNS), skip, limit, **filters)
+    return db.execute(stmt).all()
+
+
+def iter_order_partitions(db: Session, batch_size: int = 10_000):
+    """
+    Все заказы пачками по batch_size строк через серверный курсор (yield_per),
+    чтобы выгрузка не держала всю таблицу в памяти.
+    """
+    stmt = select(*ORDER_COLUMNS).order_by(Order.id).execution_options(yield_per=batch_size)
+    yield from db.execute(stmt).partitions()
 
 
 # UPDATE (полное обновление по схеме)
@@ -85,6 +133,8 @@ def update_order(db: Session, order_id: int, order: OrderUpdate):
         setattr(db_order, key, value)
 
     db.add(db_order)
+    db.flush()
+    sync_orders(db, [order_id])
     db.commit()
     db.refresh(db_order)
     return db_order
@@ -92,6 +142,30 @@ def update_order(db: Session, order_id: int, order: OrderUpdate):
 
 # --- НОВОЕ: каскадное удаление заказа ---
 
+async def _delete_dependent(client: httpx.AsyncClient, service: str, url: str, order_id: int, context: str):
+    """DELETE .../by-order/{id}; успех — 200/204/404 (удалять нечего), иначе исключение."""
+    TIMEOUT = 5.0
+    try:
+        resp = await client.delete(url, timeout=TIMEOUT)
+    except httpx.RequestError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"{service} недоступен при удалении {context}: {e}"
+        )
+    if resp.status_code not in (200, 204, 404):
+        # Заказ без удалённых зависимостей оставил бы сирот: прерываемся, фоновая задача повторит
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE if resp.status_code == 503 else status.HTTP_502_BAD_GATEWAY,
+            detail=f"{service} не удалил данные заказа {order_id} ({context}): {resp.status_code} {resp.text}",
+        )
+
+
+async def _delete_order_dependents(client: httpx.AsyncClient, order_id: int, context: str):
+    """Удаляет платеж и доставку заказа. Их отсутствие — не ошибка."""
+    await _delete_dependent(client, "Payments Service", f"{PAYMENTS_SERVICE_URL}/by-order/{order_id}", order_id, context)
+    await _delete_dependent(client, "Delivery Service", f"{DELIVERY_SERVICE_URL}/by-order/{order_id}", order_id, context)
+
+
 async def cascade_delete_order(db: Session, order_id: int) -> bool:
     """
     Каскадное удаление заказа:
@@ -99,49 +173,23 @@ async def cascade_delete_order(db: Session, order_id: int) -> bool:
     2. Удаляет доставку по order_id в Delivery Service
     3. Удаляет сам заказ в Orders Service
     """
-    # 1. Проверяем, существует ли заказ
+    # Проверяем, существует ли заказ
     db_order = db.get(Order, order_id)
     if db_order is None:
         return False
 
-    TIMEOUT = 5.0
+    await _delete_order_dependents(get_http_client(), order_id, f"заказа {order_id}")
 
-    # 2. Удаляем платеж
-    async with httpx.AsyncClient() as client:
-        try:
-            payments_url = f"{PAYMENTS_SERVICE_URL}/by-order/{order_id}"
-            resp_pay = await client.delete(payments_url, timeout=TIMEOUT)
-            # Ожидаем 204 или 200, но даже если платежа нет — это не ошибка
-            if resp_pay.status_code not in (200, 204):
-                print(f"⚠️ Не удалось удалить платеж для order_id={order_id}: {resp_pay.status_code} {resp_pay.text}")
-        except httpx.RequestError as e:
-            raise HTTPException(
-                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                detail=f"Payments Service недоступен при удалении заказа {order_id}: {e}"
-            )
-
-    # 3. Удаляем доставку
-    async with httpx.AsyncClient() as client:
-        try:
-            delivery_url = f"{DELIVERY_SERVICE_URL}/by-order/{order_id}"
-            resp_del = await client.delete(delivery_url, timeout=TIMEOUT)
-            if resp_del.status_code not in (200, 204):
-                print(f"⚠️ Не удалось удалить доставку для order_id={order_id}: {resp_del.status_code} {resp_del.text}")
-        except httpx.RequestError as e:
-            raise HTTPException(
-                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                detail=f"Delivery Service недоступен при удалении заказа {order_id}: {e}"
-            )
-
-    # 4. Удаляем заказ локально
-    stmt = delete(Order).where(Order.id == order_id).returning(Order.id)
+    # Удаляем заказ локально
+    stmt = delete_statement(Order, Order.id == order_id)
     deleted_id = db.scalar(stmt)
     if deleted_id is None:
         db.rollback()
         return False
 
+    sync_orders(db, [order_id])
     db.commit()
-    print(f"✅ Каскадно удалён заказ {order_id} и связанные данные")
+    logger.info("Каскадно удалён заказ %s и связанные данные", order_id)
     return True
 
 
@@ -155,61 +203,95 @@ def update_order_status(db: Session, order_id: int, new_status: str):
 
     db_order.status = new_status
     db.add(db_order)
+    db.flush()
+    sync_orders(db, [order_id])
     db.commit()
     db.refresh(db_order)
     return db_order
 
-async def cascade_delete_orders_by_user(db: Session, user_id: int) -> int:
+def bulk_update_order_status(db: Session, changes: list[OrderStatusChange]) -> list[BulkStatusItemResult]:
     """
-    Каскадно удаляет все заказы пользователя:
-    для каждого заказа:
-      - удаляет платеж (Payments Service)
-      - удаляет доставку (Delivery Service)
-      - удаляет заказ локально
-    Возвращает количество удалённых заказов.
+    Смена статусов многих заказов одним UPDATE ... FROM (VALUES ...) в одной транзакции.
+    Исход по каждому элементу: updated, not_found, invalid_status или duplicate (повтор id в пакете).
     """
-    # Находим все заказы пользователя
-    orders = db.scalars(select(Order).where(Order.user_id == user_id)).all()
-    if not orders:
-        print(f"ℹ️ У пользователя {user_id} нет заказов для каскадного удаления")
-        return 0
-
-    TIMEOUT = 5.0
-
-    async with httpx.AsyncClient() as client:
-        for order in orders:
-            order_id = order.id
-
-            # 1. Удаляем платеж
-            try:
-                payments_url = f"{PAYMENTS_SERVICE_URL}/by-order/{order_id}"
-                resp_pay = await client.delete(payments_url, timeout=TIMEOUT)
-                if resp_pay.status_code not in (200, 204):
-                    print(f"⚠️ Не удалось удалить платеж для order_id={order_id}: {resp_pay.status_code} {resp_pay.text}")
-            except httpx.RequestError as e:
-                raise HTTPException(
-                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                    detail=f"Payments Service недоступен при удалении заказов пользователя {user_id}: {e}"
-                )
-
-            # 2. Удаляем доставку
-            try:
-                delivery_url = f"{DELIVERY_SERVICE_URL}/by-order/{order_id}"
-                resp_del = await client.delete(delivery_url, timeout=TIMEOUT)
-                if resp_del.status_code not in (200, 204):
-                    print(f"⚠️ Не удалось удалить доставку для order_id={order_id}: {resp_del.status_code} {resp_del.text}")
-            except httpx.RequestError as e:
-                raise HTTPException(
-                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                    detail=f"Delivery Service недоступен при удалении заказов пользователя {user_id}: {e}"
-                )
-
-            # 3. Удаляем сам заказ
-            stmt = delete(Order).where(Order.id == order_id).returning(Order.id)
-            deleted_id = db.scalar(stmt)
-            if deleted_id is None:
-                print(f"⚠️ Не удалось удалить заказ {order_id} пользователя {user_id}")
-
-    db.commit()
-    print(f"✅ Каскадно удалены {len(orders)} заказ(ов) пользователя {user_id}")
-    return len(orders)
\ No newline at end of file
+    results, rows, seen = [], [], set()
+    for change in changes:
+        if change.status not in ORDER_STATUSES:
+            results.append(BulkStatusItemResult(id=change.id, outcome="invalid_status"))
+        elif change.id in seen:
+            results.append(BulkStatusItemResult(id=change.id, outcome="duplicate"))
+        else:
+            seen.add(change.id)
+            rows.append((change.id, change.status))
+            results.append(BulkStatusItemResult(id=change.id, outcome="updated", status=change.status))
+
+    updated = set()
+    if rows:
+        # VALUES — как CTE: такую форму UPDATE ... FROM понимают и Postgres, и SQLite
+        changed = values(column("id", Integer), column("status", String), name="changes").data(rows).cte("changes")
+        updated = set(db.scalars(
+            update(Order)
+            .where(Order.id == changed.c.id, Order.deleted_at.is_(None))
+            .values(status=changed.c.status)
+            .returning(Order.id)
+            .execution_options(synchronize_session=False)
+        ))
+        sync_orders(db, updated)
+        db.commit()
+
+    for result in results:
+        if result.outcome == "updated" and result.id not in updated:
+            result.outcome, result.status = "not_found", None
+    return results
+
+
+async def cascade_delete_orders_by_user(
+    db: Session, user_id: int, batch_size: int = JOB_BATCH_SIZE, on_batch=None,
+) -> int:
+    """
+    Каскадно удаляет все заказы пользователя пачками по batch_size:
+      - платежи и доставки заказов пачки удаляются параллельно, не больше CASCADE_CONCURRENCY\n        заказов сразу (Payments / Delivery Service); 200/204/404 — успех, иначе исключение
+      - затем заказы пачки удаляются локально одним DELETE и коммитом
+    После каждой пачки вызывается on_batch(удалено_всего) — прогресс фоновой задачи.
+    Повторный вызов продолжает с оставшихся заказов. Возвращает количество удалённых заказов.
+    """
+    client = get_http_client()
+    semaphore = asyncio.Semaphore(CASCADE_CONCURRENCY)
+
+    async def delete_dependents(order_id: int):
+        async with semaphore:
+            await _delete_order_dependents(client, order_id, f"заказов пользователя {user_id}")
+
+    deleted = 0
+    while True:
+        order_ids = db.scalars(
+            select(Order.id).where(Order.user_id == user_id).order_by(Order.id).limit(batch_size)
+        ).all()
+        if not order_ids:
+            break
+
+        # Ошибка любой зависимости прерывает пачку до удаления заказов: повтор задачи начнёт её заново
+        await asyncio.gather(*(delete_dependents(order_id) for order_id in order_ids))
+
+        db.execute(delete_statement(Order, Order.id.in_(order_ids)))
+        sync_orders(db, order_ids)
+        db.commit()
+        deleted += len(order_ids)
+        if on_batch is not None:
+            await on_batch(deleted)
+
+    logger.info("Каскадно удалены %d заказ(ов) пользователя %s", deleted, user_id)
+    return deleted
+
+
+async def cascade_delete_orders_by_user_job(job) -> None:
+    """Фоновая задача каскада: прогресс — удалённые заказы из total на момент первого запуска."""
+    with SessionLocal() as db:
+        if job.total is None:
+            remaining = db.scalar(select(func.count()).select_from(Order).where(Order.user_id == job.subject_id))
+            await job.checkpoint(total=remaining)
+        already = job.processed
+        await cascade_delete_orders_by_user(
+            db, job.subject_id, job.batch_size,
+            on_batch=lambda deleted: job.checkpoint(processed=already + deleted),
+        )
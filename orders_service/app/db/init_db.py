@@ -1,15 +1,26 @@
+import logging
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError, ProgrammingError
+from app.core.idempotency import idempotency_metadata
+from app.core.jobs import jobs_metadata
+from app.crud.order_views import sync_orders
 from app.db.database import Base, engine
 from app.models.order import Order
+from app.models.order_view import OrderView # Витрина заказов
+from app.reconcile import reconcile_metadata
+
+logger = logging.getLogger(__name__)
 
 def init_db():
     try:
         # Создание всех таблиц (с обработкой race condition)
         Base.metadata.create_all(bind=engine)
+        idempotency_metadata.create_all(bind=engine)
+        jobs_metadata.create_all(bind=engine)
+        reconcile_metadata.create_all(bind=engine)
     except (IntegrityError, ProgrammingError) as e:
         # Игнорируем ошибки, если таблица уже создана другой репликой
-        print(f"Таблица уже существует (создана другой репликой): {e}")
+        logger.info("Таблица уже существует (создана другой репликой): %s", e)
     
     # Заполнение тестовыми данными
     db: Session = Session(bind=engine)
@@ -24,17 +35,18 @@ def init_db():
                 {"user_id": 4, "total_amount": 75.20, "status": "delivered"},
             ]
             
-            for data in test_orders:
-                db_order = Order(**data)
-                db.add(db_order)
-            
+            db_orders = [Order(**data) for data in test_orders]
+            db.add_all(db_orders)
+            db.flush()
+            # Платежи и доставки демо-заказов витрина получит от python -m app.order_views
+            sync_orders(db, [o.id for o in db_orders])
             db.commit()
-            print("База данных заказов проинициализирована 5 тестовыми записями.")
+            logger.info("База данных заказов проинициализирована 5 тестовыми записями.")
         else:
-            print("База данных заказов уже содержит данные, пропуск инициализации.")
+            logger.info("База данных заказов уже содержит данные, пропуск инициализации.")
     
     except Exception as e:
-        print(f"Ошибка инициализации БД заказов: {e}")
+        logger.exception("Ошибка инициализации БД заказов: %s", e)
         db.rollback()
     finally:
         db.close()
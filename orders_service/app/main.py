@@ -1,18 +1,56 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware import Middleware
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import Response
 from app.api.v1 import endpoints
+from app.core.admission import ADMISSION_ENABLED, AdmissionMiddleware
+from app.core.idempotency import IdempotencyMiddleware, idempotency_purger
+from app.core.jobs import configure_jobs, job_worker, jobs_router, stop_jobs
+from app.core.logging_setup import RequestIdMiddleware, setup_logging
+from app.core.metrics import MetricsMiddleware, instrument_engine, metrics_router
+from app.core.profiling import PROFILING_ENABLED, ProfilingMiddleware, profiling_router
+from app.core.sql_stats import SqlStatsMiddleware, instrument_engine_sql_stats
+from app.core.startup import probes_router, run_shutdown, run_startup
+from app.core.tombstones import tombstone_purger
+from app.core.tracing import TracingMiddleware, configure_tracing, instrument_engine_tracing
+from app.crud.orders import DELIVERY_SERVICE_URL, USERS_SERVICE_URL, cascade_delete_orders_by_user_job
+from app.db.database import engine
+from app.db.init_db import init_db
+from app.models.order import Order
 import os
 
 # Определяем REPLICA_ID прямо в main.py
 REPLICA_ID = os.getenv("REPLICA_ID", "default-instance")
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Обе реплики стартуют параллельно: init_db выполняется под advisory lock
+    await run_startup(
+        engine, init_db, lock_name="orders_service.init_db",
+        dependency_urls=[USERS_SERVICE_URL, DELIVERY_SERVICE_URL],
+    )
+    purger = asyncio.create_task(idempotency_purger(engine))
+    worker = asyncio.create_task(job_worker())
+    # Физическое удаление помеченных строк — пачками, в окно PURGE_WINDOW
+    tombstones = asyncio.create_task(tombstone_purger(engine, [Order.__table__]))
+    yield
+    tombstones.cancel()
+    purger.cancel()
+    worker.cancel()
+    await stop_jobs()
+    await run_shutdown(engine)
+
+
 app = FastAPI(
     title="Orders Microservice",
     docs_url="/docs",
     openapi_url="/openapi.json",
-    root_path="/api/v1/orders"
+    root_path="/api/v1/orders",
+    lifespan=lifespan,
 )
 
 @app.middleware("http")
@@ -21,7 +59,32 @@ async def add_replica_header(request, call_next):
     response.headers["X-Replica-ID"] = REPLICA_ID
     return response
 
+setup_logging("orders_service")
+configure_tracing("orders_service")
+instrument_engine(engine)
+instrument_engine_tracing(engine)
+instrument_engine_sql_stats(engine)
+configure_jobs(engine, {"cascade_delete_orders_by_user": cascade_delete_orders_by_user_job})
+# Повтор POST с тем же Idempotency-Key отдаёт сохранённый ответ, не доходя до обработчика
+app.add_middleware(IdempotencyMiddleware, engine=engine)
+if PROFILING_ENABLED:
+    # Без PROFILING_TOKEN профилирование не подключается вовсе
+    app.add_middleware(ProfilingMiddleware)
+app.add_middleware(SqlStatsMiddleware)
+if ADMISSION_ENABLED:
+    # Снаружи idempotency и SQL: отклонённый запрос не доходит до БД, но попадает в метрики и логи
+    app.add_middleware(AdmissionMiddleware)
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(TracingMiddleware)
+app.add_middleware(RequestIdMiddleware)
+
 # Включение роутов
+# Служебные роуты подключаем раньше /{id} из endpoints, иначе он их перехватит
+app.include_router(probes_router)
+app.include_router(metrics_router)
+app.include_router(jobs_router)
+if PROFILING_ENABLED:
+    app.include_router(profiling_router)
 app.include_router(endpoints.router, prefix="", tags=["orders"])
 
 
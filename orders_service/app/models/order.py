@@ -1,13 +1,28 @@
+from datetime import datetime, timezone
+
 from sqlalchemy import Column, Integer, String, Float, DateTime
 from sqlalchemy.sql import func
+from app.core.tombstones import SoftDeleteMixin, live_index, tombstone_index
 from app.db.database import Base
 
-class Order(Base):
+
+def _now() -> datetime:
+    # Время изменения — из Python, с микросекундами: func.now() в SQLite — с точностью до секунды,
+    # и два изменения за секунду давали одинаковый updated_at, а значит и ETag (ложный 304)
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class Order(SoftDeleteMixin, Base):
     __tablename__ = "orders"
+    __table_args__ = (
+        # Заказы пользователя читаются только живые
+        live_index("ix_orders_user_id_live", "user_id"),
+        tombstone_index("orders"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, index=True, nullable=False) 
+    user_id = Column(Integer, nullable=False)
     status = Column(String, default="pending") 
     total_amount = Column(Float, nullable=False)
     created_at = Column(DateTime, server_default=func.now())
-    updated_at = Column(DateTime, onupdate=func.now())
\ No newline at end of file
+    updated_at = Column(DateTime, onupdate=_now)
\ No newline at end of file
@@ -0,0 +1,39 @@
+from sqlalchemy import Column, Integer, String, Float, DateTime, Index
+from app.db.database import Base
+
+
+class OrderView(Base):
+    """
+    Витрина заказа вместе с платежом и доставкой (GET /{id}/full, GET /?expand=full).
+    Поля заказа переносятся из orders той же транзакцией, поля платежа и доставки —
+    событиями Payments / Delivery (POST /view-events). *_version — emitted_at последнего
+    применённого события секции: более старое событие не перетирает новое.
+    Строка удалённого заказа удаляется физически — витрина производная.
+    """
+    __tablename__ = "order_views"
+    __table_args__ = (
+        # Заказы пользователя в порядке id — одним проходом по индексу
+        Index("ix_order_views_user_id", "user_id", "order_id"),
+    )
+
+    order_id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    status = Column(String, nullable=False)
+    total_amount = Column(Float, nullable=False)
+    created_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, nullable=True)
+
+    payment_id = Column(Integer, nullable=True)
+    payment_status = Column(String, nullable=True)
+    payment_amount = Column(Float, nullable=True)
+    payment_method = Column(String, nullable=True)
+    payment_version = Column(DateTime, nullable=True)
+
+    delivery_id = Column(Integer, nullable=True)
+    delivery_status = Column(String, nullable=True)
+    delivery_address = Column(String, nullable=True)
+    delivery_courier_id = Column(String, nullable=True)
+    delivery_version = Column(DateTime, nullable=True)
+
+    # Последнее изменение строки витрины — для ETag списка и поиска сирот после rebuild
+    refreshed_at = Column(DateTime, nullable=False)
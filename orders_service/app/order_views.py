@@ -0,0 +1,98 @@
+"""
+Перестройка витрины заказов (order_views) из источников: после включения витрины,
+потери событий или ручной правки данных.
+
+Заказы, платежи и доставки читаются тем же merge-join'ом keyset-потоков, что и сверка
+(app.reconcile). Поля заказа переносятся sync_orders, состояние платежа и доставки
+применяется как событие с версией «начало перестройки»: событие из outbox, пришедшее
+за время прохода, новее снимка и не перетирается, а снимок перекрывает всё, что было
+до начала. Работает под нагрузкой, без блокировки витрины. В конце удаляются строки
+заказов, которых больше нет (физически удалены purger'ом).
+
+Запуск в контейнере orders:
+    python -m app.order_views
+"""
+import argparse
+import asyncio
+import json
+import logging
+from datetime import datetime, timezone
+
+from fastapi.concurrency import run_in_threadpool
+
+from app.core.http_client import close_http_client
+from app.core.logging_setup import setup_logging, shutdown_logging
+from app.crud.order_views import apply_view_events, drop_orphans, sync_orders
+from app.db.database import SessionLocal
+from app.reconcile import RECONCILE_BATCH_SIZE, RECONCILE_PAGE_SIZE, full_batches
+from app.schemas.order import ViewEvent
+
+logger = logging.getLogger(__name__)
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _snapshot_event(topic: str, order_id: int, row: dict | None, version) -> ViewEvent:
+    # Нет строки — секция очищается так же, как по событию удаления
+    return ViewEvent(id=0, topic=topic, key=order_id, payload=row or {"deleted": True}, emitted_at=version)
+
+
+def _apply(order_ids: list, events: list) -> dict:
+    with SessionLocal() as db:
+        sync_orders(db, order_ids)
+        return apply_view_events(db, events, observe_lag=False)
+
+
+def _drop_orphans(refreshed_before) -> int:
+    with SessionLocal() as db:
+        return drop_orphans(db, refreshed_before)
+
+
+async def rebuild(batch_size: int = RECONCILE_BATCH_SIZE, page_size: int = RECONCILE_PAGE_SIZE) -> dict:
+    started_at = _now()
+    orders, applied, stale = 0, 0, 0
+    async for batch in full_batches(batch_size, page_size):
+        # Помеченные удалёнными тоже синхронизируем: sync_orders уберёт их строки
+        order_ids = [order_id for order_id, order, _, _ in batch if order is not None]
+        events = [
+            event
+            for order_id, order, payment, delivery in batch
+            if order is not None and order.deleted_at is None
+            for event in (_snapshot_event("payment", order_id, payment, started_at),
+                          _snapshot_event("delivery", order_id, delivery, started_at))
+        ]
+        outcomes = await run_in_threadpool(_apply, order_ids, events)
+        orders += len(events) // 2
+        applied += outcomes["applied"]
+        stale += outcomes["stale"]
+
+    removed = await run_in_threadpool(_drop_orphans, started_at)
+    report = {
+        "orders": orders,
+        "sections_applied": applied,
+        "sections_newer": stale,
+        "removed": removed,
+        "seconds": round((_now() - started_at).total_seconds(), 2),
+    }
+    logger.info("Витрина заказов перестроена: %s", json.dumps(report, ensure_ascii=False))
+    return report
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=RECONCILE_BATCH_SIZE)
+    parser.add_argument("--page-size", type=int, default=RECONCILE_PAGE_SIZE)
+    args = parser.parse_args()
+
+    setup_logging("orders_order_views")
+    try:
+        print(json.dumps(await rebuild(args.batch_size, args.page_size), ensure_ascii=False))
+    finally:
+        await close_http_client()
+        shutdown_logging()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,357 @@
+"""
+Сверка заказов с платежами и доставками: находит (и с --repair исправляет) расхождения,
+которые оставляют best-effort побочные эффекты create_payment и каскадных удалений.
+
+Заказы читаются из своей БД (вместе с помеченными удалёнными), платежи и доставки —
+keyset-страницами GET /?after_order_id= из Payments и Delivery. Все три потока отсортированы
+по order_id и сливаются merge-join'ом: в памяти — по странице на поток, размер таблиц
+значения не имеет.
+
+Инкрементальный прогон (по умолчанию) берёт только order_id, у которых с водяного знака
+(начала прошлого успешного прогона минус RECONCILE_OVERLAP) что-то изменилось хотя бы
+в одном сервисе — включая удаление заказа, — и дочитывает их состояние пачками по
+--batch-size. Первый прогон и --full сверяют всё. Прогоны и водяной знак хранятся в
+таблице reconciliation_runs.
+
+Расхождения и исправления (--repair):
+  * payment_without_order / delivery_without_order — заказа нет или он удалён:
+    DELETE /by-order/{order_id} в Payments / Delivery;
+  * paid_without_delivery — заказ оплачен, доставки нет: POST /delivery/;
+  * payment_for_unpaid_order — платёж проведён, заказ в pending: заказ → paid;
+  * paid_without_payment, delivery_for_unpaid_order — только в отчёте (нужен разбор).
+Заказы с платежом в processing (идёт сага) пропускаются.
+
+Запуск в контейнере orders:
+    python -m app.reconcile                 # инкрементально, только отчёт
+    python -m app.reconcile --full --repair
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import (
+    JSON, Column, DateTime, Integer, MetaData, String, Table, Text, func, insert, or_, select, update,
+)
+
+from app.core.http_client import close_http_client, get_http_client
+from app.core.logging_setup import setup_logging, shutdown_logging
+from app.crud.orders import DELIVERY_SERVICE_URL, PAYMENTS_SERVICE_URL, update_order_status
+from app.db.database import SessionLocal, engine
+from app.models.order import Order
+
+logger = logging.getLogger(__name__)
+
+RECONCILE_PAGE_SIZE = int(os.getenv("RECONCILE_PAGE_SIZE", "1000"))
+RECONCILE_BATCH_SIZE = int(os.getenv("RECONCILE_BATCH_SIZE", "200"))
+# Запас назад от водяного знака: расхождение часов реплик и транзакции, начатые до прошлого прогона
+RECONCILE_OVERLAP = float(os.getenv("RECONCILE_OVERLAP", "600"))
+RECONCILE_CONCURRENCY = 8
+# Сколько order_id каждого вида расхождений попадает в отчёт
+SAMPLE_SIZE = 50
+TIMEOUT = 30.0
+
+PAID_STATUSES = ("paid", "shipped", "completed")
+# success ставит create_payment, completed — в демо-данных и старых записях
+SETTLED_PAYMENT_STATUSES = ("success", "completed")
+
+# Своя MetaData, как у background_jobs: таблица создаётся из init_db
+reconcile_metadata = MetaData()
+
+reconciliation_runs = Table(
+    "reconciliation_runs", reconcile_metadata,
+    Column("id", Integer, primary_key=True),
+    Column("mode", String(16), nullable=False),    # full, incremental
+    Column("status", String(16), nullable=False),  # running, completed, failed
+    Column("repair", Integer, nullable=False, default=0),
+    Column("changed_since", DateTime, nullable=True),
+    Column("started_at", DateTime, nullable=False, index=True),
+    Column("finished_at", DateTime, nullable=True),
+    Column("checked", Integer, nullable=False, default=0),
+    Column("mismatches", JSON, nullable=False, default=dict),
+    Column("repaired", Integer, nullable=False, default=0),
+    Column("error", Text, nullable=True),
+)
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+# --- Потоки, отсортированные по order_id ---
+
+def _order_page(after: int, limit: int, changed_since: datetime | None = None, ids=None):
+    stmt = (
+        select(Order.id, Order.status, Order.deleted_at)
+        .order_by(Order.id)
+        .limit(limit)
+        .execution_options(include_deleted=True)
+    )
+    if ids is not None:
+        stmt = stmt.where(Order.id.in_(ids))
+    else:
+        stmt = stmt.where(Order.id > after)
+    if changed_since is not None:
+        stmt = stmt.where(or_(
+            func.coalesce(Order.updated_at, Order.created_at) >= changed_since,
+            Order.deleted_at >= changed_since,
+        ))
+    with SessionLocal() as db:
+        return db.execute(stmt).all()
+
+
+async def _local_orders(changed_since: datetime | None = None, page_size: int = RECONCILE_PAGE_SIZE):
+    """Заказы своей БД keyset-страницами по id, включая помеченные удалёнными."""
+    after = 0
+    while True:
+        rows = await run_in_threadpool(_order_page, after, page_size, changed_since)
+        for row in rows:
+            yield row
+        if len(rows) < page_size:
+            return
+        after = rows[-1].id
+
+
+async def _remote(base_url: str, changed_since: datetime | None = None, page_size: int = RECONCILE_PAGE_SIZE):
+    """Платежи или доставки keyset-страницами по order_id (GET /?after_order_id=)."""
+    client = get_http_client()
+    after = 0
+    while True:
+        params = {"after_order_id": after, "limit": page_size}
+        if changed_since is not None:
+            params["changed_since"] = changed_since.isoformat()
+        response = await client.get(f"{base_url}/", params=params, timeout=TIMEOUT)
+        response.raise_for_status()
+        rows = response.json()
+        for row in rows:
+            yield row
+        if len(rows) < page_size:
+            return
+        after = rows[-1]["order_id"]
+
+
+async def _remote_by_order_ids(base_url: str, order_ids: list) -> dict:
+    client = get_http_client()
+    response = await client.get(f"{base_url}/", params={"order_id": order_ids, "limit": len(order_ids)},
+                                timeout=TIMEOUT)
+    response.raise_for_status()
+    return {row["order_id"]: row for row in response.json()}
+
+
+async def _merge_join(orders, payments, deliveries):
+    """Слияние трёх потоков по order_id: (order_id, order | None, payment | None, delivery | None)."""
+    streams = (orders, payments, deliveries)
+    keys = (lambda row: row.id, lambda row: row["order_id"], lambda row: row["order_id"])
+    heads = [await anext(stream, None) for stream in streams]
+    while any(head is not None for head in heads):
+        order_id = min(key(head) for key, head in zip(keys, heads) if head is not None)
+        group = []
+        for i, (stream, key) in enumerate(zip(streams, keys)):
+            if heads[i] is not None and key(heads[i]) == order_id:
+                group.append(heads[i])
+                heads[i] = await anext(stream, None)
+            else:
+                group.append(None)
+        yield (order_id, *group)
+
+
+async def _batched(groups, batch_size: int):
+    batch = []
+    async for group in groups:
+        batch.append(group)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def full_batches(batch_size: int, page_size: int):
+    """Пачки групп (order_id, order, payment, delivery) по всем заказам; их читает и перестройка витрины."""
+    groups = _merge_join(
+        _local_orders(page_size=page_size),
+        _remote(PAYMENTS_SERVICE_URL, page_size=page_size),
+        _remote(DELIVERY_SERVICE_URL, page_size=page_size),
+    )
+    async for batch in _batched(groups, batch_size):
+        yield batch
+
+
+async def _incremental_batches(changed_since: datetime, batch_size: int, page_size: int):
+    # Изменённые с водяного знака строки трёх сервисов дают order_id для сверки;
+    # их полное состояние (в т.ч. неизменившихся сторон) дочитывается пачкой
+    touched = _merge_join(
+        _local_orders(changed_since, page_size),
+        _remote(PAYMENTS_SERVICE_URL, changed_since, page_size),
+        _remote(DELIVERY_SERVICE_URL, changed_since, page_size),
+    )
+    async for batch in _batched(touched, batch_size):
+        order_ids = [group[0] for group in batch]
+        orders = {row.id: row for row in await run_in_threadpool(_order_page, 0, len(order_ids), None, order_ids)}
+        payments, deliveries = await asyncio.gather(
+            _remote_by_order_ids(PAYMENTS_SERVICE_URL, order_ids),
+            _remote_by_order_ids(DELIVERY_SERVICE_URL, order_ids),
+        )
+        yield [(order_id, orders.get(order_id), payments.get(order_id), deliveries.get(order_id))
+               for order_id in order_ids]
+
+
+# --- Проверка и исправление ---
+
+def classify(order, payment: dict | None, delivery: dict | None) -> list[str]:
+    if order is None or order.deleted_at is not None:
+        return (["payment_without_order"] if payment else []) + (["delivery_without_order"] if delivery else [])
+    if payment is not None and payment["status"] == "processing":
+        # Сага оплаты ещё идёт — состояние промежуточное
+        return []
+
+    mismatches = []
+    settled = payment is not None and payment["status"] in SETTLED_PAYMENT_STATUSES
+    if order.status in PAID_STATUSES:
+        if delivery is None:
+            mismatches.append("paid_without_delivery")
+        if not settled:
+            mismatches.append("paid_without_payment")
+    elif order.status == "pending":
+        if settled:
+            mismatches.append("payment_for_unpaid_order")
+        if delivery is not None:
+            mismatches.append("delivery_for_unpaid_order")
+    return mismatches
+
+
+async def _delete_by_order(base_url: str, order_id: int):
+    response = await get_http_client().delete(f"{base_url}/by-order/{order_id}", timeout=TIMEOUT)
+    if response.status_code not in (200, 204, 404):
+        response.raise_for_status()
+
+
+async def _create_delivery(order_id: int):
+    # Тот же адрес-заглушка, что ставит Payments Service при оплате
+    response = await get_http_client().post(f"{DELIVERY_SERVICE_URL}/",
+                                            json={"order_id": order_id, "address": "Адрес из заказа"},
+                                            timeout=TIMEOUT)
+    response.raise_for_status()
+
+
+def _mark_order_paid(order_id: int):
+    with SessionLocal() as db:
+        update_order_status(db, order_id=order_id, new_status="paid")
+
+
+REPAIRS = {
+    "payment_without_order": lambda order_id: _delete_by_order(PAYMENTS_SERVICE_URL, order_id),
+    "delivery_without_order": lambda order_id: _delete_by_order(DELIVERY_SERVICE_URL, order_id),
+    "paid_without_delivery": _create_delivery,
+    "payment_for_unpaid_order": lambda order_id: run_in_threadpool(_mark_order_paid, order_id),
+}
+
+
+async def _repair(kind: str, order_id: int, semaphore: asyncio.Semaphore) -> bool:
+    async with semaphore:
+        try:
+            await REPAIRS[kind](order_id)
+            return True
+        except Exception as e:
+            logger.warning("Сверка: не удалось исправить %s для заказа %s: %s", kind, order_id, e)
+            return False
+
+
+# --- Прогон ---
+
+def _last_watermark() -> datetime | None:
+    with engine.connect() as conn:
+        return conn.execute(
+            select(reconciliation_runs.c.started_at)
+            .where(reconciliation_runs.c.status == "completed")
+            .order_by(reconciliation_runs.c.started_at.desc())
+            .limit(1)
+        ).scalar()
+
+
+def _start_run(mode: str, repair: bool, changed_since: datetime | None, started_at: datetime) -> int:
+    with engine.begin() as conn:
+        return conn.execute(insert(reconciliation_runs).values(
+            mode=mode, status="running", repair=int(repair), changed_since=changed_since,
+            started_at=started_at, checked=0, mismatches={}, repaired=0,
+        )).inserted_primary_key[0]
+
+
+def _finish_run(run_id: int, **values):
+    with engine.begin() as conn:
+        conn.execute(update(reconciliation_runs).where(reconciliation_runs.c.id == run_id)
+                     .values(finished_at=_now(), **values))
+
+
+async def reconcile(full: bool = False, repair: bool = False, since: datetime | None = None,
+                    batch_size: int = RECONCILE_BATCH_SIZE, page_size: int = RECONCILE_PAGE_SIZE) -> dict:
+    started_at = _now()
+    if since is None and not full:
+        watermark = await run_in_threadpool(_last_watermark)
+        since = watermark - timedelta(seconds=RECONCILE_OVERLAP) if watermark is not None else None
+    mode = "incremental" if since is not None and not full else "full"
+    changed_since = since if mode == "incremental" else None
+    run_id = await run_in_threadpool(_start_run, mode, repair, changed_since, started_at)
+
+    checked, repaired, counts, samples = 0, 0, {}, {}
+    semaphore = asyncio.Semaphore(RECONCILE_CONCURRENCY)
+    batches = (_incremental_batches(changed_since, batch_size, page_size) if mode == "incremental"
+               else full_batches(batch_size, page_size))
+    try:
+        async for batch in batches:
+            repairs = []
+            for order_id, order, payment, delivery in batch:
+                checked += 1
+                for kind in classify(order, payment, delivery):
+                    counts[kind] = counts.get(kind, 0) + 1
+                    sample = samples.setdefault(kind, [])
+                    if len(sample) < SAMPLE_SIZE:
+                        sample.append(order_id)
+                    if repair and kind in REPAIRS:
+                        repairs.append(_repair(kind, order_id, semaphore))
+            # Исправления пачки — параллельно, но не больше RECONCILE_CONCURRENCY вызовов сразу
+            repaired += sum(await asyncio.gather(*repairs))
+    except Exception as e:
+        await run_in_threadpool(_finish_run, run_id, status="failed", checked=checked, mismatches=counts,
+                                repaired=repaired, error=f"{type(e).__name__}: {e}")
+        raise
+
+    await run_in_threadpool(_finish_run, run_id, status="completed", checked=checked, mismatches=counts,
+                            repaired=repaired)
+    report = {
+        "run_id": run_id,
+        "mode": mode,
+        "changed_since": changed_since.isoformat() if changed_since else None,
+        "checked": checked,
+        "mismatches": counts,
+        "samples": samples,
+        "repaired": repaired,
+        "seconds": round((_now() - started_at).total_seconds(), 2),
+    }
+    logger.info("Сверка завершена: %s", json.dumps(report, ensure_ascii=False))
+    return report
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--full", action="store_true", help="сверить всё, а не изменения с водяного знака")
+    parser.add_argument("--repair", action="store_true", help="исправить то, что исправимо автоматически")
+    parser.add_argument("--since", type=datetime.fromisoformat, help="водяной знак вручную (UTC, ISO 8601)")
+    parser.add_argument("--batch-size", type=int, default=RECONCILE_BATCH_SIZE)
+    parser.add_argument("--page-size", type=int, default=RECONCILE_PAGE_SIZE)
+    args = parser.parse_args()
+
+    setup_logging("orders_reconcile")
+    try:
+        report = await reconcile(args.full, args.repair, args.since, args.batch_size, args.page_size)
+        print(json.dumps(report, ensure_ascii=False))
+    finally:
+        await close_http_client()
+        shutdown_logging()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
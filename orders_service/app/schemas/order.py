@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field
+from typing import Any, Dict, List, Optional
 from datetime import datetime
 
 class OrderCreate(BaseModel):
@@ -19,4 +19,66 @@ class OrderInDB(BaseModel):
     updated_at: Optional[datetime] = None
 
     class Config:
-        from_attributes = True # В старых версиях Pydantic - orm_mode = True
\ No newline at end of file
+        from_attributes = True # В старых версиях Pydantic - orm_mode = True
+
+
+# Пакетная смена статусов (PATCH /bulk-status)
+BULK_STATUS_MAX_ITEMS = 1000
+
+class OrderStatusChange(BaseModel):
+    id: int
+    status: str
+
+class BulkStatusUpdate(BaseModel):
+    items: List[OrderStatusChange] = Field(..., min_length=1, max_length=BULK_STATUS_MAX_ITEMS)
+
+class BulkStatusItemResult(BaseModel):
+    id: int
+    outcome: str  # updated, not_found, invalid_status, duplicate
+    status: Optional[str] = None
+
+class BulkStatusResult(BaseModel):
+    updated: int
+    items: List[BulkStatusItemResult]
+
+
+# Витрина заказа с платежом и доставкой (GET /{id}/full, GET /?expand=full)
+class OrderFull(BaseModel):
+    order_id: int
+    user_id: int
+    status: str
+    total_amount: float
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    payment_id: Optional[int] = None
+    payment_status: Optional[str] = None
+    payment_amount: Optional[float] = None
+    payment_method: Optional[str] = None
+    delivery_id: Optional[int] = None
+    delivery_status: Optional[str] = None
+    delivery_address: Optional[str] = None
+    delivery_courier_id: Optional[str] = None
+    refreshed_at: datetime
+
+    class Config:
+        from_attributes = True
+
+
+# События для витрины от Payments / Delivery (POST /view-events, outbox relay)
+VIEW_EVENTS_MAX_ITEMS = 5000
+
+class ViewEvent(BaseModel):
+    id: int
+    topic: str            # payment, delivery
+    key: int              # order_id
+    payload: Dict[str, Any]
+    emitted_at: datetime  # версия события (UTC)
+
+class ViewEventBatch(BaseModel):
+    events: List[ViewEvent] = Field(..., max_length=VIEW_EVENTS_MAX_ITEMS)
+
+class ViewEventsResult(BaseModel):
+    applied: int
+    stale: int
+    no_order: int
+    unknown_topic: int
@@ -1,32 +1,100 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from datetime import datetime
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 
-from app.db.database import get_db
+from app.core.bulk_formats import (
+    BULK_RESPONSES, JSON, bulk_response, export_response, negotiate_media_type,
+)
+from app.core.etag import make_etag, etag_matches
+from app.core.fast_json import FAST_JSON_ENABLED, rows_response
+from app.db.database import SessionLocal, get_db
 from app.schemas.payment import PaymentCreate, PaymentInDB, PaymentUpdate
 from app.crud import payments as crud_payments
+from app.crud import sagas as crud_sagas
 
 router = APIRouter()
 
 
+def _payment_version(db_payment):
+    """Версия платежа для ETag: id + время последнего изменения."""
+    return db_payment.id, db_payment.updated_at or db_payment.created_at
+
+
 # CREATE
 @router.post("/", response_model=PaymentInDB, status_code=status.HTTP_201_CREATED)
 async def create_payment_route(payment: PaymentCreate, db: Session = Depends(get_db)):
+    if crud_sagas.SAGA_ENABLED:
+        return await crud_sagas.create_payment_saga(db=db, payment=payment)
     return await crud_payments.create_payment(db=db, payment=payment)
 
 
 # READ ALL
-@router.get("/", response_model=List[PaymentInDB])
-def read_payments_route(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return crud_payments.get_payments(db, skip=skip, limit=limit)
+@router.get("/", response_model=List[PaymentInDB], responses=BULK_RESPONSES)
+def read_payments_route(
+    request: Request,
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    after_order_id: Optional[int] = Query(None, description="keyset-страница по order_id"),
+    order_id: Optional[List[int]] = Query(None, max_length=1000),
+    changed_since: Optional[datetime] = None,
+    db: Session = Depends(get_db),
+):
+    filters = dict(after_order_id=after_order_id, order_ids=order_id, changed_since=changed_since)
+    media_type = negotiate_media_type(request)
+    if FAST_JSON_ENABLED or media_type != JSON:
+        payments = crud_payments.get_payment_rows(db, skip=skip, limit=limit, **filters)
+    else:
+        payments = crud_payments.get_payments(db, skip=skip, limit=limit, **filters)
+
+    # ETag считаем до сериализации: при совпадении отдаём 304 без тела.
+    # Представления в разных форматах различаются, поэтому формат входит в ETag.
+    etag = make_etag(media_type, *(_payment_version(p) for p in payments))
+    headers = {"ETag": etag, "Vary": "Accept"}
+    if etag_matches(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    if media_type != JSON:
+        return bulk_response(payments, crud_payments.PAYMENT_COLUMNS, media_type, headers=headers)
+    if FAST_JSON_ENABLED:
+        return rows_response(payments, headers=headers)
+
+    response.headers.update(headers)
+    return payments
+
+
+# EXPORT (потоковая выгрузка всей таблицы)
+@router.get("/export", responses=BULK_RESPONSES)
+def export_payments_route(request: Request, batch_size: int = 10_000):
+    """
+    Потоковая выгрузка всех платежей: Arrow IPC stream, MessagePack или NDJSON (по Accept).
+    Строки читаются серверным курсором пачками по batch_size и сразу уходят клиенту.
+    """
+    def partitions():
+        # Своя сессия: генератор живёт дольше, чем зависимость get_db
+        db = SessionLocal()
+        try:
+            yield from crud_payments.iter_payment_partitions(db, batch_size=batch_size)
+        finally:
+            db.close()
+
+    return export_response(partitions(), crud_payments.PAYMENT_COLUMNS, negotiate_media_type(request))
 
 
 # READ ONE
 @router.get("/{payment_id}", response_model=PaymentInDB)
-def read_payment_route(payment_id: int, db: Session = Depends(get_db)):
+def read_payment_route(payment_id: int, request: Request, response: Response, db: Session = Depends(get_db)):
     db_payment = crud_payments.get_payment(db, payment_id=payment_id)
     if db_payment is None:
         raise HTTPException(status_code=404, detail="Payment not found")
+
+    etag = make_etag(*_payment_version(db_payment))
+    if etag_matches(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+    response.headers["ETag"] = etag
     return db_payment
 
 
@@ -0,0 +1,231 @@
+"""
+Адаптивный контроль допуска (admission control): сервис держит не больше limit запросов
+в обработке, остальные коротко ждут в очереди по приоритету или сразу получают
+503 с Retry-After. Без него при замедлении БД запросы без ограничения копятся в uvicorn
+и пуле потоков, и таймаут получают все клиенты, а не только лишние.
+
+* limit подбирается AIMD по задержке до начала ответа: превышена цель класса —
+  limit × ADMISSION_BACKOFF (не чаще раза в ADMISSION_DECREASE_INTERVAL); иначе,
+  если лимит действительно выбирается, — +1 за каждые limit завершённых запросов.
+  Границы — ADMISSION_MIN_LIMIT..ADMISSION_MAX_LIMIT (по умолчанию размер пула потоков:
+  сверх него sync-роуты всё равно ждут поток).
+* Классы роутов (ROUTE_CLASSES): critical — точечные чтения GET /{id}..., PATCH /{id}/status
+  и прочие межсервисные вызовы (INTERNAL_ROUTES: каскады, события витрины, пакетные статусы);
+  write — остальные изменения; read — списки и выгрузки. Класс занимает не больше своей доли лимита, так что
+  списки упираются в потолок первыми, а очередь отдаёт свободные места по приоритету.
+* Ждать места можно не дольше ADMISSION_MAX_WAIT, в очереди — не больше
+  ADMISSION_MAX_QUEUE запросов; дальше — 503.
+* Пробы, /metrics и SSE-потоки (/events) не ограничиваются.
+
+Метрики: admission_limit, admission_in_flight, admission_queue, admission_shed_total,
+admission_queue_wait_seconds.
+"""
+import asyncio
+import heapq
+import itertools
+import os
+import time
+
+from prometheus_client import Counter, Gauge, Histogram
+from starlette.responses import JSONResponse
+
+from app.core.startup import THREADPOOL_SIZE
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "1") == "1"
+ADMISSION_INITIAL_LIMIT = float(os.getenv("ADMISSION_INITIAL_LIMIT", "20"))
+ADMISSION_MIN_LIMIT = float(os.getenv("ADMISSION_MIN_LIMIT", "4"))
+ADMISSION_MAX_LIMIT = float(os.getenv("ADMISSION_MAX_LIMIT", str(THREADPOOL_SIZE)))
+# Цель по задержке для critical; у остальных классов — кратная (ROUTE_CLASSES)
+ADMISSION_LATENCY_TARGET = float(os.getenv("ADMISSION_LATENCY_TARGET", "0.25"))
+ADMISSION_BACKOFF = float(os.getenv("ADMISSION_BACKOFF", "0.9"))
+ADMISSION_DECREASE_INTERVAL = float(os.getenv("ADMISSION_DECREASE_INTERVAL", "0.5"))
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", "0.25"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "100"))
+ADMISSION_RETRY_AFTER = 1
+
+# Класс → (приоритет: меньше — раньше, доля лимита, цель по задержке в ADMISSION_LATENCY_TARGET)
+ROUTE_CLASSES = {
+    "critical": (0, 1.0, 1),
+    "write": (1, 0.8, 4),
+    "read": (2, 0.5, 4),
+}
+
+EXEMPT_PATHS = {"/healthz", "/readyz", "/metrics"}
+
+# Межсервисные вызовы (метод, первый сегмент пути) — critical: отклонённые, они рвут каскады
+# удаления и оставляют витрину заказов отстающей, вместо того чтобы снять нагрузку
+INTERNAL_ROUTES = {
+    ("DELETE", "by-order"),    # Orders → Payments / Delivery: каскад заказа
+    ("DELETE", "by-user"),     # Users → Orders: каскад пользователя
+    ("GET", "jobs"),           # Users опрашивает задачу каскада в Orders
+    ("POST", "view-events"),   # outbox relay Payments / Delivery → Orders
+    ("PATCH", "bulk-status"),  # Delivery → Orders (и пакеты курьерских терминалов)
+}
+
+ADMISSION_LIMIT = Gauge("admission_limit", "Текущий лимит одновременных запросов", multiprocess_mode="livesum")
+ADMISSION_IN_FLIGHT = Gauge(
+    "admission_in_flight", "Допущенные запросы в обработке", ["route_class"], multiprocess_mode="livesum",
+)
+ADMISSION_QUEUE = Gauge(
+    "admission_queue", "Запросы, ждущие допуска", ["route_class"], multiprocess_mode="livesum",
+)
+ADMISSION_SHED = Counter(
+    "admission_shed_total", "Запросы, отклонённые с 503",
+    ["route_class", "reason"],  # queue_full, timeout
+)
+ADMISSION_QUEUE_WAIT = Histogram(
+    "admission_queue_wait_seconds", "Ожидание допуска в очереди",
+    ["route_class"], buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25),
+)
+
+
+class Shed(Exception):
+    def __init__(self, reason: str):
+        self.reason = reason
+
+
+def route_class(scope) -> str | None:
+    """Класс запроса по методу и пути (без root_path); None — без ограничения."""
+    path = scope["path"]
+    root_path = scope.get("root_path", "")
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    if path in EXEMPT_PATHS or path.endswith("/events"):
+        return None
+    segments = path.strip("/").split("/")
+    by_id = segments[0].isdigit()
+    method = scope["method"]
+    if (method, segments[0]) in INTERNAL_ROUTES:
+        return "critical"
+    if method == "GET":
+        return "critical" if by_id else "read"
+    if method == "PATCH" and by_id and segments[1:] == ["status"]:
+        return "critical"
+    return "write"
+
+
+class AdaptiveLimiter:
+    """AIMD-лимит одновременных запросов с приоритетной очередью (живёт в event loop процесса)."""
+
+    def __init__(self, initial: float = ADMISSION_INITIAL_LIMIT,
+                 min_limit: float = ADMISSION_MIN_LIMIT, max_limit: float = ADMISSION_MAX_LIMIT):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = min(max(initial, min_limit), max_limit)
+        self.in_flight = 0
+        self._waiters = []  # (приоритет, порядок, future, класс)
+        self._order = itertools.count()
+        self._last_decrease = 0.0
+        ADMISSION_LIMIT.set(self.limit)
+
+    def _fits(self, cls: str) -> bool:
+        return self.in_flight < max(1.0, self.limit * ROUTE_CLASSES[cls][1])
+
+    async def acquire(self, cls: str):
+        priority = ROUTE_CLASSES[cls][0]
+        while self._waiters and self._waiters[0][2].done():
+            heapq.heappop(self._waiters)  # ушедшие по таймауту или отмене
+        # Очередь не обгоняем: место свободно, только если не ждёт никто приоритетнее или равный
+        if self._fits(cls) and not (self._waiters and self._waiters[0][0] <= priority):
+            self._grant(cls)
+            return
+        if len(self._waiters) >= ADMISSION_MAX_QUEUE:
+            raise Shed("queue_full")
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (priority, next(self._order), future, cls)
+        heapq.heappush(self._waiters, entry)
+        ADMISSION_QUEUE.labels(cls).inc()
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), ADMISSION_MAX_WAIT)
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled():
+                return  # место выдали в момент таймаута
+            future.cancel()
+            raise Shed("timeout")
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(cls)
+            future.cancel()
+            raise
+        finally:
+            ADMISSION_QUEUE.labels(cls).dec()
+            ADMISSION_QUEUE_WAIT.labels(cls).observe(time.perf_counter() - started)
+
+    def _grant(self, cls: str):
+        self.in_flight += 1
+        ADMISSION_IN_FLIGHT.labels(cls).inc()
+
+    def release(self, cls: str, latency: float | None = None):
+        self.in_flight -= 1
+        ADMISSION_IN_FLIGHT.labels(cls).dec()
+        if latency is not None:
+            self._adjust(cls, latency)
+        self._wake()
+
+    def _adjust(self, cls: str, latency: float):
+        target = ADMISSION_LATENCY_TARGET * ROUTE_CLASSES[cls][2]
+        now = time.monotonic()
+        if latency > target:
+            # Multiplicative decrease — не чаще раза за интервал: одна волна медленных ответов
+            # не должна схлопнуть лимит до минимума
+            if now - self._last_decrease >= ADMISSION_DECREASE_INTERVAL:
+                self.limit = max(self.min_limit, self.limit * ADMISSION_BACKOFF)
+                self._last_decrease = now
+        elif self.in_flight + 1 >= self.limit * ROUTE_CLASSES[cls][1] * 0.8:
+            # Additive increase, только пока класс упирается в свою долю: простой лимит не раздувает
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        ADMISSION_LIMIT.set(self.limit)
+
+    def _wake(self):
+        while self._waiters:
+            priority, _, future, cls = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)  # ушёл по таймауту или отмене
+                continue
+            if not self._fits(cls):
+                break
+            heapq.heappop(self._waiters)
+            self._grant(cls)
+            future.set_result(None)
+
+
+class AdmissionMiddleware:
+    """ASGI-middleware: допуск по AdaptiveLimiter, отказ — 503 с Retry-After."""
+
+    def __init__(self, app):
+        self.app = app
+        self.limiter = AdaptiveLimiter()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        cls = route_class(scope)
+        if cls is None:
+            return await self.app(scope, receive, send)
+
+        try:
+            await self.limiter.acquire(cls)
+        except Shed as e:
+            ADMISSION_SHED.labels(cls, e.reason).inc()
+            response = JSONResponse(
+                {"detail": "Сервис перегружен, повторите запрос позже"},
+                status_code=503, headers={"Retry-After": str(ADMISSION_RETRY_AFTER)},
+            )
+            return await response(scope, receive, send)
+
+        # Сигнал для AIMD — время до начала ответа: потоковые выгрузки не выглядят медленными
+        started = time.perf_counter()
+        latency = None
+
+        async def send_wrapper(message):
+            nonlocal latency
+            if message["type"] == "http.response.start" and latency is None:
+                latency = time.perf_counter() - started
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.limiter.release(cls, latency if latency is not None else time.perf_counter() - started)
@@ -0,0 +1,238 @@
+"""
+Idempotency-Key для POST: повтор запроса с тем же ключом получает сохранённый ответ,
+не выполняя обработчик (и, значит, не обращаясь к БД сервиса и к другим сервисам).
+
+Ключи и снимки ответов (статус, content-type, тело) лежат в таблице idempotency_keys
+общей БД сервиса — ключ виден всем репликам. Запись живёт IDEMPOTENCY_TTL секунд;
+просроченные удаляет фоновая задача пачками.
+
+* Первый запрос резервирует ключ (status_code = NULL), выполняется и сохраняет ответ.
+  Ответы 5xx и ответы больше IDEMPOTENCY_MAX_BODY не сохраняются — резерв снимается,
+  повтор выполнится заново.
+* Повтор с тем же телом → сохранённый ответ и заголовок Idempotent-Replayed: true.
+* Повтор, пока первый запрос ещё выполняется → 409 с Retry-After.
+* Тот же ключ с другим методом, путём или телом → 422.
+Резерв старше IDEMPOTENCY_LOCK_TIMEOUT (процесс упал посреди запроса) можно перехватить.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, Response
+from prometheus_client import Counter
+from sqlalchemy import (
+    Column, DateTime, Integer, LargeBinary, MetaData, String, Table, delete, insert, select, update,
+)
+from sqlalchemy.exc import IntegrityError
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", str(24 * 3600)))
+IDEMPOTENCY_LOCK_TIMEOUT = float(os.getenv("IDEMPOTENCY_LOCK_TIMEOUT", "60"))
+IDEMPOTENCY_MAX_BODY = int(os.getenv("IDEMPOTENCY_MAX_BODY", str(64 * 1024)))
+IDEMPOTENCY_PURGE_INTERVAL = float(os.getenv("IDEMPOTENCY_PURGE_INTERVAL", "300"))
+IDEMPOTENCY_PURGE_BATCH = int(os.getenv("IDEMPOTENCY_PURGE_BATCH", "1000"))
+
+MAX_KEY_LENGTH = 255
+
+IDEMPOTENCY_REQUESTS = Counter(
+    "idempotency_requests_total", "POST-запросы с Idempotency-Key по исходу",
+    ["outcome"],  # stored, replayed, in_progress, mismatch, not_stored
+)
+IDEMPOTENCY_PURGED = Counter("idempotency_keys_purged_total", "Удалённые просроченные Idempotency-Key")
+
+# Своя MetaData: таблица общая для сервисов и создаётся из init_db рядом с моделями сервиса
+idempotency_metadata = MetaData()
+
+idempotency_keys = Table(
+    "idempotency_keys", idempotency_metadata,
+    Column("key", String(MAX_KEY_LENGTH), primary_key=True),
+    Column("fingerprint", String(64), nullable=False),  # sha256 метода, пути и тела запроса
+    Column("status_code", Integer, nullable=True),      # NULL — запрос ещё выполняется
+    Column("content_type", String(100), nullable=True),
+    Column("body", LargeBinary, nullable=True),
+    Column("created_at", DateTime, nullable=False),
+    Column("expires_at", DateTime, nullable=False, index=True),
+)
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def request_fingerprint(method: str, path: str, body: bytes) -> str:
+    digest = hashlib.sha256(f"{method} {path}\n".encode())
+    digest.update(body)
+    return digest.hexdigest()
+
+
+# --- Хранилище ---
+
+def reserve_key(engine, key: str, fingerprint: str):
+    """Резервирует ключ. None — ключ наш; иначе — существующая запись (Row)."""
+    now = _now()
+    with engine.connect() as conn:
+        row = conn.execute(select(idempotency_keys).where(idempotency_keys.c.key == key)).first()
+        if row is not None:
+            abandoned = row.status_code is None and row.created_at < now - timedelta(seconds=IDEMPOTENCY_LOCK_TIMEOUT)
+            if row.expires_at > now and not abandoned:
+                return row
+            # Просроченный или брошенный ключ перехватываем условным UPDATE: из гонки выйдет один
+            taken = conn.execute(
+                update(idempotency_keys)
+                .where(idempotency_keys.c.key == key, idempotency_keys.c.created_at == row.created_at)
+                .values(fingerprint=fingerprint, status_code=None, content_type=None, body=None,
+                        created_at=now, expires_at=now + timedelta(seconds=IDEMPOTENCY_TTL))
+            ).rowcount
+            conn.commit()
+            if taken:
+                return None
+        else:
+            try:
+                conn.execute(insert(idempotency_keys).values(
+                    key=key, fingerprint=fingerprint, created_at=now,
+                    expires_at=now + timedelta(seconds=IDEMPOTENCY_TTL),
+                ))
+                conn.commit()
+                return None
+            except IntegrityError:
+                conn.rollback()
+        return conn.execute(select(idempotency_keys).where(idempotency_keys.c.key == key)).first()
+
+
+def store_response(engine, key: str, status_code: int, content_type: str | None, body: bytes):
+    with engine.begin() as conn:
+        conn.execute(
+            update(idempotency_keys).where(idempotency_keys.c.key == key)
+            .values(status_code=status_code, content_type=content_type, body=body)
+        )
+
+
+def release_key(engine, key: str):
+    with engine.begin() as conn:
+        conn.execute(delete(idempotency_keys).where(
+            idempotency_keys.c.key == key, idempotency_keys.c.status_code.is_(None)))
+
+
+def purge_expired_keys(engine, batch_size: int = IDEMPOTENCY_PURGE_BATCH) -> int:
+    """Удаляет просроченные ключи пачками по batch_size — короткие транзакции без долгих блокировок."""
+    purged = 0
+    while True:
+        batch = (
+            select(idempotency_keys.c.key)
+            .where(idempotency_keys.c.expires_at < _now())
+            .limit(batch_size)
+            .scalar_subquery()
+        )
+        with engine.begin() as conn:
+            deleted = conn.execute(delete(idempotency_keys).where(idempotency_keys.c.key.in_(batch))).rowcount
+        purged += deleted
+        if deleted < batch_size:
+            break
+    IDEMPOTENCY_PURGED.inc(purged)
+    return purged
+
+
+async def idempotency_purger(engine):
+    """Фоновая задача lifespan: периодически удаляет просроченные ключи."""
+    while True:
+        try:
+            purged = await run_in_threadpool(purge_expired_keys, engine)
+            if purged:
+                logger.info("Удалено просроченных Idempotency-Key: %d", purged)
+        except Exception:
+            logger.exception("Ошибка при удалении просроченных Idempotency-Key")
+        await asyncio.sleep(IDEMPOTENCY_PURGE_INTERVAL)
+
+
+# --- Middleware ---
+
+class IdempotencyMiddleware:
+    """ASGI-middleware: POST с заголовком Idempotency-Key выполняется не больше одного раза."""
+
+    def __init__(self, app, engine):
+        self.app = app
+        self.engine = engine
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST":
+            return await self.app(scope, receive, send)
+        raw_key = dict(scope["headers"]).get(b"idempotency-key")
+        if raw_key is None:
+            return await self.app(scope, receive, send)
+
+        key = raw_key.decode("latin-1").strip()
+        if not key or len(key) > MAX_KEY_LENGTH:
+            response = JSONResponse({"detail": f"Idempotency-Key: от 1 до {MAX_KEY_LENGTH} символов"}, status_code=400)
+            return await response(scope, receive, send)
+
+        # Тело читаем целиком: оно входит в отпечаток и затем отдаётся приложению заново
+        chunks = []
+        while True:
+            message = await receive()
+            if message["type"] != "http.request":
+                break
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                break
+        body = b"".join(chunks)
+        fingerprint = request_fingerprint("POST", scope["path"], body)
+
+        existing = await run_in_threadpool(reserve_key, self.engine, key, fingerprint)
+        if existing is not None:
+            return await self._reply_existing(existing, fingerprint, scope, receive, send)
+
+        body_sent = False
+
+        async def replay_receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        status_code, content_type, response_body, size = 500, None, [], 0
+
+        async def capture_send(message):
+            nonlocal status_code, content_type, size
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                content_type = dict(message.get("headers", [])).get(b"content-type", b"").decode("latin-1") or None
+            elif message["type"] == "http.response.body":
+                chunk = message.get("body", b"")
+                size += len(chunk)
+                if size <= IDEMPOTENCY_MAX_BODY:
+                    response_body.append(chunk)
+            await send(message)
+
+        try:
+            await self.app(scope, replay_receive, capture_send)
+        except BaseException:
+            await run_in_threadpool(release_key, self.engine, key)
+            raise
+
+        if status_code < 500 and size <= IDEMPOTENCY_MAX_BODY:
+            await run_in_threadpool(store_response, self.engine, key, status_code, content_type, b"".join(response_body))
+            IDEMPOTENCY_REQUESTS.labels("stored").inc()
+        else:
+            await run_in_threadpool(release_key, self.engine, key)
+            IDEMPOTENCY_REQUESTS.labels("not_stored").inc()
+
+    async def _reply_existing(self, row, fingerprint, scope, receive, send):
+        if row.fingerprint != fingerprint:
+            IDEMPOTENCY_REQUESTS.labels("mismatch").inc()
+            response = JSONResponse(
+                {"detail": "Idempotency-Key уже использован с другим запросом"}, status_code=422)
+        elif row.status_code is None:
+            IDEMPOTENCY_REQUESTS.labels("in_progress").inc()
+            response = JSONResponse(
+                {"detail": "Запрос с этим Idempotency-Key ещё выполняется"}, status_code=409,
+                headers={"Retry-After": "1"})
+        else:
+            IDEMPOTENCY_REQUESTS.labels("replayed").inc()
+            response = Response(row.body, status_code=row.status_code, media_type=row.content_type,
+                                headers={"Idempotent-Replayed": "true"})
+        await response(scope, receive, send)
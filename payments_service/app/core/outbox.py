@@ -0,0 +1,143 @@
+"""
+Transactional outbox: событие для другого сервиса пишется в таблицу outbox_events той же
+транзакцией, что и изменение данных, а фоновый relay пачками отправляет его получателю
+(POST {"events": [...]}) и после ответа 2xx удаляет отправленное.
+
+* Откат транзакции — события нет; падение процесса между commit и отправкой — событие
+  дождётся следующего relay. Доставка at-least-once: получатель обязан быть идемпотентным
+  (версия события — emitted_at, время записи в outbox).
+* Relay работает в каждом воркере; пачку захватывает аренда (locked_until) через
+  FOR UPDATE SKIP LOCKED, как в очереди доставок, — воркеры не шлют одно и то же.
+  Аренда, не снятая из-за ошибки или падения, истекает через OUTBOX_LEASE_SECONDS.
+* Метрики: отправлено (outbox_sent_total), очередь (outbox_pending) и отставание
+  (outbox_lag_seconds — возраст самого старого неотправленного события).
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+
+from fastapi.concurrency import run_in_threadpool
+from prometheus_client import Counter, Gauge
+from sqlalchemy import (
+    JSON, Column, DateTime, Integer, MetaData, String, Table, delete, func, insert, or_, select, update,
+)
+
+from app.core.http_client import get_http_client
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "500"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "0.5"))
+OUTBOX_LEASE_SECONDS = float(os.getenv("OUTBOX_LEASE_SECONDS", "30"))
+OUTBOX_RETRY_MAX = 30.0
+OUTBOX_TIMEOUT = 10.0
+
+OUTBOX_SENT = Counter("outbox_sent_total", "События outbox, принятые получателем", ["topic"])
+OUTBOX_PENDING = Gauge("outbox_pending", "Неотправленные события outbox", multiprocess_mode="max")
+OUTBOX_LAG = Gauge(
+    "outbox_lag_seconds", "Возраст самого старого неотправленного события outbox", multiprocess_mode="max",
+)
+
+# Своя MetaData: таблица общая для сервисов и создаётся из init_db рядом с моделями сервиса
+outbox_metadata = MetaData()
+
+outbox_events = Table(
+    "outbox_events", outbox_metadata,
+    Column("id", Integer, primary_key=True),
+    Column("topic", String(64), nullable=False),
+    Column("key", Integer, nullable=False),
+    Column("payload", JSON, nullable=False),
+    Column("created_at", DateTime, nullable=False),
+    Column("locked_until", DateTime, nullable=True),  # аренда relay; NULL — свободно
+)
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def emit(db, topic: str, key: int, payload: dict):
+    """Ставит событие в транзакцию db: уйдёт получателю только после commit."""
+    emit_many(db, topic, [(key, payload)])
+
+
+def emit_many(db, topic: str, events):
+    """
+    События (key, payload) пакетных изменений — многострочным INSERT по OUTBOX_BATCH_SIZE строк,
+    а не INSERT на событие.
+    """
+    now = _now()
+    rows = [{"topic": topic, "key": key, "payload": payload, "created_at": now} for key, payload in events]
+    for start in range(0, len(rows), OUTBOX_BATCH_SIZE):
+        db.execute(insert(outbox_events).values(rows[start:start + OUTBOX_BATCH_SIZE]))
+
+
+# --- Relay ---
+
+def claim_batch(engine, limit: int = OUTBOX_BATCH_SIZE) -> list:
+    """Захватывает до limit событий по порядку id; чужие аренды пропускает (SKIP LOCKED)."""
+    now = _now()
+    free = (
+        select(outbox_events.c.id)
+        .where(or_(outbox_events.c.locked_until.is_(None), outbox_events.c.locked_until < now))
+        .order_by(outbox_events.c.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .cte("free")
+    )
+    with engine.begin() as conn:
+        rows = conn.execute(
+            update(outbox_events)
+            .where(outbox_events.c.id == free.c.id)
+            .values(locked_until=now + timedelta(seconds=OUTBOX_LEASE_SECONDS))
+            .returning(outbox_events.c.id, outbox_events.c.topic, outbox_events.c.key,
+                       outbox_events.c.payload, outbox_events.c.created_at)
+        ).all()
+    return sorted(rows, key=lambda row: row.id)
+
+
+def delete_sent(engine, ids):
+    with engine.begin() as conn:
+        conn.execute(delete(outbox_events).where(outbox_events.c.id.in_(ids)))
+
+
+def observe_outbox(engine):
+    with engine.connect() as conn:
+        pending, oldest = conn.execute(select(func.count(), func.min(outbox_events.c.created_at))).one()
+    OUTBOX_PENDING.set(pending)
+    OUTBOX_LAG.set((_now() - oldest).total_seconds() if oldest is not None else 0)
+
+
+async def relay_once(engine, url: str) -> int:
+    """Отправляет одну пачку; возвращает её размер. Ошибка отправки — исключение, аренда истечёт сама."""
+    rows = await run_in_threadpool(claim_batch, engine)
+    if not rows:
+        return 0
+    events = [
+        {"id": row.id, "topic": row.topic, "key": row.key, "payload": row.payload,
+         "emitted_at": row.created_at.isoformat()}
+        for row in rows
+    ]
+    response = await get_http_client().post(url, json={"events": events}, timeout=OUTBOX_TIMEOUT)
+    response.raise_for_status()
+    await run_in_threadpool(delete_sent, engine, [row.id for row in rows])
+    for event in events:
+        OUTBOX_SENT.labels(event["topic"]).inc()
+    return len(rows)
+
+
+async def outbox_relay(engine, url: str):
+    """Фоновая задача lifespan: отправка outbox получателю; полная пачка — следующая без паузы."""
+    delay = OUTBOX_POLL_INTERVAL
+    while True:
+        try:
+            sent = await relay_once(engine, url)
+            await run_in_threadpool(observe_outbox, engine)
+            delay = OUTBOX_POLL_INTERVAL
+            if sent == OUTBOX_BATCH_SIZE:
+                continue
+        except Exception as e:
+            logger.warning("Outbox: не удалось отправить события в %s (%s), повтор через %.1f с", url, e, delay)
+            delay = min(delay * 2, OUTBOX_RETRY_MAX)
+        await asyncio.sleep(delay)
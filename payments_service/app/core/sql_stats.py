@@ -0,0 +1,134 @@
+import hashlib
+import logging
+import os
+import re
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+from app.core.metrics import route_template
+
+logger = logging.getLogger("app.sql")
+
+# Запросы дольше порога попадают в slow-query лог
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+# Сколько одинаковых по форме запросов за один HTTP-запрос считаем признаком N+1
+REPEATED_STATEMENT_THRESHOLD = int(os.getenv("REPEATED_STATEMENT_THRESHOLD", "5"))
+
+_PLACEHOLDER_RE = re.compile(r"%\(\w+\)s|%s|:\w+|\$\d+|\?")
+_PLACEHOLDER_LIST_RE = re.compile(r"\?(?:\s*,\s*\?)+")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+class RequestSqlStats:
+    __slots__ = ("count", "total_seconds", "shapes")
+
+    def __init__(self):
+        self.count = 0
+        self.total_seconds = 0.0
+        self.shapes: Counter = Counter()
+
+
+_request_stats: ContextVar[RequestSqlStats | None] = ContextVar("request_sql_stats", default=None)
+
+
+def statement_shape(statement: str) -> str:
+    """Форма запроса: плейсхолдеры → ?, списки IN (?, ?, ...) → ?+, пробелы схлопнуты."""
+    shape = _PLACEHOLDER_RE.sub("?", statement)
+    shape = _PLACEHOLDER_LIST_RE.sub("?+", shape)
+    return _WHITESPACE_RE.sub(" ", shape).strip()
+
+
+def statement_fingerprint(shape: str) -> str:
+    return hashlib.blake2b(shape.encode("utf-8"), digest_size=6).hexdigest()
+
+
+def parameters_fingerprint(parameters) -> dict | str:
+    """Типы связанных параметров без значений (значения могут содержать персональные данные)."""
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        if parameters and isinstance(parameters[0], (dict, list, tuple)):
+            return f"executemany[{len(parameters)}]"
+        return [type(value).__name__ for value in parameters]
+    return type(parameters).__name__
+
+
+def instrument_engine_sql_stats(engine):
+    """Подсчёт запросов и времени БД на запрос + slow-query лог."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("sql_stats_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["sql_stats_start"].pop()
+        stats = _request_stats.get()
+        shape = None
+        if stats is not None:
+            shape = statement_shape(statement)
+            stats.count += 1
+            stats.total_seconds += elapsed
+            stats.shapes[shape] += 1
+
+        if elapsed * 1000 >= SLOW_QUERY_MS:
+            shape = shape or statement_shape(statement)
+            logger.warning(
+                "slow query %.1fms fingerprint=%s params=%s: %s",
+                elapsed * 1000, statement_fingerprint(shape), parameters_fingerprint(parameters), shape,
+            )
+
+    @event.listens_for(engine, "handle_error")
+    def _on_error(context):
+        stack = context.connection.info.get("sql_stats_start") if context.connection is not None else None
+        if stack:
+            stack.pop()
+
+
+class SqlStatsMiddleware:
+    """
+    ASGI-middleware: число SQL-запросов и время БД на запрос в заголовке Server-Timing,
+    предупреждение при повторяющихся одинаковых запросах (N+1).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = RequestSqlStats()
+        token = _request_stats.set(stats)
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                total_ms = (time.perf_counter() - started) * 1000
+                timing = (
+                    f'db;dur={stats.total_seconds * 1000:.2f};desc="{stats.count} queries", '
+                    f"app;dur={total_ms:.2f}"
+                )
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"server-timing", timing.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_stats.reset(token)
+            self._report_repeated(scope, stats)
+
+    @staticmethod
+    def _report_repeated(scope, stats: RequestSqlStats):
+        if not stats.shapes:
+            return
+        shape, repeats = stats.shapes.most_common(1)[0]
+        if repeats >= REPEATED_STATEMENT_THRESHOLD:
+            logger.warning(
+                "possible N+1: %s %s executed %d identical statements fingerprint=%s (%d queries total): %s",
+                scope["method"], route_template(scope), repeats, statement_fingerprint(shape), stats.count, shape,
+            )
@@ -0,0 +1,161 @@
+"""
+Мягкое удаление (tombstone): вместо DELETE строка помечается deleted_at, а физически
+удаляется позже фоновым purger'ом — пачками, в окно низкой нагрузки.
+
+Короткий UPDATE одной строки вместо DELETE ... RETURNING не трогает индексы (кроме
+частичных) и не конкурирует с чтениями за блокировки; вакуум/компакция идут пачками.
+
+* Модели наследуют SoftDeleteMixin; уникальность и индексы для чтения — частичные
+  (WHERE deleted_at IS NULL, live_index), помеченные строки purger находит по
+  tombstone_index (WHERE deleted_at IS NOT NULL) — оба индекса маленькие.
+* install_soft_delete_filter(SessionLocal): все ORM-SELECT видят только живые строки
+  (execution_options(include_deleted=True) — посмотреть и помеченные).
+* delete_statement(Model, ...) — UPDATE deleted_at или, при SOFT_DELETE_ENABLED=0,
+  прежний DELETE; оба с RETURNING id.
+
+Purger удаляет строки старше TOMBSTONE_RETENTION пачками по PURGE_BATCH_SIZE в окне
+PURGE_WINDOW ("HH:MM-HH:MM" по UTC, пусто — в любое время). Метрики: скорость
+(tombstones_purged_total), отставание (tombstone_purge_lag_seconds — возраст самой
+старой помеченной строки) и очередь (tombstones_pending).
+"""
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+from fastapi.concurrency import run_in_threadpool
+from prometheus_client import Counter, Gauge, Histogram
+from sqlalchemy import Column, DateTime, Index, delete, event, func, select, text, update
+from sqlalchemy.orm import with_loader_criteria
+
+logger = logging.getLogger(__name__)
+
+SOFT_DELETE_ENABLED = os.getenv("SOFT_DELETE_ENABLED", "1") == "1"
+# Сколько помеченные строки хранятся до физического удаления (окно для разбора и восстановления)
+TOMBSTONE_RETENTION = float(os.getenv("TOMBSTONE_RETENTION", str(24 * 3600)))
+PURGE_WINDOW = os.getenv("PURGE_WINDOW", "01:00-05:00")
+PURGE_BATCH_SIZE = int(os.getenv("PURGE_BATCH_SIZE", "1000"))
+# Пауза между пачками: пропускаем вперёд рабочие запросы и даём догнать репликам
+PURGE_BATCH_PAUSE = float(os.getenv("PURGE_BATCH_PAUSE", "0.1"))
+PURGE_INTERVAL = float(os.getenv("PURGE_INTERVAL", "60"))
+
+TOMBSTONES_PURGED = Counter("tombstones_purged_total", "Физически удалённые помеченные строки", ["table"])
+TOMBSTONES_PENDING = Gauge(
+    "tombstones_pending", "Помеченные строки, ещё не удалённые purger'ом",
+    ["table"], multiprocess_mode="max",
+)
+TOMBSTONE_PURGE_LAG = Gauge(
+    "tombstone_purge_lag_seconds", "Возраст самой старой помеченной строки",
+    ["table"], multiprocess_mode="max",
+)
+TOMBSTONE_PURGE_BATCH = Histogram(
+    "tombstone_purge_batch_seconds", "Время удаления одной пачки помеченных строк",
+    ["table"], buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+
+_LIVE = text("deleted_at IS NULL")
+_TOMBSTONED = text("deleted_at IS NOT NULL")
+
+
+class SoftDeleteMixin:
+    deleted_at = Column(DateTime, nullable=True)
+
+
+def live_index(name: str, *columns: str, unique: bool = False) -> Index:
+    """Частичный индекс по живым строкам: уникальность не мешает повторно создать удалённое."""
+    return Index(name, *columns, unique=unique, postgresql_where=_LIVE, sqlite_where=_LIVE)
+
+
+def tombstone_index(table_name: str) -> Index:
+    """Частичный индекс по помеченным строкам — для purger'а."""
+    return Index(f"ix_{table_name}_tombstones", "deleted_at", postgresql_where=_TOMBSTONED, sqlite_where=_TOMBSTONED)
+
+
+def install_soft_delete_filter(session_factory):
+    @event.listens_for(session_factory, "do_orm_execute")
+    def _live_rows_only(execute_state):
+        if (
+            execute_state.is_select
+            and not execute_state.is_column_load
+            and not execute_state.is_relationship_load
+            and not execute_state.execution_options.get("include_deleted", False)
+        ):
+            execute_state.statement = execute_state.statement.options(
+                with_loader_criteria(SoftDeleteMixin, lambda cls: cls.deleted_at.is_(None), include_aliases=True)
+            )
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def delete_statement(model, *where):
+    """Удаление строк модели: UPDATE deleted_at (tombstone) или DELETE; RETURNING id."""
+    if SOFT_DELETE_ENABLED:
+        return (
+            update(model).where(*where, model.deleted_at.is_(None))
+            .values(deleted_at=_now()).returning(model.id)
+        )
+    return delete(model).where(*where).returning(model.id)
+
+
+# --- Purger ---
+
+def in_purge_window(now: datetime, window: str = PURGE_WINDOW) -> bool:
+    if not window:
+        return True
+    start, _, end = window.partition("-")
+    current = now.strftime("%H:%M")
+    start, end = start.strip(), end.strip()
+    # Окно может переходить через полночь: 22:00-04:00
+    return start <= current < end if start <= end else current >= start or current < end
+
+
+def purge_table(engine, table, batch_size: int = PURGE_BATCH_SIZE, deadline: float | None = None) -> int:
+    """Удаляет помеченные строки старше TOMBSTONE_RETENTION пачками; каждая пачка — своя короткая транзакция."""
+    name = table.name
+    purged = 0
+    while deadline is None or time.monotonic() < deadline:
+        cutoff = _now() - timedelta(seconds=TOMBSTONE_RETENTION)
+        batch = (
+            select(table.c.id).where(table.c.deleted_at < cutoff)
+            .order_by(table.c.deleted_at).limit(batch_size).scalar_subquery()
+        )
+        started = time.perf_counter()
+        with engine.begin() as conn:
+            deleted = conn.execute(delete(table).where(table.c.id.in_(batch))).rowcount
+        TOMBSTONE_PURGE_BATCH.labels(name).observe(time.perf_counter() - started)
+        TOMBSTONES_PURGED.labels(name).inc(deleted)
+        purged += deleted
+        if deleted < batch_size:
+            break
+        time.sleep(PURGE_BATCH_PAUSE)
+    return purged
+
+
+def observe_tombstones(engine, table):
+    with engine.connect() as conn:
+        pending, oldest = conn.execute(
+            select(func.count(), func.min(table.c.deleted_at)).where(table.c.deleted_at.is_not(None))
+        ).one()
+    TOMBSTONES_PENDING.labels(table.name).set(pending)
+    TOMBSTONE_PURGE_LAG.labels(table.name).set((_now() - oldest).total_seconds() if oldest is not None else 0)
+
+
+async def tombstone_purger(engine, tables):
+    """Фоновая задача lifespan: метрики каждые PURGE_INTERVAL, удаление — только в окне PURGE_WINDOW."""
+    while True:
+        try:
+            for table in tables:
+                if in_purge_window(_now()):
+                    # Пачки не должны выходить за интервал: иначе одна таблица займёт всё окно
+                    purged = await run_in_threadpool(
+                        purge_table, engine, table, PURGE_BATCH_SIZE, time.monotonic() + PURGE_INTERVAL,
+                    )
+                    if purged:
+                        logger.info("Удалено помеченных строк из %s: %d", table.name, purged)
+                await run_in_threadpool(observe_tombstones, engine, table)
+        except Exception:
+            logger.exception("Ошибка при удалении помеченных строк")
+        await asyncio.sleep(PURGE_INTERVAL)
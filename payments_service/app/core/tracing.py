@@ -0,0 +1,293 @@
+"""
+Лёгкий распределённый трейсинг по W3C Trace Context без внешнего коллектора.
+
+* входящий traceparent извлекается TracingMiddleware (его создаёт/пробрасывает nginx);
+* общий httpx-клиент внедряет traceparent в исходящие вызовы (TracingTransport);
+* SQL-запросы оборачиваются в спаны через события SQLAlchemy (instrument_engine_tracing);
+* сэмплер parent-based: решение родителя наследуется, корневые спаны — с вероятностью TRACE_SAMPLE_RATIO;
+* сэмплированные спаны пишутся фоновым потоком в файл в формате OTLP-JSON (по строке на пачку).
+"""
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import httpx
+from sqlalchemy import event
+
+from app.core.metrics import route_template
+
+logger = logging.getLogger(__name__)
+
+TRACE_SAMPLE_RATIO = float(os.getenv("TRACE_SAMPLE_RATIO", "0.1"))
+TRACE_EXPORT_DIR = os.getenv("TRACE_EXPORT_DIR", "/tmp/traces")
+
+# Коды OTLP
+SPAN_KIND_INTERNAL, SPAN_KIND_SERVER, SPAN_KIND_CLIENT = 1, 2, 3
+STATUS_UNSET, STATUS_OK, STATUS_ERROR = 0, 1, 2
+
+_TRACEPARENT_RE = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+_MAX_STATEMENT_LENGTH = 1000
+
+_current_span: ContextVar["Span | None"] = ContextVar("current_span", default=None)
+
+
+class Span:
+    __slots__ = (
+        "trace_id", "span_id", "parent_id", "sampled", "name", "kind",
+        "start_ns", "end_ns", "attributes", "status",
+    )
+
+    def __init__(self, name, kind, trace_id, parent_id, sampled, attributes=None):
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes or {}
+        self.status = STATUS_UNSET
+
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [_otlp_attribute(k, v) for k, v in self.attributes.items()],
+            "status": {"code": self.status},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def _otlp_attribute(key, value) -> dict:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+def parse_traceparent(header: str | None):
+    """traceparent → (trace_id, parent_span_id, sampled) или None, если заголовок невалиден."""
+    if not header:
+        return None
+    match = _TRACEPARENT_RE.match(header.strip().lower())
+    if not match or match.group(1) == "0" * 32 or match.group(2) == "0" * 16:
+        return None
+    return match.group(1), match.group(2), bool(int(match.group(3), 16) & 0x01)
+
+
+def current_span() -> "Span | None":
+    return _current_span.get()
+
+
+# --- Экспорт ---
+
+class FileSpanExporter:
+    """Фоновая запись спанов в OTLP-JSON (JSON Lines): запрос никогда не ждёт диск."""
+
+    def __init__(self, service_name: str, directory: str, batch_size: int = 512, flush_interval: float = 1.0):
+        self.service_name = service_name
+        self.path = os.path.join(directory, f"{service_name}-{os.getpid()}.otlp.jsonl")
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    def export(self, span: Span):
+        if self._thread is None:
+            self._start()
+        self._queue.put(span)
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            if batch[0] is None:
+                return
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    span = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if span is None:
+                    self._write(batch)
+                    return
+                batch.append(span)
+            self._write(batch)
+
+    def _write(self, spans):
+        payload = {
+            "resourceSpans": [{
+                "resource": {"attributes": [_otlp_attribute("service.name", self.service_name)]},
+                "scopeSpans": [{"scope": {"name": "microlab.tracing"}, "spans": [s.to_otlp() for s in spans]}],
+            }]
+        }
+        try:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(payload, ensure_ascii=False) + "\n")
+        except OSError as e:
+            logger.warning("Не удалось записать спаны в %s: %s", self.path, e)
+
+    def shutdown(self, timeout: float = 5.0):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout)
+            self._thread = None
+
+
+_exporter: FileSpanExporter | None = None
+
+
+def configure_tracing(service_name: str):
+    global _exporter
+    _exporter = FileSpanExporter(service_name, TRACE_EXPORT_DIR)
+
+
+def shutdown_tracing():
+    if _exporter is not None:
+        _exporter.shutdown()
+
+
+# --- Создание спанов ---
+
+def begin_span(name: str, kind: int = SPAN_KIND_INTERNAL, attributes: dict | None = None, remote_parent=None) -> Span:
+    """Создаёт спан: от удалённого родителя (traceparent), от текущего спана или корневой."""
+    parent = _current_span.get()
+    if remote_parent is not None:
+        trace_id, parent_id, sampled = remote_parent
+    elif parent is not None:
+        trace_id, parent_id, sampled = parent.trace_id, parent.span_id, parent.sampled
+    else:
+        trace_id, parent_id = f"{random.getrandbits(128):032x}", None
+        sampled = random.random() < TRACE_SAMPLE_RATIO
+    return Span(name, kind, trace_id, parent_id, sampled, attributes)
+
+
+def end_span(span: Span):
+    span.end_ns = time.time_ns()
+    if span.sampled and _exporter is not None:
+        _exporter.export(span)
+
+
+@contextmanager
+def start_span(name: str, kind: int = SPAN_KIND_INTERNAL, attributes: dict | None = None, remote_parent=None):
+    span = begin_span(name, kind, attributes, remote_parent)
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException:
+        span.status = STATUS_ERROR
+        raise
+    finally:
+        _current_span.reset(token)
+        end_span(span)
+
+
+# --- Входящие запросы ---
+
+class TracingMiddleware:
+    """ASGI-middleware: серверный спан на запрос с родителем из входящего traceparent."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope["headers"])
+        remote_parent = parse_traceparent(headers.get(b"traceparent", b"").decode("latin-1"))
+        method = scope["method"]
+
+        with start_span(method, SPAN_KIND_SERVER, {"http.request.method": method, "url.path": scope["path"]},
+                        remote_parent=remote_parent) as span:
+            async def send_wrapper(message):
+                if message["type"] == "http.response.start":
+                    span.attributes["http.response.status_code"] = message["status"]
+                    if message["status"] >= 500:
+                        span.status = STATUS_ERROR
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                route = route_template(scope)
+                span.name = f"{method} {route}"
+                span.attributes["http.route"] = route
+
+
+# --- Исходящие вызовы ---
+
+class TracingTransport(httpx.AsyncBaseTransport):
+    """Обёртка транспорта httpx: клиентский спан и внедрение traceparent в запрос."""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self._transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        attributes = {"http.request.method": request.method, "url.full": str(request.url.copy_with(query=None))}
+        with start_span(f"{request.method} {request.url.host}", SPAN_KIND_CLIENT, attributes) as span:
+            request.headers["traceparent"] = span.traceparent()
+            response = await self._transport.handle_async_request(request)
+            span.attributes["http.response.status_code"] = response.status_code
+            if response.status_code >= 500:
+                span.status = STATUS_ERROR
+            return response
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+# --- SQLAlchemy ---
+
+def instrument_engine_tracing(engine):
+    """Спан на каждый SQL-запрос (дочерний к спану текущего запроса)."""
+    db_system = engine.dialect.name
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "SQL"
+        span = begin_span(operation, SPAN_KIND_CLIENT, {
+            "db.system": db_system,
+            "db.statement": statement[:_MAX_STATEMENT_LENGTH],
+        })
+        conn.info.setdefault("trace_spans", []).append(span)
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        end_span(conn.info["trace_spans"].pop())
+
+    @event.listens_for(engine, "handle_error")
+    def _on_error(context):
+        spans = context.connection.info.get("trace_spans") if context.connection is not None else None
+        if spans:
+            span = spans.pop()
+            span.status = STATUS_ERROR
+            end_span(span)
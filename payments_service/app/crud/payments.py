@@ -1,15 +1,46 @@
+import logging
+import os
+from datetime import datetime
+
 import httpx
 from sqlalchemy.orm import Session
-from sqlalchemy import select, delete
+from sqlalchemy import func, select
 from fastapi import HTTPException, status
 
+from app.core.http_client import get_http_client
+from app.core.outbox import emit
+from app.core.tombstones import delete_statement
 from app.models.payment import Payment
 from app.schemas.payment import PaymentCreate, PaymentUpdate
 
+logger = logging.getLogger(__name__)
+
+# Колонки схемы PaymentInDB — для быстрых списков и выгрузок без ORM-объектов
+PAYMENT_COLUMNS = (
+    Payment.id, Payment.order_id, Payment.amount, Payment.status,
+    Payment.method, Payment.created_at, Payment.updated_at,
+)
+
 # Важно: Внутри Docker сети мы обращаемся к Nginx Gateway,
 # чтобы наш запрос к заказам тоже прошел через балансировщик!
-ORDERS_SERVICE_URL = "http://nginx_gateway/api/v1/orders"
-DELIVERY_SERVICE_URL = "http://nginx_gateway/api/v1/delivery"
+ORDERS_SERVICE_URL = os.getenv("ORDERS_SERVICE_URL", "http://nginx_gateway/api/v1/orders")
+DELIVERY_SERVICE_URL = os.getenv("DELIVERY_SERVICE_URL", "http://nginx_gateway/api/v1/delivery")
+# Приёмник событий витрины заказов (orders_service: order_views)
+ORDER_VIEW_EVENTS_URL = os.getenv("ORDER_VIEW_EVENTS_URL", f"{ORDERS_SERVICE_URL}/view-events")
+ORDER_VIEW_TOPIC = "payment"
+
+
+# --- События для витрины заказов (outbox: уходят вместе с commit) ---
+
+def emit_payment_state(db: Session, payment):
+    """Текущее состояние платежа (ORM-объект или строка с колонками PAYMENT_COLUMNS)."""
+    emit(db, ORDER_VIEW_TOPIC, payment.order_id, {
+        "id": payment.id, "status": payment.status, "amount": payment.amount, "method": payment.method,
+    })
+
+
+def emit_payment_deleted(db: Session, order_id: int):
+    emit(db, ORDER_VIEW_TOPIC, order_id, {"deleted": True})
 
 
 # --- Межсервисное общение с Orders Service ---
@@ -21,39 +52,39 @@ async def verify_order_can_be_paid(order_id: int):
     url = f"{ORDERS_SERVICE_URL}/{order_id}"
     TIMEOUT = 5.0
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(url, timeout=TIMEOUT)
-
-            if response.status_code == 404:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail=f"Заказ {order_id} не найден."
-                )
-
-            if response.status_code != 200:
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail="Не удалось получить данные о заказе."
-                )
+    client = get_http_client()
+    try:
+        response = await client.get(url, timeout=TIMEOUT)
 
-            order_data = response.json()
+        if response.status_code == 404:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Заказ {order_id} не найден."
+            )
 
-            # ВАЛИДАЦИЯ БИЗНЕС-ЛОГИКИ
-            if order_data['status'] != 'pending':
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail=f"Заказ {order_id} имеет статус '{order_data['status']}' и не может быть оплачен."
-                )
+        if response.status_code != 200:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Не удалось получить данные о заказе."
+            )
 
-            return True
+        order_data = response.json()
 
-        except httpx.RequestError as e:
+        # ВАЛИДАЦИЯ БИЗНЕС-ЛОГИКИ
+        if order_data['status'] != 'pending':
             raise HTTPException(
-                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                detail=f"Сервис заказов недоступен: {e}"
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Заказ {order_id} имеет статус '{order_data['status']}' и не может быть оплачен."
             )
 
+        return True
+
+    except httpx.RequestError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Сервис заказов недоступен: {e}"
+        )
+
 
 async def update_order_status_after_payment(order_id: int):
     """
@@ -63,23 +94,23 @@ async def update_order_status_after_payment(order_id: int):
     params = {"status": "paid"}
     TIMEOUT = 5.0
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.patch(url, params=params, timeout=TIMEOUT)
-
-            if response.status_code == 200:
-                print(f"✅ Статус заказа {order_id} обновлен на 'paid'")
-                return response.json()
-            else:
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail=f"Не удалось обновить статус заказа: {response.status_code}"
-                )
-        except httpx.RequestError as e:
+    client = get_http_client()
+    try:
+        response = await client.patch(url, params=params, timeout=TIMEOUT)
+
+        if response.status_code == 200:
+            logger.info("Статус заказа %s обновлен на 'paid'", order_id)
+            return response.json()
+        else:
             raise HTTPException(
-                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                detail=f"Orders Service недоступен: {e}"
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Не удалось обновить статус заказа: {response.status_code}"
             )
+    except httpx.RequestError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Orders Service недоступен: {e}"
+        )
 
 
 async def create_delivery_for_order(order_id: int):
@@ -94,27 +125,27 @@ async def create_delivery_for_order(order_id: int):
         "address": "Адрес из заказа"  # здесь можно подтягивать реальный адрес из Orders
     }
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(
-                url,
-                json=delivery_payload,
-                timeout=TIMEOUT
-            )
-
-            if response.status_code == 201:
-                print(f"✅ Доставка для заказа {order_id} создана автоматически")
-                return response.json()
-
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"Не удалось создать доставку: {response.status_code} - {response.text}"
-            )
-        except httpx.RequestError as e:
-            raise HTTPException(
-                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                detail=f"Delivery Service недоступен: {e}"
-            )
+    client = get_http_client()
+    try:
+        response = await client.post(
+            url,
+            json=delivery_payload,
+            timeout=TIMEOUT
+        )
+
+        if response.status_code == 201:
+            logger.info("Доставка для заказа %s создана автоматически", order_id)
+            return response.json()
+
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Не удалось создать доставку: {response.status_code} - {response.text}"
+        )
+    except httpx.RequestError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Delivery Service недоступен: {e}"
+        )
 
 
 # --- CRUD Операции ---
@@ -137,6 +168,8 @@ async def create_payment(db: Session, payment: PaymentCreate):
         status="success"
     )
     db.add(db_payment)
+    db.flush()
+    emit_payment_state(db, db_payment)
     db.commit()
     db.refresh(db_payment)
 
@@ -144,21 +177,50 @@ async def create_payment(db: Session, payment: PaymentCreate):
     try:
         await update_order_status_after_payment(payment.order_id)
     except Exception as e:
-        print(f"⚠️ Предупреждение: Платеж создан, но не удалось обновить статус заказа: {e}")
+        logger.warning("Платеж создан, но не удалось обновить статус заказа: %s", e)
 
     # 4. Создаем доставку
     try:
         delivery_data = await create_delivery_for_order(payment.order_id)
-        print(f"✅ Доставка автоматически создана: {delivery_data}")
+        logger.info("Доставка автоматически создана: %s", delivery_data)
     except Exception as e:
-        print(f"⚠️ Предупреждение: Платеж создан, но не удалось создать доставку: {e}")
+        logger.warning("Платеж создан, но не удалось создать доставку: %s", e)
 
     return db_payment
 
 
 # READ ALL
-def get_payments(db: Session, skip: int = 0, limit: int = 100):
-    return db.scalars(select(Payment).offset(skip).limit(limit)).all()
+def _filter_payments(stmt, skip: int, limit: int, after_order_id=None, order_ids=None, changed_since=None):
+    """
+    Фильтры списка платежей. С after_order_id — keyset-страница по order_id (WHERE order_id > ...
+    ORDER BY order_id по частичному индексу): так сверка между сервисами читает таблицу
+    по порядку без OFFSET. changed_since — созданные или изменённые с этого момента.
+    """
+    if order_ids:
+        stmt = stmt.where(Payment.order_id.in_(order_ids))
+    if changed_since is not None:
+        stmt = stmt.where(func.coalesce(Payment.updated_at, Payment.created_at) >= changed_since)
+    if after_order_id is not None:
+        return stmt.where(Payment.order_id > after_order_id).order_by(Payment.order_id).limit(limit)
+    return stmt.offset(skip).limit(limit)
+
+
+def get_payments(db: Session, skip: int = 0, limit: int = 100, **filters):
+    return db.scalars(_filter_payments(select(Payment), skip, limit, **filters)).all()
+
+
+def get_payment_rows(db: Session, skip: int = 0, limit: int = 100, **filters):
+    """Список платежей в виде Row (колонки схемы PaymentInDB), без ORM-объектов."""
+    return db.execute(_filter_payments(select(*PAYMENT_COLUMNS), skip, limit, **filters)).all()
+
+
+def iter_payment_partitions(db: Session, batch_size: int = 10_000):
+    """
+    Все платежи пачками по batch_size строк через серверный курсор (yield_per),
+    чтобы выгрузка не держала всю таблицу в памяти.
+    """
+    stmt = select(*PAYMENT_COLUMNS).order_by(Payment.id).execution_options(yield_per=batch_size)
+    yield from db.execute(stmt).partitions()
 
 
 # READ ONE
@@ -177,6 +239,8 @@ def update_payment(db: Session, payment_id: int, payment: PaymentUpdate):
         setattr(db_payment, key, value)
 
     db.add(db_payment)
+    if update_data:
+        emit_payment_state(db, db_payment)
     db.commit()
     db.refresh(db_payment)
     return db_payment
@@ -184,9 +248,10 @@ def update_payment(db: Session, payment_id: int, payment: PaymentUpdate):
 
 # DELETE по ID
 def delete_payment(db: Session, payment_id: int):
-    stmt = delete(Payment).where(Payment.id == payment_id).returning(Payment.id)
-    deleted_id = db.scalar(stmt)
-    if deleted_id:
+    stmt = delete_statement(Payment, Payment.id == payment_id).returning(Payment.order_id)
+    deleted = db.execute(stmt).first()
+    if deleted:
+        emit_payment_deleted(db, deleted.order_id)
         db.commit()
         return True
     return False
@@ -199,13 +264,14 @@ def delete_payment_by_order_id(db: Session, order_id: int) -> bool:
     Удаляет платеж, связанный с конкретным order_id.
     Используется для каскадного удаления (когда удаляется заказ или пользователь).
     """
-    stmt = delete(Payment).where(Payment.order_id == order_id).returning(Payment.id)
+    stmt = delete_statement(Payment, Payment.order_id == order_id)
     deleted_id = db.scalar(stmt)
     if deleted_id:
+        emit_payment_deleted(db, order_id)
         db.commit()
-        print(f"✅ Платеж для order_id={order_id} удалён")
+        logger.info("Платеж для order_id=%s удалён", order_id)
         return True
 
     # Платёж может отсутствовать — это не ошибка для каскадного сценария
-    print(f"ℹ️ Платеж для order_id={order_id} не найден, ничего не удаляем")
+    logger.info("Платеж для order_id=%s не найден, ничего не удаляем", order_id)
     return False
@@ -0,0 +1,268 @@
+"""
+Сага оплаты: платёж → статус заказа 'paid' → доставка, с компенсациями.
+
+Состояние саги (PaymentSaga) пишется в БД на каждом переходе, поэтому после падения
+процесса фоновый resumer дозавершает брошенные саги: шаг, прерванный на середине
+(исход неизвестен), сначала компенсируется, затем повторяется — все действия и
+компенсации идемпотентны. Шаги без взаимных зависимостей выполняются параллельно;
+здесь доставка зависит от статуса заказа (delivery проверяет 'paid'), так что цепочка
+последовательная.
+
+При ошибке шага выполненные шаги откатываются в обратном порядке (заказ → 'pending',
+доставка удаляется), а платёж аннулируется (помечается удалённым, чтобы заказ можно было оплатить снова;
+история остаётся в payment_sagas). PAYMENT_SAGA_ENABLED=0 возвращает прежнюю цепочку
+create_payment — для сравнения пропускной способности (benchmarks/payment_saga.py).
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+
+import httpx
+from fastapi import HTTPException, status
+from prometheus_client import Counter
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from app.core.http_client import get_http_client
+from app.core.tombstones import delete_statement
+from app.crud.payments import (
+    DELIVERY_SERVICE_URL, ORDERS_SERVICE_URL, PAYMENT_COLUMNS,
+    create_delivery_for_order, emit_payment_deleted, emit_payment_state, update_order_status_after_payment, verify_order_can_be_paid,
+)
+from app.db.database import SessionLocal
+from app.models.payment import Payment
+from app.models.saga import PaymentSaga
+from app.schemas.payment import PaymentCreate
+
+logger = logging.getLogger(__name__)
+
+SAGA_ENABLED = os.getenv("PAYMENT_SAGA_ENABLED", "1") == "1"
+# Сага без движения дольше этого считается брошенной (процесс упал) и подхватывается resumer'ом
+SAGA_RESUME_AFTER = float(os.getenv("SAGA_RESUME_AFTER", "30"))
+SAGA_RESUME_INTERVAL = float(os.getenv("SAGA_RESUME_INTERVAL", "10"))
+COMPENSATION_ATTEMPTS = 3
+
+SAGA_RESULTS = Counter("payment_saga_total", "Завершённые саги оплаты", ["status"])
+
+TIMEOUT = 5.0
+
+
+# --- Компенсации ---
+
+async def revert_order_status(order_id: int):
+    """Возвращает заказ в 'pending'. Удалённый заказ откатывать не нужно."""
+    client = get_http_client()
+    response = await client.patch(f"{ORDERS_SERVICE_URL}/{order_id}/status",
+                                  params={"status": "pending"}, timeout=TIMEOUT)
+    if response.status_code not in (200, 404):
+        raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY,
+                            detail=f"Не удалось откатить статус заказа: {response.status_code}")
+
+
+async def cancel_delivery_for_order(order_id: int):
+    """Удаляет доставку заказа; её отсутствие — не ошибка."""
+    client = get_http_client()
+    response = await client.delete(f"{DELIVERY_SERVICE_URL}/by-order/{order_id}", timeout=TIMEOUT)
+    if response.status_code not in (200, 204, 404):
+        raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY,
+                            detail=f"Не удалось отменить доставку: {response.status_code}")
+
+
+# --- Описание саги ---
+
+class SagaStep:
+    __slots__ = ("name", "action", "compensate", "depends_on")
+
+    def __init__(self, name, action, compensate, depends_on=()):
+        self.name = name
+        self.action = action
+        self.compensate = compensate
+        self.depends_on = depends_on
+
+
+# Порядок — топологический: компенсация идёт в обратном
+PAYMENT_SAGA_STEPS = (
+    SagaStep("mark_order_paid", update_order_status_after_payment, revert_order_status),
+    SagaStep("create_delivery", create_delivery_for_order, cancel_delivery_for_order,
+             depends_on=("mark_order_paid",)),
+)
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _describe(error: BaseException) -> str:
+    if isinstance(error, HTTPException):
+        return f"{error.status_code}: {error.detail}"
+    return f"{type(error).__name__}: {error}"
+
+
+def _save(db: Session, saga: PaymentSaga, **changes):
+    for key, value in changes.items():
+        setattr(saga, key, value)
+    saga.updated_at = _now()
+    db.commit()
+
+
+def _with_steps(saga: PaymentSaga, names, state: str) -> dict:
+    # JSON-колонку переприсваиваем целиком, иначе SQLAlchemy не заметит изменения
+    return {**saga.steps, **{name: state for name in names}}
+
+
+# --- Исполнение ---
+
+async def run_saga(db: Session, saga: PaymentSaga) -> PaymentSaga:
+    """Выполняет (или продолжает) сагу до completed/compensated; при неудачной компенсации остаётся compensating."""
+    steps = {step.name: step for step in PAYMENT_SAGA_STEPS}
+    # Состояние саги меняет только этот код: перечитывать его после каждого commit незачем,
+    # а ленивый SELECT открыл бы транзакцию, висящую на время межсервисного вызова
+    db.expire_on_commit = False
+
+    if saga.status == "running":
+        # Шаги, прерванные падением процесса: исход неизвестен — откатываем и выполняем заново
+        interrupted = [name for name, state in saga.steps.items() if state == "running"]
+        try:
+            for name in interrupted:
+                await steps[name].compensate(saga.order_id)
+            if interrupted:
+                _save(db, saga, steps=_with_steps(saga, interrupted, "pending"))
+        except (HTTPException, httpx.HTTPError) as e:
+            _save(db, saga, status="compensating", error=_describe(e))
+
+    while saga.status == "running":
+        ready = [
+            step for step in PAYMENT_SAGA_STEPS
+            if saga.steps[step.name] == "pending" and all(saga.steps[dep] == "done" for dep in step.depends_on)
+        ]
+        if not ready:
+            break
+
+        _save(db, saga, steps=_with_steps(saga, [step.name for step in ready], "running"))
+        results = await asyncio.gather(*(step.action(saga.order_id) for step in ready), return_exceptions=True)
+
+        failed = [(step, result) for step, result in zip(ready, results) if isinstance(result, BaseException)]
+        new_steps = _with_steps(saga, [step.name for step in ready], "done")
+        new_steps.update({step.name: "failed" for step, _ in failed})
+        if failed:
+            _save(db, saga, steps=new_steps, status="compensating", error=_describe(failed[0][1]))
+            logger.warning("Сага %s: шаг %s не выполнен (%s), компенсация",
+                           saga.id, failed[0][0].name, saga.error)
+        else:
+            _save(db, saga, steps=new_steps)
+
+    if saga.status == "running":
+        paid = db.execute(
+            update(Payment).where(Payment.id == saga.payment_id).values(status="success").returning(*PAYMENT_COLUMNS)
+        ).first()
+        if paid is not None:
+            emit_payment_state(db, paid)
+        _save(db, saga, status="completed")
+        SAGA_RESULTS.labels("completed").inc()
+    elif saga.status == "compensating":
+        await _compensate(db, saga)
+    return saga
+
+
+async def _compensate(db: Session, saga: PaymentSaga):
+    # Неудачный шаг тоже откатываем: запрос мог дойти до сервиса, а ответ — потеряться
+    for step in reversed(PAYMENT_SAGA_STEPS):
+        if saga.steps[step.name] not in ("done", "failed", "running"):
+            continue
+        for attempt in range(COMPENSATION_ATTEMPTS):
+            try:
+                await step.compensate(saga.order_id)
+                break
+            except (HTTPException, httpx.HTTPError) as e:
+                last_error = e
+                await asyncio.sleep(0.2 * 2 ** attempt)
+        else:
+            # Остаётся compensating — resumer повторит позже
+            _save(db, saga, error=f"компенсация {step.name}: {_describe(last_error)}")
+            logger.error("Сага %s: не удалось откатить шаг %s: %s", saga.id, step.name, saga.error)
+            SAGA_RESULTS.labels("compensation_failed").inc()
+            return
+        _save(db, saga, steps=_with_steps(saga, [step.name], "compensated"))
+
+    # Аннулирование платежа
+    if db.scalar(delete_statement(Payment, Payment.id == saga.payment_id)):
+        emit_payment_deleted(db, saga.order_id)
+    _save(db, saga, status="compensated")
+    SAGA_RESULTS.labels("compensated").inc()
+
+
+async def create_payment_saga(db: Session, payment: PaymentCreate) -> Payment:
+    """Создание платежа через сагу (вместо create_payment с предупреждениями в лог)."""
+    await verify_order_can_be_paid(payment.order_id)
+
+    db_payment = Payment(
+        order_id=payment.order_id,
+        amount=payment.amount,
+        method=payment.method,
+        status="processing",
+    )
+    db.add(db_payment)
+    db.flush()
+    emit_payment_state(db, db_payment)
+    # Платёж и состояние саги — одной транзакцией: после падения сага найдётся вместе с платежом
+    saga = PaymentSaga(
+        payment_id=db_payment.id, order_id=payment.order_id, amount=payment.amount, method=payment.method,
+        status="running", steps={step.name: "pending" for step in PAYMENT_SAGA_STEPS}, updated_at=_now(),
+    )
+    db.add(saga)
+    db.commit()
+
+    await run_saga(db, saga)
+
+    if saga.status == "completed":
+        db.refresh(db_payment)
+        return db_payment
+    if saga.status == "compensated":
+        raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=f"Оплата отменена: {saga.error}")
+    raise HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail=f"Оплата не завершена, отмена продолжится автоматически: {saga.error}",
+    )
+
+
+# --- Возобновление после падения ---
+
+async def resume_stale_sagas(batch_size: int = 100) -> int:
+    """Подхватывает саги без движения дольше SAGA_RESUME_AFTER. Возвращает число возобновлённых."""
+    cutoff = _now() - timedelta(seconds=SAGA_RESUME_AFTER)
+    resumed = 0
+    with SessionLocal() as db:
+        stale = db.scalars(
+            select(PaymentSaga)
+            .where(PaymentSaga.status.in_(("running", "compensating")), PaymentSaga.updated_at < cutoff)
+            .order_by(PaymentSaga.id)
+            .limit(batch_size)
+        ).all()
+        for saga in stale:
+            # Захват: ту же сагу мог взять другой воркер — условный UPDATE по прочитанному updated_at
+            claimed = db.execute(
+                update(PaymentSaga)
+                .where(PaymentSaga.id == saga.id, PaymentSaga.updated_at == saga.updated_at)
+                .values(updated_at=_now(), attempts=PaymentSaga.attempts + 1)
+            ).rowcount
+            db.commit()
+            if not claimed:
+                continue
+            db.refresh(saga)
+            logger.info("Возобновление саги %s (status=%s, steps=%s)", saga.id, saga.status, saga.steps)
+            await run_saga(db, saga)
+            resumed += 1
+    return resumed
+
+
+async def saga_resumer():
+    """Фоновая задача lifespan: периодически дозавершает брошенные саги."""
+    while True:
+        try:
+            resumed = await resume_stale_sagas()
+            if resumed:
+                logger.info("Возобновлено саг: %d", resumed)
+        except Exception:
+            logger.exception("Ошибка при возобновлении саг")
+        await asyncio.sleep(SAGA_RESUME_INTERVAL)
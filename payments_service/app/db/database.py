@@ -3,6 +3,8 @@ from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 
+from app.core.tombstones import install_soft_delete_filter
+
 # ИСПОЛЬЗУЕМ ПЕРЕМЕННЫЕ ДЛЯ PAYMENTS DB
 POSTGRES_USER = os.getenv("PAYMENTS_POSTGRES_USER")
 POSTGRES_PASSWORD = os.getenv("PAYMENTS_POSTGRES_PASSWORD")
@@ -10,14 +12,20 @@ POSTGRES_DB = os.getenv("PAYMENTS_POSTGRES_DB")
 DATABASE_HOST = os.getenv("PAYMENTS_DATABASE_HOST")
 DATABASE_PORT = os.getenv("PAYMENTS_DATABASE_PORT")
 
-SQLALCHEMY_DATABASE_URL = (
+# Полный URL (например, sqlite для локального стенда) имеет приоритет над переменными Postgres
+SQLALCHEMY_DATABASE_URL = os.getenv("PAYMENTS_DATABASE_URL") or (
     f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@"
     f"{DATABASE_HOST}:{DATABASE_PORT}/{POSTGRES_DB}"
 )
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+# SQLite-соединения по умолчанию привязаны к создавшему их потоку, а sync-роуты идут в пуле потоков
+connect_args = {"check_same_thread": False} if SQLALCHEMY_DATABASE_URL.startswith("sqlite") else {}
+
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args=connect_args)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Помеченные deleted_at строки в выборки не попадают
+install_soft_delete_filter(SessionLocal)
 
 Base = declarative_base()
 
@@ -1,9 +1,17 @@
+import logging
 from sqlalchemy.orm import Session
+from app.core.idempotency import idempotency_metadata
+from app.core.outbox import outbox_metadata
 from app.db.database import Base, engine
 from app.models.payment import Payment # Импортируем модель платежа
+from app.models.saga import PaymentSaga # Состояние саг оплаты
+
+logger = logging.getLogger(__name__)
 
 def init_db():
     Base.metadata.create_all(bind=engine)
+    idempotency_metadata.create_all(bind=engine)
+    outbox_metadata.create_all(bind=engine)
 
     db: Session = Session(bind=engine)
     try:
@@ -22,10 +30,10 @@ def init_db():
                 db.add(db_payment)
             
             db.commit()
-            print("База данных платежей проинициализирована 5 тестовыми записями.")
+            logger.info("База данных платежей проинициализирована 5 тестовыми записями.")
         else:
-            print("База данных платежей уже содержит данные, пропуск инициализации.")
+            logger.info("База данных платежей уже содержит данные, пропуск инициализации.")
     except Exception as e:
-        print(f"Ошибка инициализации БД платежей: {e}")
+        logger.exception("Ошибка инициализации БД платежей: %s", e)
     finally:
         db.close()
\ No newline at end of file
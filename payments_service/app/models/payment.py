@@ -1,18 +1,33 @@
+from datetime import datetime, timezone
+
 from sqlalchemy import Column, Integer, String, Float, DateTime
 from sqlalchemy.sql import func
+from app.core.tombstones import SoftDeleteMixin, live_index, tombstone_index
 from app.db.database import Base
 
-class Payment(Base):
+
+def _now() -> datetime:
+    # Время изменения — из Python, с микросекундами: func.now() в SQLite — с точностью до секунды,
+    # и два изменения за секунду давали одинаковый updated_at, а значит и ETag (ложный 304)
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class Payment(SoftDeleteMixin, Base):
     __tablename__ = "payments"
+    __table_args__ = (
+        # Один живой платёж на заказ; аннулированный (помеченный) не мешает оплатить снова
+        live_index("uq_payments_order_id_live", "order_id", unique=True),
+        tombstone_index("payments"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     
     # ID заказа, который оплачивается
-    order_id = Column(Integer, unique=True, nullable=False, index=True) 
+    order_id = Column(Integer, nullable=False)
     
     amount = Column(Float, nullable=False)
     status = Column(String, default="pending") # pending, completed, failed, refunded
     method = Column(String, nullable=False) # card, paypal, cash, etc.
     
     created_at = Column(DateTime, server_default=func.now())
-    updated_at = Column(DateTime, onupdate=func.now())
\ No newline at end of file
+    updated_at = Column(DateTime, onupdate=_now)
\ No newline at end of file
@@ -0,0 +1,23 @@
+from sqlalchemy import Column, Integer, String, Float, DateTime, JSON, Text
+from sqlalchemy.sql import func
+from app.db.database import Base
+
+class PaymentSaga(Base):
+    """Состояние саги оплаты: переживает падение процесса и дозавершается при рестарте."""
+    __tablename__ = "payment_sagas"
+
+    id = Column(Integer, primary_key=True, index=True)
+
+    payment_id = Column(Integer, nullable=False, index=True)
+    order_id = Column(Integer, nullable=False, index=True)
+    amount = Column(Float, nullable=False)
+    method = Column(String, nullable=False)
+
+    status = Column(String, nullable=False, default="running", index=True) # running, completed, compensating, compensated
+    # Статус каждого шага: pending, running, done, failed, compensated
+    steps = Column(JSON, nullable=False)
+    error = Column(Text, nullable=True)
+    attempts = Column(Integer, nullable=False, default=1)
+
+    created_at = Column(DateTime, server_default=func.now())
+    updated_at = Column(DateTime, nullable=False)
@@ -1,14 +1,29 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+import logging
+
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
 from sqlalchemy.orm import Session
 from typing import List
 
+from app.core.etag import make_etag, etag_matches
+from app.core.fast_json import FAST_JSON_ENABLED, rows_response
+from app.core.jobs import JobStatus, start_job
 from app.db.database import get_db
 from app.schemas.user import UserInDB, UserCreate, UserUpdate
 from app.crud import users as crud_users
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter()
 
 
+def _user_version(db_user):
+    """
+    Версия пользователя для ETag.
+    В таблице users нет updated_at, поэтому берём отдаваемые наружу поля.
+    """
+    return db_user.id, db_user.full_name, db_user.email, db_user.is_active
+
+
 @router.post("/", response_model=UserInDB, status_code=status.HTTP_201_CREATED)
 def create_user(user: UserCreate, db: Session = Depends(get_db)):
     """Создание нового пользователя."""
@@ -23,9 +38,7 @@ def create_user(user: UserCreate, db: Session = Depends(get_db)):
     except HTTPException:
         raise
     except Exception as e:
-        import logging
-        logging.basicConfig(level=logging.ERROR)
-        logging.error(f"Error creating user: {str(e)}", exc_info=True)
+        logger.exception("Error creating user: %s", e)
         raise HTTPException(
             status_code=500,
             detail="Internal server error during user creation"
@@ -33,18 +46,43 @@ def create_user(user: UserCreate, db: Session = Depends(get_db)):
 
 
 @router.get("/", response_model=List[UserInDB])
-def read_users(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    """Получение списка пользователей."""
-    users = crud_users.get_users(db, skip=skip, limit=limit)
+def read_users(
+    request: Request,
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    db: Session = Depends(get_db),
+):
+    """Получение списка пользователей (поддерживает If-None-Match)."""
+    if FAST_JSON_ENABLED:
+        users = crud_users.get_user_rows(db, skip=skip, limit=limit)
+    else:
+        users = crud_users.get_users(db, skip=skip, limit=limit)
+
+    # ETag считаем до сериализации: при совпадении отдаём 304 без тела
+    etag = make_etag(*(_user_version(u) for u in users))
+    if etag_matches(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+    if FAST_JSON_ENABLED:
+        return rows_response(users, headers={"ETag": etag})
+
+    response.headers["ETag"] = etag
     return users
 
 
 @router.get("/{user_id}", response_model=UserInDB)
-def read_user(user_id: int, db: Session = Depends(get_db)):
-    """Получение пользователя по ID."""
+def read_user(user_id: int, request: Request, response: Response, db: Session = Depends(get_db)):
+    """Получение пользователя по ID (поддерживает If-None-Match)."""
     db_user = crud_users.get_user(db, user_id=user_id)
     if db_user is None:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
+
+    etag = make_etag(*_user_version(db_user))
+    if etag_matches(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+    response.headers["ETag"] = etag
     return db_user
 
 
@@ -59,14 +97,16 @@ def update_user(user_id: int, user: UserUpdate, db: Session = Depends(get_db)):
 
 # --- НОВОЕ: каскадное удаление пользователя ---
 
-@router.delete("/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_user(user_id: int, db: Session = Depends(get_db)):
+@router.delete("/{user_id}", response_model=JobStatus, status_code=status.HTTP_202_ACCEPTED)
+async def delete_user(user_id: int, request: Request, response: Response, db: Session = Depends(get_db)):
     """
-    Каскадное удаление пользователя:
+    Каскадное удаление пользователя фоновой задачей:
     - удаляет все его заказы (Orders → Payments + Delivery)
     - затем удаляет пользователя
+    Сразу отвечает 202 с id задачи; ход и ошибки (например, активные доставки) — GET /jobs/{id}.
     """
-    success = await crud_users.cascade_delete_user(db, user_id=user_id)
-    if not success:
+    if crud_users.get_user(db, user_id=user_id) is None:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
-    return
+    job = await start_job("cascade_delete_user", user_id)
+    response.headers["Location"] = f"{request.scope.get('root_path', '')}/jobs/{job.id}"
+    return job
@@ -0,0 +1,43 @@
+"""
+Production-профиль: gunicorn как менеджер процессов + uvicorn-воркеры (uvloop, httptools).
+Запуск: gunicorn app.main:app -c python:app.core.gunicorn_conf --bind 0.0.0.0:PORT
+"""
+import os
+
+
+def _available_cpus() -> int:
+    """Число CPU с учётом cgroup-квоты контейнера (cpu.max) и affinity."""
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, int(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+# Async-воркеры не блокируются на I/O, поэтому один воркер на ядро
+workers = int(os.getenv("WEB_CONCURRENCY", _available_cpus()))
+worker_class = "uvicorn_worker.UvicornWorker"
+
+# Плавная перезагрузка воркеров (защита от утечек памяти); джиттер разносит рестарты во времени
+max_requests = int(os.getenv("MAX_REQUESTS", "10000"))
+max_requests_jitter = int(os.getenv("MAX_REQUESTS_JITTER", "1000"))
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+timeout = int(os.getenv("WORKER_TIMEOUT", "60"))
+
+# Дольше, чем keepalive_timeout у upstream в nginx (60s): соединение закрывает nginx, а не мы
+keepalive = 75
+
+# Без preload: у каждого воркера свой engine и пул соединений (не делим сокеты через fork)
+preload_app = False
+
+
+def child_exit(server, worker):
+    # Убираем live-gauges завершившегося воркера из агрегата /metrics
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
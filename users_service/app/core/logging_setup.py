@@ -0,0 +1,169 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import uuid
+from contextvars import ContextVar
+
+import orjson
+
+from app.core.tracing import current_span
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+# Сэмплирование INFO-сообщений по логгерам: "app.crud.payments=0.1,app.crud.deliveries=0.5".
+# WARNING и выше пишутся всегда.
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")
+
+_request_id: ContextVar[str | None] = ContextVar("request_id", default=None)
+_listener: logging.handlers.QueueListener | None = None
+
+
+def current_request_id() -> str | None:
+    return _request_id.get()
+
+
+class ContextFilter(logging.Filter):
+    """Добавляет service, request_id и trace/span id. Выполняется в потоке запроса, до очереди."""
+
+    def __init__(self, service_name: str):
+        super().__init__()
+        self.service_name = service_name
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.service = self.service_name
+        record.request_id = _request_id.get()
+        span = current_span()
+        record.trace_id = span.trace_id if span is not None else None
+        record.span_id = span.span_id if span is not None else None
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Пропускает долю INFO/DEBUG-записей для логгеров с настроенной частотой (по префиксу имени)."""
+
+    def __init__(self, rates: dict):
+        super().__init__()
+        # Более длинные префиксы проверяем первыми
+        self.rates = sorted(rates.items(), key=lambda item: -len(item[0]))
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        for prefix, rate in self.rates:
+            if record.name == prefix or record.name.startswith(prefix + "."):
+                return random.random() < rate
+        return True
+
+
+class _QueueFormatter(logging.Formatter):
+    """
+    QueueHandler.prepare() склеивает traceback с сообщением и обнуляет exc_info —
+    сохраняем traceback отдельным атрибутом, чтобы в JSON он был отдельным полем.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        if record.exc_info:
+            record.exception = self.formatException(record.exc_info)
+        return record.getMessage()
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись. Выполняется в потоке QueueListener."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "service": getattr(record, "service", None),
+            "msg": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+            "trace_id": getattr(record, "trace_id", None),
+            "span_id": getattr(record, "span_id", None),
+        }
+        exception = getattr(record, "exception", None)
+        if exception is None and record.exc_info:
+            exception = self.formatException(record.exc_info)
+        if exception:
+            payload["exception"] = exception
+        return orjson.dumps(payload, default=str).decode("utf-8")
+
+
+def _parse_sample_rates(value: str) -> dict:
+    rates = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, rate = item.partition("=")
+        try:
+            rates[name.strip()] = float(rate)
+        except ValueError:
+            continue
+    return rates
+
+
+def setup_logging(service_name: str):
+    """
+    Корневой логгер пишет в очередь (QueueHandler), а форматирование в JSON и запись
+    в stdout выполняет фоновый QueueListener — запрос не блокируется на stdout.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.setFormatter(_QueueFormatter())
+    queue_handler.addFilter(SamplingFilter(_parse_sample_rates(LOG_SAMPLE_RATES)))
+    queue_handler.addFilter(ContextFilter(service_name))
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter())
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(LOG_LEVEL)
+
+    # Логи uvicorn/gunicorn тоже идут через очередь в JSON
+    for name in ("uvicorn", "uvicorn.error", "uvicorn.access", "gunicorn.error", "gunicorn.access"):
+        server_logger = logging.getLogger(name)
+        server_logger.handlers = []
+        server_logger.propagate = True
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class RequestIdMiddleware:
+    """ASGI-middleware: request id из X-Request-ID (ставит nginx) или новый; возвращается в ответе."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        header = dict(scope["headers"]).get(b"x-request-id")
+        request_id = header.decode("latin-1")[:64] if header else uuid.uuid4().hex
+        token = _request_id.set(request_id)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_id.reset(token)
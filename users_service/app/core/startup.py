@@ -0,0 +1,176 @@
+import asyncio
+import logging
+import os
+import random
+import time
+import zlib
+
+import anyio.to_thread
+import httpx
+from fastapi import APIRouter, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from app.core.http_client import close_http_client, get_http_client
+from app.core.metrics import record_startup
+from app.core.tracing import shutdown_tracing, start_span
+
+logger = logging.getLogger(__name__)
+
+# Сколько ждать БД при старте, прежде чем упасть (docker перезапустит контейнер)
+STARTUP_DB_TIMEOUT = float(os.getenv("STARTUP_DB_TIMEOUT", "60"))
+
+# Размер пула потоков AnyIO для sync-роутов (по умолчанию у AnyIO 40).
+# Имеет смысл держать не больше pool_size + max_overflow движка БД.
+THREADPOOL_SIZE = int(os.getenv("THREADPOOL_SIZE", "40"))
+
+_PROCESS_STARTED = time.monotonic()
+
+# Состояние старта процесса: отдаётся в /healthz и /readyz
+startup_state = {
+    "ready": False,
+    "pid": os.getpid(),
+    "threadpool_size": None,
+    "db_attempts": 0,
+    "db_wait_seconds": None,
+    "init_db_seconds": None,
+    "warmup_seconds": None,
+    "time_to_ready_seconds": None,
+}
+
+_warmup_task: asyncio.Task | None = None
+
+
+def wait_for_db(engine, timeout: float = STARTUP_DB_TIMEOUT) -> int:
+    """
+    Опрашивает БД (SELECT 1) с экспоненциальной задержкой и джиттером.
+    Возвращает число попыток; по истечении timeout пробрасывает ошибку подключения.
+    """
+    deadline = time.monotonic() + timeout
+    delay = 0.05
+    attempts = 0
+    while True:
+        attempts += 1
+        try:
+            with engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+            return attempts
+        except OperationalError:
+            if time.monotonic() >= deadline:
+                raise
+            time.sleep(delay * random.uniform(0.5, 1.5))
+            delay = min(delay * 2, 2.0)
+
+
+def run_with_advisory_lock(engine, lock_name: str, fn):
+    """
+    Выполняет fn под pg_advisory_lock, чтобы реплики не гонялись в create_all/сидинге.
+    Вне Postgres (например, SQLite в локальном стенде) просто вызывает fn.
+    """
+    if engine.dialect.name != "postgresql":
+        return fn()
+
+    key = zlib.crc32(lock_name.encode("utf-8"))
+    with engine.connect() as conn:
+        conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": key})
+        try:
+            return fn()
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": key})
+
+
+def warm_db_pool(engine):
+    """Заранее открывает соединения пула, чтобы первые запросы не платили за connect."""
+    size = engine.pool.size() if hasattr(engine.pool, "size") else 0
+    connections = [engine.connect() for _ in range(size)]
+    for conn in connections:
+        conn.close()
+
+
+async def warm_http_client(urls):
+    """Открывает keepalive-соединения к зависимостям (best effort: они могут ещё стартовать)."""
+    client = get_http_client()
+    hosts = {str(httpx.URL(url).copy_with(path="/", query=None)) for url in urls}
+    for host in hosts:
+        try:
+            await client.get(host, timeout=1.0)
+        except httpx.HTTPError:
+            pass
+
+
+async def _warm_up(engine, dependency_urls):
+    with start_span("service.warmup"):
+        step = time.monotonic()
+        try:
+            await run_in_threadpool(warm_db_pool, engine)
+            await warm_http_client(dependency_urls)
+        except Exception:
+            # Прогрев — оптимизация: без него сервис работает, только первые запросы медленнее
+            logger.exception("Прогрев не удался")
+        startup_state["warmup_seconds"] = round(time.monotonic() - step, 3)
+
+    startup_state["time_to_ready_seconds"] = round(time.monotonic() - _PROCESS_STARTED, 3)
+    startup_state["ready"] = True
+    record_startup(startup_state)
+    logger.info("Сервис готов за %ss: %s", startup_state["time_to_ready_seconds"], startup_state)
+
+
+async def run_startup(engine, init_db, lock_name: str, dependency_urls=()):
+    """
+    Старт сервиса в процессе uvicorn (вместо sleep + отдельного init_db):
+    ожидание БД → init_db под advisory lock, затем фоном прогрев пула и HTTP-клиента → ready.
+    Прогрев идёт, когда сервер уже принимает соединения: /healthz отвечает,
+    а /readyz отдаёт 503 "starting", пока он не закончится.
+    """
+    global _warmup_task
+    # Лимитер пула потоков привязан к event loop, поэтому настраиваем его здесь
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+    startup_state["threadpool_size"] = THREADPOOL_SIZE
+
+    # Все запросы старта (SELECT 1, create_all, сидинг) — в одном трейсе
+    with start_span("service.startup"):
+        started = time.monotonic()
+        startup_state["db_attempts"] = await run_in_threadpool(wait_for_db, engine)
+        startup_state["db_wait_seconds"] = round(time.monotonic() - started, 3)
+
+        step = time.monotonic()
+        await run_in_threadpool(run_with_advisory_lock, engine, lock_name, init_db)
+        startup_state["init_db_seconds"] = round(time.monotonic() - step, 3)
+
+    _warmup_task = asyncio.create_task(_warm_up(engine, dependency_urls))
+
+
+async def run_shutdown(engine):
+    # Сначала снимаем готовность, чтобы балансировщик перестал слать трафик
+    startup_state["ready"] = False
+    if _warmup_task is not None:
+        _warmup_task.cancel()
+    await close_http_client()
+    engine.dispose()
+    shutdown_tracing()
+
+
+probes_router = APIRouter()
+
+
+@probes_router.get("/healthz", include_in_schema=False)
+def healthz():
+    """Liveness: процесс жив и обслуживает запросы."""
+    return {
+        "status": "ok",
+        "uptime_seconds": round(time.monotonic() - _PROCESS_STARTED, 3),
+        "startup": startup_state,
+    }
+
+
+@probes_router.get("/readyz", include_in_schema=False)
+def readyz():
+    """Readiness: БД доступна, init_db выполнен, пулы прогреты (до этого — 503 "starting")."""
+    if not startup_state["ready"]:
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"status": "starting", "startup": startup_state},
+        )
+    return {"status": "ready", "startup": startup_state}
@@ -1,13 +1,23 @@
+import asyncio
+import logging
+import os
+
+from fastapi import HTTPException
 from sqlalchemy.orm import Session
-from sqlalchemy import delete
+from sqlalchemy import select
 import httpx
 
+from app.core.http_client import get_http_client
+from app.core.tombstones import delete_statement
+from app.db.database import SessionLocal
 from app.models.user import User
 from app.schemas.user import UserCreate, UserUpdate
 
+logger = logging.getLogger(__name__)
+
 # URL Orders Service через API Gateway
-ORDERS_SERVICE_URL = "http://nginx_gateway/api/v1/orders"
-DELIVERIES_SERVICE_URL = "http://nginx_gateway/api/v1/delivery/"
+ORDERS_SERVICE_URL = os.getenv("ORDERS_SERVICE_URL", "http://nginx_gateway/api/v1/orders")
+DELIVERIES_SERVICE_URL = os.getenv("DELIVERY_SERVICE_URL", "http://nginx_gateway/api/v1/delivery") + "/"
 
 import bcrypt
 
@@ -43,6 +53,12 @@ def get_users(db: Session, skip: int = 0, limit: int = 100):
     return db.query(User).offset(skip).limit(limit).all()
 
 
+def get_user_rows(db: Session, skip: int = 0, limit: int = 100):
+    """Список пользователей в виде Row (колонки схемы UserInDB, без хеша пароля)."""
+    stmt = select(User.id, User.full_name, User.email, User.is_active).offset(skip).limit(limit)
+    return db.execute(stmt).all()
+
+
 def create_user(db: Session, user: UserCreate):
     hashed_password = hash_password(user.password)
     db_user = User(
@@ -80,7 +96,7 @@ def update_user(db: Session, user_id: int, user: UserUpdate):
 # --- Обычное удаление только пользователя (оставим как вспомогательное) ---
 
 def _delete_user_only(db: Session, user_id: int) -> bool:
-    stmt = delete(User).where(User.id == user_id).returning(User.id)
+    stmt = delete_statement(User, User.id == user_id)
     deleted_id = db.scalar(stmt)
     if deleted_id is None:
         return False
@@ -88,85 +104,118 @@ def _delete_user_only(db: Session, user_id: int) -> bool:
     return True
 
 
-# --- НОВОЕ: каскадное удаление пользователя ---
-
-async def cascade_delete_user(db: Session, user_id: int) -> bool:
-    """
-    Каскадное удаление пользователя:
-    0. Проверяет, нет ли активных доставок по его заказам.
-    1. вызывает Orders Service для удаления всех его заказов (которые удалят payments+delivery)
-    2. удаляет самого пользователя
-    """
-    db_user = db.query(User).filter(User.id == user_id).first()
-    if not db_user:
-        return False
-
-    TIMEOUT = 5.0
-
-    # 0. Проверяем активные доставки через Delivery Service
-    async with httpx.AsyncClient() as client:
-        try:
-            # Получаем ВСЕ заказы пользователя
-            orders_url = f"{ORDERS_SERVICE_URL}/"
-            resp_orders = await client.get(orders_url, timeout=TIMEOUT)
-            if resp_orders.status_code != 200:
-                print(f"⚠️ Не удалось получить заказы при удалении пользователя {user_id}: {resp_orders.status_code}")
-            else:
-                orders = resp_orders.json()
-                # Берём только заказы этого пользователя
-                user_orders_ids = [o["id"] for o in orders if o["user_id"] == user_id]
-
-                if user_orders_ids:
-                    # Получаем все доставки
-                    resp_deliveries = await client.get(DELIVERIES_SERVICE_URL, timeout=TIMEOUT)
-                    if resp_deliveries.status_code == 200:
-                        deliveries = resp_deliveries.json()
-                        active_statuses = ["processing", "shipped", "in_transit"]
-
-                        active = [
-                            d for d in deliveries
-                            if d["order_id"] in user_orders_ids and d["status"] in active_statuses
-                        ]
-
-                        if active:
-                            from fastapi import HTTPException
-                            raise HTTPException(
-                                status_code=400,
-                                detail="Нельзя удалить пользователя: есть активные доставки по его заказам."
-                            )
-                    else:
-                        print(f"⚠️ Не удалось получить доставки при удалении пользователя {user_id}: {resp_deliveries.status_code}")
-
-        except httpx.RequestError as e:
-            from fastapi import HTTPException
-            # Если Delivery Service недоступен — лучше не удалять пользователя,
-            # чтобы не потерять связь с активными доставками.
-            raise HTTPException(
-                status_code=503,
-                detail=f"Delivery Service недоступен при проверке активных доставок: {e}"
+# --- НОВОЕ: каскадное удаление пользователя (фоновая задача) ---
+
+TIMEOUT = 5.0
+# Опрос задачи Orders Service: от 0.2 с с удвоением до 2 с
+ORDERS_JOB_POLL_MIN, ORDERS_JOB_POLL_MAX = 0.2, 2.0
+# Страница проверки активных доставок: id заказов на один запрос к Delivery (у него max_length=1000)
+ACTIVE_CHECK_PAGE = 500
+ACTIVE_DELIVERY_STATUSES = ("processing", "shipped", "in_transit")
+
+
+async def _user_order_ids(client: httpx.AsyncClient, user_id: int):
+    """id заказов пользователя страницами по ACTIVE_CHECK_PAGE (keyset по id, фильтр user_id в Orders)."""
+    after_id = 0
+    while True:
+        resp = await client.get(
+            f"{ORDERS_SERVICE_URL}/", timeout=TIMEOUT,
+            params={"user_id": user_id, "after_id": after_id, "limit": ACTIVE_CHECK_PAGE},
+        )
+        if resp.status_code != 200:
+            raise HTTPException(status_code=503, detail=f"Не удалось получить заказы пользователя {user_id}: {resp.status_code}")
+        ids = [o["id"] for o in resp.json()]
+        if ids:
+            yield ids
+        if len(ids) < ACTIVE_CHECK_PAGE:
+            return
+        after_id = ids[-1]
+
+
+async def ensure_no_active_deliveries(client: httpx.AsyncClient, user_id: int):
+    """400, если по заказам пользователя есть активные доставки; 503, если сервисы недоступны."""
+    try:
+        async for order_ids in _user_order_ids(client, user_id):
+            # На заказ не больше одной живой доставки (uq_deliveries_order_id_live): limit = размер страницы
+            resp = await client.get(
+                DELIVERIES_SERVICE_URL, timeout=TIMEOUT,
+                params={"order_id": order_ids, "limit": len(order_ids)},
             )
-
-    # 1. Вызываем Orders Service (как раньше)
-    async with httpx.AsyncClient() as client:
-        try:
-            url = f"{ORDERS_SERVICE_URL}/by-user/{user_id}"
-            resp = await client.delete(url, timeout=TIMEOUT)
-            if resp.status_code not in (200, 204):
-                print(f"⚠️ Не удалось удалить заказы пользователя {user_id}: {resp.status_code} {resp.text}")
-        except httpx.RequestError as e:
-            from fastapi import HTTPException
+            if resp.status_code != 200:
+                raise HTTPException(
+                    status_code=503, detail=f"Не удалось получить доставки пользователя {user_id}: {resp.status_code}",
+                )
+            if any(d["status"] in ACTIVE_DELIVERY_STATUSES for d in resp.json()):
+                raise HTTPException(
+                    status_code=400,
+                    detail="Нельзя удалить пользователя: есть активные доставки по его заказам."
+                )
+
+    except httpx.RequestError as e:
+        # Если Delivery Service недоступен — лучше не удалять пользователя,
+        # чтобы не потерять связь с активными доставками.
+        raise HTTPException(
+            status_code=503,
+            detail=f"Delivery Service недоступен при проверке активных доставок: {e}"
+        )
+
+
+async def _delete_orders_of_user(client: httpx.AsyncClient, job):
+    """Запускает каскад заказов в Orders Service (202 + задача) и ждёт его, перенося прогресс в свою задачу."""
+    user_id = job.subject_id
+    try:
+        # Orders не создаёт вторую задачу, пока идёт первая — повтор после рестарта безопасен
+        resp = await client.delete(
+            f"{ORDERS_SERVICE_URL}/by-user/{user_id}", params={"batch_size": job.batch_size}, timeout=TIMEOUT,
+        )
+        if resp.status_code != 202:
             raise HTTPException(
-                status_code=503,
-                detail=f"Orders Service недоступен при удалении пользователя {user_id}: {e}"
+                status_code=502,
+                detail=f"Не удалось запустить удаление заказов пользователя {user_id}: {resp.status_code} {resp.text}",
             )
-
-    # 2. Удаляем пользователя локально
-    stmt = delete(User).where(User.id == user_id).returning(User.id)
-    deleted_id = db.scalar(stmt)
-    if deleted_id is None:
-        db.rollback()
-        return False
-
-    db.commit()
-    print(f"✅ Каскадно удалён пользователь {user_id} и его заказы/платежи/доставки")
-    return True
+        orders_job = resp.json()
+        await job.checkpoint(orders_job_id=orders_job["id"])
+
+        delay = ORDERS_JOB_POLL_MIN
+        while orders_job["status"] not in ("completed", "failed"):
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, ORDERS_JOB_POLL_MAX)
+            resp = await client.get(f"{ORDERS_SERVICE_URL}/jobs/{orders_job['id']}", timeout=TIMEOUT)
+            if resp.status_code != 200:
+                raise HTTPException(status_code=502, detail=f"Статус удаления заказов недоступен: {resp.status_code}")
+            orders_job = resp.json()
+            # Заодно heartbeat: пока ждём Orders, задачу не сочтут брошенной
+            await job.checkpoint(processed=orders_job["processed"], total=orders_job["total"])
+    except httpx.RequestError as e:
+        raise HTTPException(
+            status_code=503,
+            detail=f"Orders Service недоступен при удалении пользователя {user_id}: {e}"
+        )
+
+    if orders_job["status"] == "failed":
+        raise HTTPException(status_code=502, detail=f"Удаление заказов не удалось: {orders_job['error']}")
+
+
+async def cascade_delete_user_job(job) -> None:
+    """
+    Каскадное удаление пользователя (фоновая задача, фаза сохраняется в job.state):
+    0. check  — нет ли активных доставок по его заказам
+    1. orders — Orders Service удаляет все его заказы пачками (которые удалят payments+delivery)
+    2. user   — удаляем самого пользователя
+    """
+    client = get_http_client()
+    phase = job.state.get("phase", "check")
+
+    if phase == "check":
+        await ensure_no_active_deliveries(client, job.subject_id)
+        phase = "orders"
+        await job.checkpoint(phase=phase)
+
+    if phase == "orders":
+        await _delete_orders_of_user(client, job)
+        phase = "user"
+        await job.checkpoint(phase=phase)
+
+    with SessionLocal() as db:
+        if _delete_user_only(db, job.subject_id):
+            logger.info("Каскадно удалён пользователь %s и его заказы/платежи/доставки", job.subject_id)
@@ -1,10 +1,15 @@
+import logging
 from sqlalchemy.orm import Session
+from app.core.jobs import jobs_metadata
 from app.db.database import Base, engine
 from app.models.user import User
 
+logger = logging.getLogger(__name__)
+
 def init_db():
     # 1. Создание всех таблиц
     Base.metadata.create_all(bind=engine)
+    jobs_metadata.create_all(bind=engine)
     
     # 2. Заполнение тестовыми данными
     db: Session = Session(bind=engine)
@@ -49,11 +54,11 @@ def init_db():
                 db.add(db_user)
             
             db.commit()
-            print("База данных пользователей проинициализирована 5 тестовыми записями.")
+            logger.info("База данных пользователей проинициализирована 5 тестовыми записями.")
         else:
-            print("База данных уже содержит данные, пропуск инициализации.")
+            logger.info("База данных уже содержит данные, пропуск инициализации.")
     
     except Exception as e:
-        print(f"Ошибка инициализации БД: {e}")
+        logger.exception("Ошибка инициализации БД: %s", e)
     finally:
         db.close()
@@ -1,13 +1,70 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from app.api.v1 import endpoints
+from app.core.admission import ADMISSION_ENABLED, AdmissionMiddleware
+from app.core.jobs import configure_jobs, job_worker, jobs_router, stop_jobs
+from app.core.logging_setup import RequestIdMiddleware, setup_logging
+from app.core.metrics import MetricsMiddleware, instrument_engine, metrics_router
+from app.core.profiling import PROFILING_ENABLED, ProfilingMiddleware, profiling_router
+from app.core.sql_stats import SqlStatsMiddleware, instrument_engine_sql_stats
+from app.core.startup import probes_router, run_shutdown, run_startup
+from app.core.tombstones import tombstone_purger
+from app.core.tracing import TracingMiddleware, configure_tracing, instrument_engine_tracing
+from app.crud.users import ORDERS_SERVICE_URL, cascade_delete_user_job
+from app.db.database import engine
+from app.db.init_db import init_db
+from app.models.user import User
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await run_startup(
+        engine, init_db, lock_name="users_service.init_db",
+        dependency_urls=[ORDERS_SERVICE_URL],
+    )
+    worker = asyncio.create_task(job_worker())
+    # Физическое удаление помеченных строк — пачками, в окно PURGE_WINDOW
+    tombstones = asyncio.create_task(tombstone_purger(engine, [User.__table__]))
+    yield
+    tombstones.cancel()
+    worker.cancel()
+    await stop_jobs()
+    await run_shutdown(engine)
+
 
 app = FastAPI(
     title="Users Microservice",
     docs_url="/docs",
     openapi_url="/openapi.json",
-    root_path="/api/v1/users"
+    root_path="/api/v1/users",
+    lifespan=lifespan,
 )
 
+setup_logging("users_service")
+configure_tracing("users_service")
+instrument_engine(engine)
+instrument_engine_tracing(engine)
+instrument_engine_sql_stats(engine)
+configure_jobs(engine, {"cascade_delete_user": cascade_delete_user_job})
+if PROFILING_ENABLED:
+    # Без PROFILING_TOKEN профилирование не подключается вовсе
+    app.add_middleware(ProfilingMiddleware)
+app.add_middleware(SqlStatsMiddleware)
+if ADMISSION_ENABLED:
+    # Снаружи профилирования и SQL: отклонённый запрос не доходит до БД, но попадает в метрики и логи
+    app.add_middleware(AdmissionMiddleware)
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(TracingMiddleware)
+app.add_middleware(RequestIdMiddleware)
+
+# Служебные роуты подключаем раньше /{id} из endpoints, иначе он их перехватит
+app.include_router(probes_router)
+app.include_router(metrics_router)
+app.include_router(jobs_router)
+if PROFILING_ENABLED:
+    app.include_router(profiling_router)
 app.include_router(endpoints.router, prefix="", tags=["users"])
 
 @app.get("/")
@@ -1,11 +1,17 @@
 from sqlalchemy import Column, Integer, String, Boolean
+from app.core.tombstones import SoftDeleteMixin, live_index, tombstone_index
 from app.db.database import Base
 
-class User(Base):
+class User(SoftDeleteMixin, Base):
     __tablename__ = "users"
+    __table_args__ = (
+        # Email уникален среди живых пользователей: удалённый не мешает зарегистрироваться снова
+        live_index("uq_users_email_live", "email", unique=True),
+        tombstone_index("users"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     full_name = Column(String, index=True)
-    email = Column(String, unique=True, index=True)
+    email = Column(String)
     hashed_password = Column(String)
     is_active = Column(Boolean, default=True)
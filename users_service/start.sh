@@ -1,7 +1,13 @@
 #!/bin/bash
 
-sleep 10
+# Ожидание БД, init_db и прогрев выполняются в lifespan приложения (app/core/startup.py)
 
-python -c "from app.db.init_db import init_db; init_db()"
+# SERVE_MODE=multi — production-профиль: воркеры по числу CPU, uvloop + httptools
+if [ "${SERVE_MODE:-single}" = "multi" ]; then
+    # Метрики воркеров агрегируются через файлы (prometheus_client multiprocess mode)
+    export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus}
+    rm -rf "$PROMETHEUS_MULTIPROC_DIR" && mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+    exec gunicorn app.main:app -c python:app.core.gunicorn_conf --bind 0.0.0.0:8000
+fi
 
-exec uvicorn app.main:app --host 0.0.0.0 --port 8000
\ No newline at end of file
+exec uvicorn app.main:app --host 0.0.0.0 --port 8000 --loop asyncio --http h11 --timeout-keep-alive 75